@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_fundamental_parser.py
+# مقایسه سرعت پارسر lxml/XPath صفحه بنیادی TSETMC با پیاده‌سازی قبلی BeautifulSoup روی فایل‌های HTML ذخیره‌شده.
+#
+# اجرا (از ریشه پروژه):
+#     python benchmarks/bench_fundamental_parser.py
+#     python benchmarks/bench_fundamental_parser.py --fixtures response_cache --repeat 50
+#
+# با --fixtures می‌توان پوشه‌ای از صفحات واقعی (مثلاً فایل‌های *.body در RESPONSE_CACHE_DIR) را داد.
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+from services.data_fetch_and_process import _parse_fundamental_html
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _parse_fundamental_html_bs4(html_content):
+    """
+    Original BeautifulSoup implementation of _parse_fundamental_html, kept here as the
+    reference for the timing and parity checks.
+    """
+    soup = BeautifulSoup(html_content, 'lxml')
+
+    data = {}
+    
+    # --- Parsing the "اثرات مالی" (Financial effects) table ---
+    financial_table_div = soup.find('div', id='MainContent_C2P')
+    if financial_table_div:
+        table = financial_table_div.find('table')
+        if table:
+            rows = table.find_all('tr')
+            for row in rows:
+                cols = row.find_all(['td', 'th'])
+                cols = [ele.text.strip() for ele in cols]
+                
+                # The table has multiple rows with different data
+                # Let's map based on the label in the first column
+                if 'سود هر سهم' in cols[0]:
+                    try:
+                        # EPS is in the 2nd column
+                        data['eps'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['eps'] = None
+                elif 'P/E گروه' in cols[0]:
+                    try:
+                        data['pe_group'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['pe_group'] = None
+                elif 'P/E' in cols[0]:
+                    try:
+                        data['pe_ratio'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['pe_ratio'] = None
+                elif 'نسبت P/B' in cols[0]:
+                    try:
+                        data['pb_ratio'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['pb_ratio'] = None
+                elif 'نسبت P/S' in cols[0]:
+                    try:
+                        data['ps_ratio'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['ps_ratio'] = None
+                elif 'حجم مبنا' in cols[0]:
+                    try:
+                        # حجم مبنا is an integer, but sometimes has commas
+                        data['base_volume'] = int(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['base_volume'] = None
+
+    # --- Parsing the "مشخصات" (Specifications) and other divs ---
+    # These are usually in `div`s with specific `id`s. We can iterate and find them.
+    specs_div = soup.find('div', id='MainContent_C1P')
+    if specs_div:
+        table = specs_div.find('table')
+        if table:
+            rows = table.find_all('tr')
+            for row in rows:
+                cols = row.find_all(['td', 'th'])
+                cols = [ele.text.strip() for ele in cols]
+
+                if 'قیمت پایانی' in cols[0]:
+                    try:
+                        data['closing_price'] = float(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['closing_price'] = None
+                elif 'تعداد سهام' in cols[0]:
+                    try:
+                        data['total_shares'] = int(cols[1].replace(',', ''))
+                    except (ValueError, IndexError):
+                        data['total_shares'] = None
+
+    # --- Parsing data from the main header area (usually has a table or spans) ---
+    main_header_table = soup.find('table', class_='InfoTbl')
+    if main_header_table:
+        # Finding the market value (ارزش بازار)
+        market_value_row = main_header_table.find('tr', string=lambda text: 'ارزش بازار' in text)
+        if market_value_row:
+            try:
+                market_value_td = market_value_row.find_next_sibling('td')
+                if market_value_td:
+                    data['market_value'] = int(market_value_td.text.strip().replace(',', ''))
+            except (ValueError, IndexError, AttributeError):
+                data['market_value'] = None
+    
+    # We can also parse from the JavaScript data at the top of the page.
+    # This is a more robust approach for real-time data.
+    # Let's find the `t111C1411_t1` object from script tags.
+    script_tag = soup.find('script', text=lambda text: 't111C1411_t1=' in text)
+    if script_tag:
+        js_code = script_tag.string
+        # A simple regex to extract JSON-like data. Not perfect, but can work.
+        import re
+        match = re.search(r'var t111C1411_t1=(.+?);', js_code)
+        if match:
+            js_data = match.group(1)
+            # This is a raw JavaScript object. It needs careful parsing.
+            # A simple and fragile way is to use eval, but that's a security risk.
+            # A safer way is to replace single quotes with double quotes and parse it.
+            # We'll skip this for now as it's complex and the HTML parsing is sufficient.
+    
+    return data
+
+
+def _load_fixtures(fixtures_dir):
+    paths = sorted(glob.glob(os.path.join(fixtures_dir, '*.html')) + glob.glob(os.path.join(fixtures_dir, '*.body')))
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def _time_parser(parser, pages, repeat):
+    """Best-of-3 seconds per page for parsing every page `repeat` times."""
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for _, content in pages:
+                parser(content)
+        best = min(best, time.perf_counter() - start)
+    return best / (repeat * len(pages))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark fundamental page parsers.')
+    arg_parser.add_argument('--fixtures', default=DEFAULT_FIXTURES_DIR, help='Directory of saved .html/.body pages.')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='Parses of each page per timing run.')
+    args = arg_parser.parse_args()
+
+    pages = _load_fixtures(args.fixtures)
+    if not pages:
+        print(f"No fixtures found in {args.fixtures}.")
+        return 1
+
+    mismatches = 0
+    for name, content in pages:
+        expected, actual = _parse_fundamental_html_bs4(content), _parse_fundamental_html(content)
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH {name}:\n  bs4:  {expected}\n  lxml: {actual}")
+
+    bs4_time = _time_parser(_parse_fundamental_html_bs4, pages, args.repeat)
+    lxml_time = _time_parser(_parse_fundamental_html, pages, args.repeat)
+    total_bytes = sum(len(content) for _, content in pages)
+
+    print(f"{len(pages)} page(s), {total_bytes / len(pages) / 1024:.1f} KiB average, {mismatches} result mismatch(es)")
+    print(f"BeautifulSoup: {bs4_time * 1000:8.3f} ms/page")
+    print(f"lxml XPath:    {lxml_time * 1000:8.3f} ms/page  ({bs4_time / lxml_time:.1f}x faster)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
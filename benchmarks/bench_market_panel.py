@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_market_panel.py
+# مقایسه حافظه و زمان بارگذاری کل stock_data به روش قبلی train_model (SELECT * در DataFrame با ستون‌های
+# float64/object) با پنل فشرده services/market_panel.py (float32/int64، نماد و تاریخ به صورت کد عددی).
+#
+# اجرا (از ریشه پروژه):
+#     python benchmarks/bench_market_panel.py
+#     python benchmarks/bench_market_panel.py --db sqlite:////path/to/app.db
+#
+# «اندازه» حافظه‌ای است که نتیجه نگه می‌دارد (memory_usage(deep=True) یا nbytes) و «اوج» بیشترین حافظه
+# تخصیص‌یافته در حین بارگذاری است (tracemalloc)؛ محدودیت 2G کانتینر در docker-compose.yml با اوج سنجیده می‌شود.
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from models import HistoricalData
+from services.market_panel import DEFAULT_PANEL_COLUMNS, load_market_panel
+
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.db')}"
+
+NON_VALUE_COLUMNS = ('symbol_id', 'symbol_name', 'date', 'jdate')
+
+
+def _load_select_all(engine, chunksize):
+    """The previous train_model loader: SELECT * in chunks, concatenated, numeric columns coerced."""
+    chunks = list(pd.read_sql_query("SELECT * FROM stock_data ORDER BY symbol_id, date", engine, chunksize=chunksize))
+    frame = pd.concat(chunks, ignore_index=True)
+    del chunks
+    frame['gregorian_date'] = pd.to_datetime(frame['date'])
+    for column in frame.columns:
+        if column not in NON_VALUE_COLUMNS and column != 'gregorian_date':
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    return frame, frame.memory_usage(deep=True).sum()
+
+
+def _load_panel(engine, columns, chunksize):
+    panel = load_market_panel(engine, columns, chunksize=chunksize)
+    return panel, panel.nbytes
+
+
+def _measure(loader, *args):
+    """(rows, bytes held by the result, peak bytes allocated while loading, seconds). Timed in a separate
+    run without tracemalloc, which slows allocations down."""
+    start = time.perf_counter()
+    result, held = loader(*args)
+    seconds = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result, held = loader(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(result), held, peak, seconds
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the memory of the compact market panel.')
+    arg_parser.add_argument('--db', default=DEFAULT_DATABASE_URL, help='SQLAlchemy URL of the database.')
+    arg_parser.add_argument('--chunksize', type=int, default=50000, help='Rows fetched per chunk.')
+    args = arg_parser.parse_args()
+
+    engine = create_engine(args.db)
+    all_columns = [column.name for column in HistoricalData.__table__.columns if column.name not in NON_VALUE_COLUMNS]
+
+    runs = [
+        ('SELECT * DataFrame', _load_select_all, engine, args.chunksize),
+        ('MarketPanel, all columns', _load_panel, engine, all_columns, args.chunksize),
+        ('MarketPanel, OHLCV', _load_panel, engine, DEFAULT_PANEL_COLUMNS, args.chunksize),
+    ]
+    baseline = None
+    print(f"{'loader':32} {'rows':>9} {'held MiB':>9} {'peak MiB':>9} {'seconds':>8}")
+    for name, loader, *loader_args in runs:
+        rows, held, peak, seconds = _measure(loader, *loader_args)
+        baseline = baseline or (held, peak)
+        print(f"{name:32} {rows:9d} {held / 2 ** 20:9.1f} {peak / 2 ** 20:9.1f} {seconds:8.2f}"
+              f"  ({baseline[0] / held:.1f}x smaller held, {baseline[1] / peak:.1f}x smaller peak)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -51,6 +51,44 @@ class Config:
    # کلید API MetalsDev برای دریافت قیمت کالاها
     METALS_DEV_API_KEY = os.environ.get('METALS_DEV_API_KEY', 'USXIBBPXNPFOPKR6BQ5N671R6BQ5N')
 
+    # تنظیمات همزمانی پایپ‌لاین به‌روزرسانی کامل داده‌ها (run_full_data_update)
+    # FETCH: تعداد نخ‌های دریافت از شبکه، COMPUTE: تعداد پردازه‌های محاسبه اندیکاتور (۱ یعنی بدون پردازه جداگانه)
+    # WRITE_BATCH_SIZE: تعداد نمادهایی که در یک commit به پایگاه داده نوشته می‌شوند
+    DATA_UPDATE_FETCH_WORKERS = int(os.environ.get('DATA_UPDATE_FETCH_WORKERS', 8))
+    DATA_UPDATE_COMPUTE_WORKERS = int(os.environ.get('DATA_UPDATE_COMPUTE_WORKERS', 2))
+    DATA_UPDATE_WRITE_BATCH_SIZE = int(os.environ.get('DATA_UPDATE_WRITE_BATCH_SIZE', 50))
+
+    # پوشه ذخیره ستونی قیمت‌ها (services/price_store.py)
+    PRICE_STORE_DIR = os.environ.get('PRICE_STORE_DIR') or os.path.join(
+        os.path.abspath(os.path.dirname(__file__)), 'price_store')
+
+    # کش دیسکی صفحات HTML دریافتی از TSETMC (services/response_cache.py)
+    RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR') or os.path.join(
+        os.path.abspath(os.path.dirname(__file__)), 'response_cache')
+
+    # اگر فعال باشد، اندیکاتورهای تکنیکال در به‌روزرسانی شبانه با وضعیت ذخیره‌شده هر نماد و فقط با بارهای جدید
+    # به‌روز می‌شوند (services/indicator_state.py) و دیگر برای هر نماد از ابتدای تاریخچه محاسبه نمی‌شوند
+    INDICATOR_INCREMENTAL_UPDATE = os.environ.get('INDICATOR_INCREMENTAL_UPDATE', 'true').lower() in ('1', 'true', 'yes')
+
+    # کش مشترک اندیکاتورها (services/indicator_cache.py): حداکثر تعداد نتایج در حافظه (LRU) و پوشه اختیاری
+    # برای ذخیره روی دیسک تا پردازه‌های محاسبه و اسکرینرها نتایج یکدیگر را استفاده کنند (خالی یعنی فقط حافظه)
+    INDICATOR_CACHE_SIZE = int(os.environ.get('INDICATOR_CACHE_SIZE', 4096))
+    INDICATOR_CACHE_DIR = os.environ.get('INDICATOR_CACHE_DIR', '')
+
+    # اعتبارسنجی کیفیت داده‌ها پس از به‌روزرسانی شبانه (services/data_quality.py)
+    # LOOKBACK_DAYS: بازه بررسی (روز تقویمی)، MAX_GAP_DAYS: حداکثر روز معاملاتی بدون بار پیش از هشدار شکاف،
+    # STALE_DAYS: حداکثر عقب‌ماندگی آخرین بار نماد از بازار (روز معاملاتی) پیش از قرنطینه
+    DATA_QUALITY_LOOKBACK_DAYS = int(os.environ.get('DATA_QUALITY_LOOKBACK_DAYS', 120))
+    DATA_QUALITY_MAX_GAP_DAYS = int(os.environ.get('DATA_QUALITY_MAX_GAP_DAYS', 5))
+    DATA_QUALITY_STALE_DAYS = int(os.environ.get('DATA_QUALITY_STALE_DAYS', 10))
+
+    # اسکن شبانه الگوهای شمعی کل بازار (services/candlestick_scanner.py): بازه روزهای تقویمی که بازنویسی می‌شود
+    CANDLESTICK_SCAN_LOOKBACK_DAYS = int(os.environ.get('CANDLESTICK_SCAN_LOOKBACK_DAYS', 30))
+
+    # کش محلی نوع بازار نمادها (symbol_id -> flow و market_type) برای populate_all_symbols_initial
+    MARKET_TYPE_CACHE_FILE = os.environ.get('MARKET_TYPE_CACHE_FILE') or os.path.join(
+        os.path.abspath(os.path.dirname(__file__)), 'market_type_cache.json')
+
 
 # --- تنظیمات پایگاه داده ---
     SQLALCHEMY_DATABASE_URI = os.environ.get(
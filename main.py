@@ -185,6 +185,76 @@ def create_app(test_config=None):
             else:
                 click.echo(f"خطا: {message}")
 
+    @app.cli.command('import-tickers-data')
+    @click.option('--data-dir', default=None, help='مسیر پوشه CSVها (پیش‌فرض: tickers_data در ریشه پروژه).')
+    @click.option('--workers', default=None, type=int, help='تعداد پردازه‌های خواندن CSV (پیش‌فرض: تعداد هسته‌ها).')
+    @click.option('--raw', is_flag=True, help='استفاده از فایل‌های تعدیل‌نشده به جای نسخه «-ت».')
+    @click.option('--overwrite', is_flag=True, help='بازنویسی ردیف‌های موجود در stock_data.')
+    def import_tickers_data_command(data_dir, workers, raw, overwrite):
+        """بارگذاری اولیه داده‌های تاریخی از آرشیو tickers_data بدون نیاز به شبکه."""
+        from services.tickers_archive_importer import import_tickers_archive
+
+        with app.app_context():
+            rows_written, message = import_tickers_archive(
+                data_dir=data_dir,
+                workers=workers,
+                prefer_adjusted=not raw,
+                overwrite=overwrite
+            )
+            click.echo(message)
+
+    @app.cli.command('rebuild-price-store')
+    @click.option('--compact', is_flag=True, help='پس از بارگذاری، فایل‌ها مرتب و بدون ردیف تکراری بازنویسی شوند.')
+    def rebuild_price_store_command(compact):
+        """پر کردن ذخیره ستونی قیمت‌ها (price_store) از جدول stock_data."""
+        from services.price_store import rebuild_price_store_from_db, get_price_store
+
+        with app.app_context():
+            appended = rebuild_price_store_from_db()
+            click.echo(f"{appended} ردیف به price_store اضافه شد.")
+            if compact:
+                rows = get_price_store().compact()
+                click.echo(f"price_store فشرده شد: {rows} ردیف.")
+
+    @app.cli.command('advance-indicators')
+    def advance_indicators_command():
+        """به‌روزرسانی افزایشی اندیکاتورهای تکنیکال همه نمادها با بارهای جدید (indicator_states)."""
+        from services.indicator_state import run_incremental_indicator_update
+
+        with app.app_context():
+            written, message = run_incremental_indicator_update()
+            click.echo(message)
+
+    @app.cli.command('update-smart-money')
+    def update_smart_money_command():
+        """محاسبه و ذخیره جریان پول حقیقی/حقوقی بارهای جدید همه نمادها (smart_money_flow_data)."""
+        from services.smart_money_flow import run_smart_money_flow_update
+
+        with app.app_context():
+            written, message = run_smart_money_flow_update()
+            click.echo(message)
+
+    @app.cli.command('scan-candlesticks')
+    @click.option('--days', default=None, type=int, help='بازه اسکن به روز تقویمی (پیش‌فرض: CANDLESTICK_SCAN_LOOKBACK_DAYS).')
+    @click.option('--full', is_flag=True, help='اسکن کل تاریخچه همه نمادها.')
+    def scan_candlesticks_command(days, full):
+        """اسکن الگوهای شمعی همه نمادها و ذخیره در candlestick_pattern_detection."""
+        from services.candlestick_scanner import run_candlestick_pattern_scan
+
+        with app.app_context():
+            written, message = run_candlestick_pattern_scan(lookback_days=days, full_history=full)
+            click.echo(message)
+
+    @app.cli.command('resample-bars')
+    @click.option('--full', is_flag=True, help='حذف و ساخت دوباره همه کندل‌ها (مثلاً بعد از اصلاح داده‌های تاریخی).')
+    def resample_bars_command(full):
+        """ساخت کندل‌های هفتگی و ماهانه (تقویم جلالی) همه نمادها در resampled_bars."""
+        from services.bar_resampler import run_bar_resampling
+
+        with app.app_context():
+            written, message = run_bar_resampling(full_rebuild=full)
+            click.echo(message)
+
     return app
 
 # --- اضافه کردن کد برای اجرای خودکار سرور پراکسی در زمان اجرای برنامه اصلی ---
@@ -0,0 +1,42 @@
+"""Add data_quality_flags
+
+Revision ID: 41f03704d2fb
+Revises: 7f645b6fd88f
+Create Date: 2026-10-17 11:04:27.652913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '41f03704d2fb'
+down_revision: Union[str, Sequence[str], None] = '7f645b6fd88f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('data_quality_flags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('symbol_id', sa.String(length=50), nullable=False),
+    sa.Column('check_name', sa.String(length=30), nullable=False),
+    sa.Column('severity', sa.String(length=10), nullable=False),
+    sa.Column('bad_bars', sa.Integer(), nullable=False),
+    sa.Column('first_bad_date', sa.Date(), nullable=True),
+    sa.Column('last_bad_date', sa.Date(), nullable=True),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.Column('detected_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('symbol_id', 'check_name', name='_symbol_check_quality_uc')
+    )
+    op.create_index(op.f('ix_data_quality_flags_symbol_id'), 'data_quality_flags', ['symbol_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_data_quality_flags_symbol_id'), table_name='data_quality_flags')
+    op.drop_table('data_quality_flags')
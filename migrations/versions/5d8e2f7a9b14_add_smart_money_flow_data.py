@@ -0,0 +1,44 @@
+"""Add smart_money_flow_data
+
+Revision ID: 5d8e2f7a9b14
+Revises: c3a9e51b7d20
+Create Date: 2026-10-17 15:02:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8e2f7a9b14'
+down_revision: Union[str, Sequence[str], None] = 'c3a9e51b7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('smart_money_flow_data',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('symbol_id', sa.String(length=50), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('jdate', sa.String(length=10), nullable=False),
+    sa.Column('individual_buy_power', sa.Float(), nullable=True),
+    sa.Column('individual_net_flow', sa.Float(), nullable=True),
+    sa.Column('individual_buy_per_trade', sa.Float(), nullable=True),
+    sa.Column('individual_sell_per_trade', sa.Float(), nullable=True),
+    sa.Column('legal_net_flow', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['symbol_id'], ['comprehensive_symbol_data.symbol_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('symbol_id', 'jdate', name='_symbol_jdate_smart_money_uc')
+    )
+    op.create_index('ix_smart_money_flow_data_symbol_date', 'smart_money_flow_data', ['symbol_id', 'date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_smart_money_flow_data_symbol_date', table_name='smart_money_flow_data')
+    op.drop_table('smart_money_flow_data')
@@ -0,0 +1,39 @@
+"""Add ingestion_checkpoints
+
+Revision ID: 7f645b6fd88f
+Revises: 2993f4428236
+Create Date: 2026-10-17 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f645b6fd88f'
+down_revision: Union[str, Sequence[str], None] = '2993f4428236'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ingestion_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('symbol_id', sa.String(length=50), nullable=False),
+    sa.Column('stage', sa.String(length=20), nullable=False),
+    sa.Column('run_date', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('last_data_date', sa.Date(), nullable=True),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('symbol_id', 'stage', name='_symbol_stage_checkpoint_uc')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('ingestion_checkpoints')
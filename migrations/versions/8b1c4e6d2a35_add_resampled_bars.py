@@ -0,0 +1,53 @@
+"""Add resampled_bars
+
+Revision ID: 8b1c4e6d2a35
+Revises: 5d8e2f7a9b14
+Create Date: 2026-10-17 18:24:09.552381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1c4e6d2a35'
+down_revision: Union[str, Sequence[str], None] = '5d8e2f7a9b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('resampled_bars',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('symbol_id', sa.String(length=50), nullable=False),
+    sa.Column('timeframe', sa.String(length=10), nullable=False),
+    sa.Column('period_jdate', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('first_date', sa.Date(), nullable=False),
+    sa.Column('last_date', sa.Date(), nullable=False),
+    sa.Column('last_jdate', sa.String(length=10), nullable=False),
+    sa.Column('open', sa.Float(), nullable=True),
+    sa.Column('high', sa.Float(), nullable=True),
+    sa.Column('low', sa.Float(), nullable=True),
+    sa.Column('close', sa.Float(), nullable=True),
+    sa.Column('volume', sa.BigInteger(), nullable=True),
+    sa.Column('value', sa.BigInteger(), nullable=True),
+    sa.Column('num_trades', sa.Integer(), nullable=True),
+    sa.Column('bar_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['symbol_id'], ['comprehensive_symbol_data.symbol_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('symbol_id', 'timeframe', 'period_jdate', name='_symbol_timeframe_period_uc')
+    )
+    op.create_index('ix_resampled_bars_timeframe_period_start', 'resampled_bars', ['timeframe', 'period_start'], unique=False)
+    op.create_index('ix_resampled_bars_symbol_timeframe_start', 'resampled_bars', ['symbol_id', 'timeframe', 'period_start'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_resampled_bars_symbol_timeframe_start', table_name='resampled_bars')
+    op.drop_index('ix_resampled_bars_timeframe_period_start', table_name='resampled_bars')
+    op.drop_table('resampled_bars')
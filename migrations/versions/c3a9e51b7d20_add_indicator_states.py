@@ -0,0 +1,50 @@
+"""Add indicator_states
+
+Revision ID: c3a9e51b7d20
+Revises: 41f03704d2fb
+Create Date: 2026-10-17 13:26:08.904517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a9e51b7d20'
+down_revision: Union[str, Sequence[str], None] = '41f03704d2fb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('indicator_states',
+    sa.Column('symbol_id', sa.String(length=50), nullable=False),
+    sa.Column('last_date', sa.Date(), nullable=False),
+    sa.Column('last_jdate', sa.String(length=10), nullable=False),
+    sa.Column('bar_count', sa.Integer(), nullable=False),
+    sa.Column('volume_count', sa.Integer(), nullable=False),
+    sa.Column('last_close', sa.Float(), nullable=True),
+    sa.Column('last_high', sa.Float(), nullable=True),
+    sa.Column('last_low', sa.Float(), nullable=True),
+    sa.Column('ema_gain', sa.Float(), nullable=True),
+    sa.Column('ema_loss', sa.Float(), nullable=True),
+    sa.Column('ema_fast', sa.Float(), nullable=True),
+    sa.Column('ema_slow', sa.Float(), nullable=True),
+    sa.Column('ema_signal', sa.Float(), nullable=True),
+    sa.Column('atr', sa.Float(), nullable=True),
+    sa.Column('sum_close_20', sa.Float(), nullable=True),
+    sa.Column('sum_close_50', sa.Float(), nullable=True),
+    sa.Column('sum_volume_20', sa.Float(), nullable=True),
+    sa.Column('close_window', sa.Text(), nullable=True),
+    sa.Column('volume_window', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('symbol_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('indicator_states')
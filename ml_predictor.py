@@ -20,6 +20,8 @@ logger = logging.getLogger(__name__)
 try:
     # این ایمپورت به ساختار 'backend/services/utils.py' اشاره می‌کند
     from services.utils import calculate_rsi, calculate_macd, calculate_sma, calculate_volume_ma, calculate_atr
+    from services.indicator_registry import compute_indicators, history_bars
+    from services.jalali_calendar import gregorian_to_jalali
 except ImportError as e:
     logger.error(f"خطا: توابع کمکی از utils.py ایمپورت نشدند. {e}")
     logger.error("لطفا مطمئن شوید utils.py وجود دارد و شامل این توابع است.")
@@ -84,7 +86,13 @@ except Exception as e:
     logger.error(f"خطا در بارگذاری مدل ML یا فایل‌های مرتبط: {e}", exc_info=True)
     raise RuntimeError(f"خطا در بارگذاری مدل ML: {e}")
 
+# --- اندیکاتورهای ویژگی‌ها (services/indicator_registry) و تعداد بار تاریخی لازم برای پیش‌بینی ---
+# Stochastic (۱۴+۳ بار) و تغییرات ۵ روزه کوتاه‌ترند؛ OBV تجمعی است و نسبت به ابتدای همین پنجره محاسبه می‌شود.
+ML_INDICATORS = ['RSI', 'MACD', 'SMA_20', 'SMA_50', 'Volume_MA_5', 'ATR']
+ML_HISTORY_BARS = history_bars(ML_INDICATORS)
+
 # --- تابع مهندسی ویژگی برای داده‌های جدید (باید با train_model.py یکسان باشد) ---
+
 def _perform_feature_engineering_for_prediction(df_symbol_hist, symbol_id_for_logging="N/A"):
     """
     انجام مهندسی ویژگی بر روی داده‌های تاریخی یک نماد برای پیش‌بینی.
@@ -93,15 +101,16 @@ def _perform_feature_engineering_for_prediction(df_symbol_hist, symbol_id_for_lo
     # اطمینان از مرتب بودن داده‌ها بر اساس تاریخ و ایجاد کپی صریح
     df_processed = df_symbol_hist.sort_values(by='gregorian_date').set_index('gregorian_date').copy()
 
-    # --- محاسبه شاخص‌های تکنیکال ---
-    df_processed.loc[:, 'rsi'] = calculate_rsi(df_processed['close'])
-    macd_line, signal_line, _ = calculate_macd(df_processed['close'])
-    df_processed.loc[:, 'macd'] = macd_line
-    df_processed.loc[:, 'signal_line'] = signal_line
-    df_processed.loc[:, 'sma_20'] = calculate_sma(df_processed['close'], window=20)
-    df_processed.loc[:, 'sma_50'] = calculate_sma(df_processed['close'], window=50)
-    df_processed.loc[:, 'volume_ma_5_day'] = calculate_volume_ma(df_processed['volume'], window=5)
-    df_processed.loc[:, 'atr'] = calculate_atr(df_processed['high'], df_processed['low'], df_processed['close'])
+    # --- محاسبه شاخص‌های تکنیکال (یک گذر رجیستری اندیکاتورها از طریق کش مشترک) ---
+    last_bar_date = df_processed.index[-1] if len(df_processed) else None
+    indicators = compute_indicators(df_processed, ML_INDICATORS, symbol_id_for_logging, last_bar_date)
+    df_processed.loc[:, 'rsi'] = indicators['RSI']
+    df_processed.loc[:, 'macd'] = indicators['MACD']
+    df_processed.loc[:, 'signal_line'] = indicators['MACD_Signal']
+    df_processed.loc[:, 'sma_20'] = indicators['SMA_20']
+    df_processed.loc[:, 'sma_50'] = indicators['SMA_50']
+    df_processed.loc[:, 'volume_ma_5_day'] = indicators['Volume_MA_5']
+    df_processed.loc[:, 'atr'] = indicators['ATR']
 
     # --- ویژگی‌های جدید اضافه شده (باید با train_model.py یکسان باشد) ---
     # Stochastic Oscillator
@@ -229,7 +238,7 @@ if __name__ == "__main__":
     sample_df = pd.DataFrame(sample_data)
     sample_df['symbol_id'] = 'SAMPLE'
     sample_df['symbol_name'] = 'نماد نمونه'
-    sample_df['jdate'] = sample_df['gregorian_date'].apply(lambda x: jdatetime.date.fromgregorian(year=x.year, month=x.month, day=x.day).strftime('%Y-%m-%d'))
+    sample_df['jdate'] = gregorian_to_jalali(sample_df['gregorian_date'])
 
 
     trend, prob = predict_trend_for_symbol(sample_df, symbol_id_for_logging='SAMPLE')
@@ -446,3 +446,146 @@ class PotentialBuyQueueResult(db.Model):
 
     def __repr__(self):
         return f'<PotentialBuyQueueResult {self.symbol_name} {self.jdate}>'
+
+
+class IngestionCheckpoint(db.Model):
+    """
+    Per-symbol, per-stage watermark of the nightly data update (run_full_data_update),
+    so an interrupted run can resume with the symbols and stages not yet handled today.
+    """
+    __tablename__ = 'ingestion_checkpoints'
+    id = db.Column(db.Integer, primary_key=True)
+    symbol_id = db.Column(db.String(50), nullable=False)
+    stage = db.Column(db.String(20), nullable=False) # 'historical', 'technical', 'fundamental'
+    run_date = db.Column(db.Date, nullable=False) # Gregorian date of the run that last handled this stage
+    status = db.Column(db.String(20), nullable=False) # 'done', 'no_data', 'failed'
+    last_data_date = db.Column(db.Date, nullable=True) # Latest bar date stored (historical stage)
+    message = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('symbol_id', 'stage', name='_symbol_stage_checkpoint_uc'),)
+
+    def __repr__(self):
+        return f'<IngestionCheckpoint {self.symbol_id} {self.stage} {self.run_date} {self.status}>'
+
+
+class DataQualityFlag(db.Model):
+    """
+    Result of the market-wide data-quality check (services/data_quality.py): one row per
+    symbol and failed check. Symbols with an 'error' flag are quarantined and skipped by
+    the screeners until a later check run no longer finds the problem.
+    """
+    __tablename__ = 'data_quality_flags'
+    id = db.Column(db.Integer, primary_key=True)
+    symbol_id = db.Column(db.String(50), nullable=False, index=True)
+    check_name = db.Column(db.String(30), nullable=False) # 'invalid_close', 'high_below_low', 'duplicate_jdate', 'gap', 'stale'
+    severity = db.Column(db.String(10), nullable=False) # 'error' (quarantined) or 'warning'
+    bad_bars = db.Column(db.Integer, nullable=False, default=0) # Number of affected bars (or missing trading days)
+    first_bad_date = db.Column(db.Date, nullable=True)
+    last_bad_date = db.Column(db.Date, nullable=True)
+    details = db.Column(db.Text, nullable=True)
+    detected_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('symbol_id', 'check_name', name='_symbol_check_quality_uc'),)
+
+    def __repr__(self):
+        return f'<DataQualityFlag {self.symbol_id} {self.check_name} {self.severity}>'
+
+
+class IndicatorState(db.Model):
+    """
+    Recursive state of the technical indicators of one symbol after its last processed bar
+    (services/indicator_state.py), so the next daily bar advances RSI, MACD, ATR and the
+    moving averages in constant time instead of recomputing them over the whole history.
+    """
+    __tablename__ = 'indicator_states'
+    symbol_id = db.Column(db.String(50), primary_key=True)
+    last_date = db.Column(db.Date, nullable=False) # Gregorian date of the last bar folded into the state
+    last_jdate = db.Column(db.String(10), nullable=False)
+    bar_count = db.Column(db.Integer, nullable=False) # Bars with a close seen so far
+    volume_count = db.Column(db.Integer, nullable=False) # Bars with a volume seen so far
+
+    last_close = db.Column(db.Float)
+    last_high = db.Column(db.Float) # Carried forward when a bar has no high (ATR)
+    last_low = db.Column(db.Float)
+
+    ema_gain = db.Column(db.Float) # RSI average gain
+    ema_loss = db.Column(db.Float) # RSI average loss
+    ema_fast = db.Column(db.Float) # MACD 12-day EMA
+    ema_slow = db.Column(db.Float) # MACD 26-day EMA
+    ema_signal = db.Column(db.Float) # MACD signal EMA
+    atr = db.Column(db.Float) # EMA of true range
+
+    sum_close_20 = db.Column(db.Float) # Rolling-window sums (SMA_20 / Bollinger, SMA_50, Volume_MA_20)
+    sum_close_50 = db.Column(db.Float)
+    sum_volume_20 = db.Column(db.Float)
+    close_window = db.Column(db.Text) # JSON list of the last 50 closes, oldest first
+    volume_window = db.Column(db.Text) # JSON list of the last 20 volumes, oldest first
+
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<IndicatorState {self.symbol_id} {self.last_jdate} ({self.bar_count} bars)>'
+
+
+class SmartMoneyFlowData(db.Model):
+    """
+    Daily real (individual) / legal money-flow metrics of every symbol, computed for the whole
+    market in one vectorized pass (services/smart_money_flow.py) after the nightly update, so
+    the screeners only read the latest row of each symbol.
+    """
+    __tablename__ = 'smart_money_flow_data'
+    id = db.Column(db.Integer, primary_key=True)
+    symbol_id = db.Column(db.String(50), db.ForeignKey('comprehensive_symbol_data.symbol_id'), nullable=False)
+    date = db.Column(db.Date, nullable=False) # Gregorian date of the bar
+    jdate = db.Column(db.String(10), nullable=False)
+    individual_buy_power = db.Column(db.Float) # buy_i_volume / sell_i_volume (0 without real sellers)
+    individual_net_flow = db.Column(db.Float) # buy_i_volume - sell_i_volume
+    individual_buy_per_trade = db.Column(db.Float) # buy_i_volume / buy_count_i
+    individual_sell_per_trade = db.Column(db.Float) # sell_i_volume / sell_count_i
+    legal_net_flow = db.Column(db.Float) # buy_n_volume - sell_n_volume
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('symbol_id', 'jdate', name='_symbol_jdate_smart_money_uc'),
+        db.Index('ix_smart_money_flow_data_symbol_date', 'symbol_id', 'date'), # Latest row per symbol
+    )
+
+    def __repr__(self):
+        return f'<SmartMoneyFlowData {self.symbol_id} - {self.jdate}>'
+
+
+class ResampledBar(db.Model):
+    """
+    Weekly / monthly OHLCV candle of a symbol built from its daily stock_data bars
+    (services/bar_resampler.py). Periods follow the Jalali calendar: weeks start on Saturday
+    and months on the 1st of the Jalali month. The latest period of each symbol is rebuilt
+    after every ingest, so it may be partial (see last_date).
+    """
+    __tablename__ = 'resampled_bars'
+    id = db.Column(db.Integer, primary_key=True)
+    symbol_id = db.Column(db.String(50), db.ForeignKey('comprehensive_symbol_data.symbol_id'), nullable=False)
+    timeframe = db.Column(db.String(10), nullable=False) # 'weekly' or 'monthly'
+    period_jdate = db.Column(db.String(10), nullable=False) # Jalali calendar start of the period (Saturday / 1st of the month)
+    period_start = db.Column(db.Date, nullable=False) # Gregorian date of period_jdate
+    first_date = db.Column(db.Date, nullable=False) # First daily bar in the period
+    last_date = db.Column(db.Date, nullable=False) # Last daily bar in the period
+    last_jdate = db.Column(db.String(10), nullable=False)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float)
+    volume = db.Column(db.BigInteger)
+    value = db.Column(db.BigInteger)
+    num_trades = db.Column(db.Integer)
+    bar_count = db.Column(db.Integer, nullable=False) # Daily bars in the period
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('symbol_id', 'timeframe', 'period_jdate', name='_symbol_timeframe_period_uc'),
+        db.Index('ix_resampled_bars_timeframe_period_start', 'timeframe', 'period_start'), # Latest periods of all symbols
+        db.Index('ix_resampled_bars_symbol_timeframe_start', 'symbol_id', 'timeframe', 'period_start'),
+    )
+
+    def __repr__(self):
+        return f'<ResampledBar {self.symbol_id} {self.timeframe} {self.period_jdate}>'
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import requests
 import jdatetime
 import logging
 import socket
@@ -12,6 +11,7 @@ from requests.exceptions import ConnectionError, Timeout
 # وارد کردن سرویس‌های داده جدید
 from services.iran_market_data import fetch_iran_market_indices
 from services.global_commodities_data import fetch_global_commodities
+from services.http_client import get_http_client
 
 # تنظیم لاگینگ
 logger = logging.getLogger(__name__)
@@ -123,7 +123,7 @@ class MarketOverviewResource(Resource):
         # اگر URL یک پراکسی است، درخواست را به آن ارسال کن
         if "tgju.org" not in tgju_base_url:
             try:
-                gold_response = requests.get(f"{tgju_base_url}/gold", timeout=timeout)
+                gold_response = get_http_client().get(f"{tgju_base_url}/gold", timeout=timeout, max_retries=0)
                 gold_response.raise_for_status()
                 tgju_data["gold_prices"] = gold_response.json()
                 logger.info("داده‌های طلا از پراکسی با موفقیت دریافت شد.")
@@ -131,7 +131,7 @@ class MarketOverviewResource(Resource):
                 logger.error(f"خطا در دریافت Gold از پراکسی: {e}", exc_info=True)
 
             try:
-                coin_response = requests.get(f"{tgju_base_url}/coin", timeout=timeout) # تغییر از /currency به /coin
+                coin_response = get_http_client().get(f"{tgju_base_url}/coin", timeout=timeout, max_retries=0) # تغییر از /currency به /coin
                 coin_response.raise_for_status()
                 tgju_data["coin_prices"] = coin_response.json() # تغییر از currency_prices به coin_prices
                 logger.info("داده‌های سکه از پراکسی با موفقیت دریافت شد.")
@@ -141,7 +141,7 @@ class MarketOverviewResource(Resource):
         # اگر از URL فال‌بک استفاده می‌شود، داده‌ها را مستقیماً از آن دریافت کن
         else:
             try:
-                fallback_resp = requests.get(f"{tgju_base_url}/ajax.json", timeout=timeout)
+                fallback_resp = get_http_client().get(f"{tgju_base_url}/ajax.json", timeout=timeout, max_retries=0)
                 fallback_resp.raise_for_status()
                 raw_data = fallback_resp.json()
                 tgju_data["gold_prices"] = [i for i in raw_data.get("last", []) if "gold" in i.get("name", "")]
@@ -6,7 +6,6 @@ from models import (
     WeeklyWatchlistResult, AggregatedPerformance # AggregatedPerformance is still needed for GoldenKeyResult updates
 )
 from datetime import datetime, timedelta, date
-import jdatetime
 import pandas as pd
 import numpy as np
 from flask import current_app
@@ -17,6 +16,7 @@ import json
 
 # Import utility functions
 from services.utils import get_today_jdate_str, normalize_value, calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands, calculate_volume_ma, calculate_atr, calculate_smart_money_flow, check_candlestick_patterns, check_tsetmc_filters, check_financial_ratios
+from services.jalali_calendar import jalali_to_gregorian
 
 # تنظیمات لاگینگ برای این ماژول
 import logging
@@ -28,16 +28,11 @@ GOLDEN_KEY_LOOKBACK_DAYS = 200
 # Helper function to convert Jalali date string to Gregorian date object
 def convert_jalali_to_gregorian_date(jdate_str):
     """
-    Converts a Jalali date string (YYYY-MM-DD) to a Gregorian date object.
-    Handles NaN/None values gracefully.
+    Converts a Jalali date string (YYYY-MM-DD) to a Gregorian date.
+    Also accepts a whole Series of jdate strings, converted in one vectorized call.
+    Handles NaN/None values gracefully (NaT).
     """
-    if pd.notna(jdate_str) and isinstance(jdate_str, str):
-        try:
-            jy, jm, jd = map(int, jdate_str.split('-'))
-            return jdatetime.date(jy, jm, jd).togregorian()
-        except ValueError:
-            return None # Return None for invalid date strings
-    return None # Return None for NaN or None
+    return jalali_to_gregorian(jdate_str)
 
 # Helper function to get the most reliable price
 def get_reliable_price(data_row):
@@ -111,7 +106,7 @@ def run_golden_key_analysis_and_save():
         merged_df = pd.merge(hist_df, tech_df, on='jdate', how='inner')
         
         # FIX: Convert jdate to Gregorian date objects for pandas operations (MODIFIED)
-        merged_df['greg_date'] = merged_df['jdate'].apply(convert_jalali_to_gregorian_date)
+        merged_df['greg_date'] = convert_jalali_to_gregorian_date(merged_df['jdate'])
         merged_df = merged_df.dropna(subset=['greg_date']) # Drop rows where conversion failed
         merged_df = merged_df.sort_values(by='greg_date', ascending=True).reset_index(drop=True)
         # END FIX
@@ -299,7 +294,8 @@ def run_golden_key_analysis_and_save():
     top_5_golden_key = sorted_results[:5]
     
     saved_count = 0
-    for item in top_5_golden_key:
+    entry_dates = jalali_to_gregorian([item['jdate'] for item in top_5_golden_key])
+    for item, entry_timestamp in zip(top_5_golden_key, entry_dates):
         golden_key_entry = GoldenKeyResult.query.filter_by(
             symbol_id=item['symbol_id'], 
             jdate=item['jdate'] 
@@ -336,7 +332,7 @@ def run_golden_key_analysis_and_save():
         saved_count += 1
         
         # --- Create/Update SignalsPerformance entry for Golden Key ---
-        greg_entry_date = jdatetime.date(*map(int, item['jdate'].split('-'))).togregorian()
+        greg_entry_date = entry_timestamp.date()
 
         signal_performance_entry = SignalsPerformance.query.filter_by(
             symbol_id=item['symbol_id'],
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# services/bar_resampler.py
+# ساخت کندل‌های هفتگی و ماهانه (OHLCV) همه نمادها از بارهای روزانه stock_data، هم‌راستا با تقویم جلالی:
+# هفته از شنبه شروع می‌شود و ماه از روز اول ماه جلالی. نتیجه در جدول resampled_bars ذخیره می‌شود و بعد از هر
+# دریافت داده فقط دوره آخر هر نماد (که ممکن است ناقص باشد) و دوره‌های جدیدتر از آن دوباره ساخته می‌شوند.
+# اندیکاتورها و فیلترهای تایم‌فریم بالاتر کندل‌ها را با get_resampled_bars / get_latest_resampled_bars می‌خوانند.
+# اگر بارهای قدیمی‌تر بازنویسی شوند (تعدیل قیمت، ورود مجدد آرشیو) reset_resampled_bars کندل‌های از آن تاریخ به بعد را
+# حذف می‌کند تا اجرای بعدی آن‌ها را دوباره بسازد.
+
+import logging
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, or_, select
+
+from extensions import db
+from models import HistoricalData, ComprehensiveSymbolData, ResampledBar
+from services.db_utils import bulk_upsert
+from services.jalali_calendar import gregorian_to_jalali, jalali_to_gregorian
+
+logger = logging.getLogger(__name__)
+
+TIMEFRAMES = ('weekly', 'monthly')
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+SUM_COLUMNS = ['volume', 'value', 'num_trades']
+BAR_COLUMNS = ['symbol_id', 'date'] + PRICE_COLUMNS + SUM_COLUMNS
+
+SATURDAY_OFFSET = 2 # 1970-01-03, day 2 of the datetime64 epoch, was a Saturday
+
+
+def period_starts(dates, timeframe):
+    """
+    Calendar start of the period each date falls in.
+
+    Args:
+        dates (array-like): Gregorian dates.
+        timeframe (str): 'weekly' (weeks start on Saturday) or 'monthly' (1st of the Jalali month).
+
+    Returns:
+        tuple: (period start as a datetime64[D] array, period start as Jalali 'YYYY-MM-DD' strings).
+    """
+    if timeframe not in TIMEFRAMES:
+        raise ValueError(f"Unknown timeframe '{timeframe}'. Expected one of {TIMEFRAMES}.")
+    days = np.asarray(pd.to_datetime(pd.Series(dates)).to_numpy(), dtype='datetime64[D]')
+    unique_days, inverse = np.unique(days, return_inverse=True)
+
+    if timeframe == 'weekly':
+        offsets = unique_days.astype(np.int64)
+        starts = (offsets - (offsets - SATURDAY_OFFSET) % 7).astype('datetime64[D]')
+        start_jdates = np.asarray(gregorian_to_jalali(starts), dtype=object)
+    else:
+        start_jdates = np.array([jdate[:8] + '01' for jdate in gregorian_to_jalali(unique_days)], dtype=object)
+        starts = np.asarray(jalali_to_gregorian(start_jdates), dtype='datetime64[D]')
+    return starts[inverse], start_jdates[inverse]
+
+
+def resample_bars(bars, timeframe):
+    """
+    Aggregates daily bars into weekly or monthly candles. Pure function.
+
+    Args:
+        bars (DataFrame): symbol_id, date and the daily open/high/low/close/volume/value/num_trades,
+            one row per bar, sorted by symbol then date.
+        timeframe (str): 'weekly' or 'monthly'.
+
+    Returns:
+        DataFrame: One row per symbol and period with the ResampledBar columns (except id/updated_at).
+    """
+    if bars.empty:
+        return pd.DataFrame(columns=['symbol_id', 'timeframe', 'period_jdate', 'period_start', 'first_date',
+                                     'last_date', 'last_jdate', 'bar_count'] + PRICE_COLUMNS + SUM_COLUMNS)
+    frame = bars[BAR_COLUMNS].copy()
+    for column in PRICE_COLUMNS + SUM_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    starts, start_jdates = period_starts(frame['date'], timeframe)
+    frame['period_start'], frame['period_jdate'] = starts, start_jdates
+
+    grouped = frame.groupby(['symbol_id', 'period_jdate'], sort=False)
+    candles = grouped.agg(
+        period_start=('period_start', 'first'), first_date=('date', 'first'), last_date=('date', 'last'),
+        open=('open', 'first'), high=('high', 'max'), low=('low', 'min'), close=('close', 'last'),
+        volume=('volume', 'sum'), value=('value', 'sum'), num_trades=('num_trades', 'sum'),
+        bar_count=('date', 'size'),
+    ).reset_index()
+    candles['period_start'] = pd.to_datetime(candles['period_start']).dt.date
+    candles['first_date'] = pd.to_datetime(candles['first_date']).dt.date
+    candles['last_date'] = pd.to_datetime(candles['last_date']).dt.date
+    candles['last_jdate'] = gregorian_to_jalali(candles['last_date'])
+    candles.insert(1, 'timeframe', timeframe)
+    for column in SUM_COLUMNS:
+        candles[column] = candles[column].round().astype('int64')
+    return candles
+
+
+def _latest_periods(session, symbol_ids=None):
+    """
+    {symbol_id: {timeframe: (period_start, first_date) of its latest stored candle, or None}} for
+    every symbol. Each latest candle is a correlated index lookup instead of a scan of the table.
+    """
+    columns = [ComprehensiveSymbolData.symbol_id]
+    for timeframe in TIMEFRAMES:
+        for column in (ResampledBar.period_start, ResampledBar.first_date):
+            columns.append(select(column)
+                           .where(ResampledBar.symbol_id == ComprehensiveSymbolData.symbol_id, ResampledBar.timeframe == timeframe)
+                           .order_by(ResampledBar.period_start.desc()).limit(1)
+                           .correlate(ComprehensiveSymbolData).scalar_subquery())
+    query = session.query(*columns)
+    if symbol_ids is not None:
+        query = query.filter(ComprehensiveSymbolData.symbol_id.in_(list(symbol_ids)))
+    return {symbol_id: {timeframe: (values[2 * i], values[2 * i + 1]) if values[2 * i] is not None else None
+                        for i, timeframe in enumerate(TIMEFRAMES)}
+            for symbol_id, *values in query.all()}
+
+
+def _load_bars_to_rebuild(session, latest_periods):
+    """
+    Loads the daily bars from the first bar of each symbol's latest stored period (the whole
+    history for symbols missing a timeframe), sorted by symbol then date. Symbols are grouped by
+    that date, so on a normal day there are only a few (symbol_id IN ..., date >= ...) ranges.
+    """
+    by_reload_date, new_symbols = {}, []
+    for symbol_id, latest in latest_periods.items():
+        if None in latest.values():
+            new_symbols.append(symbol_id)
+        else:
+            by_reload_date.setdefault(min(first_date for _, first_date in latest.values()), []).append(symbol_id)
+
+    columns = [getattr(HistoricalData, column) for column in BAR_COLUMNS]
+    conditions = [and_(HistoricalData.symbol_id.in_(ids[start:start + 500]), HistoricalData.date >= reload_date)
+                  for reload_date, ids in by_reload_date.items() for start in range(0, len(ids), 500)]
+    conditions += [HistoricalData.symbol_id.in_(new_symbols[start:start + 500]) for start in range(0, len(new_symbols), 500)]
+    rows = []
+    for start in range(0, len(conditions), 100):
+        rows += session.query(*columns).filter(or_(*conditions[start:start + 100])).all()
+    frame = pd.DataFrame(rows, columns=BAR_COLUMNS)
+    return frame.sort_values(['symbol_id', 'date'], kind='stable').reset_index(drop=True)
+
+
+def update_resampled_bars(session=db.session, symbol_ids=None):
+    """
+    Rebuilds the latest stored weekly and monthly candle of every symbol (or symbol_ids) and adds
+    the newer ones. Idempotent; does not commit.
+
+    Returns:
+        Tuple[int, int]: Number of rows written and number of symbols updated.
+    """
+    latest_periods = _latest_periods(session, symbol_ids)
+    bars = _load_bars_to_rebuild(session, latest_periods)
+    if bars.empty:
+        return 0, 0
+    written = 0
+    for timeframe in TIMEFRAMES:
+        candles = resample_bars(bars, timeframe)
+        # Periods before the symbol's latest stored one were only partly reloaded; their stored rows stay
+        latest_start = pd.to_datetime(candles['symbol_id'].map(
+            {symbol_id: latest[timeframe][0] for symbol_id, latest in latest_periods.items() if latest[timeframe]}))
+        candles = candles[latest_start.isna() | (pd.to_datetime(candles['period_start']) >= latest_start)]
+        written += bulk_upsert(session, ResampledBar, candles.to_dict('records'),
+                               index_elements=['symbol_id', 'timeframe', 'period_jdate'])
+    return written, bars['symbol_id'].nunique()
+
+
+def reset_resampled_bars(session, rewritten_from):
+    """
+    Drops the candles that contain (or follow) rewritten daily bars, so the next
+    update_resampled_bars rebuilds each symbol from its latest remaining candle. Does not commit.
+
+    Args:
+        rewritten_from (dict): {symbol_id: earliest rewritten bar date}.
+
+    Returns:
+        int: Number of candles dropped.
+    """
+    by_date = {}
+    for symbol_id, since_date in rewritten_from.items():
+        by_date.setdefault(since_date, []).append(symbol_id)
+    dropped = 0
+    for since_date, ids in by_date.items():
+        for start in range(0, len(ids), 500):
+            dropped += session.query(ResampledBar).filter(
+                ResampledBar.symbol_id.in_(ids[start:start + 500]), ResampledBar.last_date >= since_date
+            ).delete(synchronize_session=False)
+    if dropped:
+        logger.info(f"Dropped {dropped} weekly/monthly candles after their daily bars were rewritten.")
+    return dropped
+
+
+def run_bar_resampling(full_rebuild=False, symbol_ids=None):
+    """
+    Brings resampled_bars up to the latest stored daily bars for all symbols (or symbol_ids) and
+    commits. full_rebuild drops the stored candles first (e.g. after historical bars were corrected).
+
+    Returns:
+        Tuple[int, str]: Number of rows written and a summary message.
+    """
+    try:
+        if full_rebuild:
+            delete_query = ResampledBar.query
+            if symbol_ids is not None:
+                delete_query = delete_query.filter(ResampledBar.symbol_id.in_(list(symbol_ids)))
+            delete_query.delete(synchronize_session=False)
+        written, symbol_count = update_resampled_bars(db.session, symbol_ids=symbol_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during bar resampling: {e}", exc_info=True)
+        return 0, f"An error occurred during bar resampling: {e}"
+
+    message = f"Bar resampling: {written} weekly/monthly candles written for {symbol_count} symbols."
+    logger.info(message)
+    return written, message
+
+
+def _frame(rows):
+    columns = [column.name for column in ResampledBar.__table__.columns if column.name not in ('id', 'updated_at')]
+    return pd.DataFrame([{column: getattr(row, column) for column in columns} for row in rows], columns=columns)
+
+
+def get_resampled_bars(symbol_id, timeframe, periods=None):
+    """The last `periods` (all if None) weekly or monthly candles of a symbol as a DataFrame, oldest first."""
+    rows = ResampledBar.query.filter_by(symbol_id=symbol_id, timeframe=timeframe) \
+        .order_by(ResampledBar.period_start.desc()).limit(periods).all()
+    return _frame(rows[::-1])
+
+
+def get_latest_resampled_bars(timeframe, periods, symbol_ids=None):
+    """
+    The candles of the last `periods` calendar periods of the market, for all symbols (or symbol_ids)
+    in one range query: {symbol_id: DataFrame oldest first}. Symbols without a candle in a period
+    (e.g. halted ones) simply have fewer rows.
+    """
+    try:
+        latest_start = db.session.query(func.max(ResampledBar.period_start)).filter(ResampledBar.timeframe == timeframe).scalar()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not load {timeframe} resampled bars: {e}")
+        return {}
+    if latest_start is None:
+        return {}
+    if timeframe == 'weekly':
+        first_start = latest_start - timedelta(days=7 * (periods - 1))
+    else:
+        # Step back month by month: the day before a month's start lies in the previous month
+        first_start = latest_start
+        for _ in range(periods - 1):
+            first_start = period_starts([first_start - timedelta(days=1)], 'monthly')[0][0].astype(object)
+
+    query = ResampledBar.query.filter(ResampledBar.timeframe == timeframe, ResampledBar.period_start >= first_start)
+    if symbol_ids is not None:
+        query = query.filter(ResampledBar.symbol_id.in_(list(symbol_ids)))
+    frame = _frame(query.all())
+    if frame.empty:
+        return {}
+    frame = frame.sort_values(['symbol_id', 'period_start'], kind='stable')
+    return {symbol_id: candles.reset_index(drop=True) for symbol_id, candles in frame.groupby('symbol_id', sort=False)}
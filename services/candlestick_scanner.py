@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# services/candlestick_scanner.py
+# اسکنر برداری الگوهای شمعی: کتابخانه‌ای از الگوها روی کل تاریخچه OHLC همه نمادها در یک گذر (آرایه‌های numpy)
+# ارزیابی می‌شود و نتیجه با درج دسته‌ای در جدول candlestick_pattern_detection ذخیره می‌شود.
+#
+# قرارداد ورودی: آرایه‌های بلند (یک ردیف برای هر بار) که بر اساس نماد و سپس تاریخ مرتب شده‌اند؛ «بار قبلی» یعنی
+# بار معاملاتی قبلی همان نماد. Hammer و Bullish Engulfing همان قواعد check_candlestick_patterns در services/utils را دارند.
+
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from sqlalchemy import and_, select
+
+from extensions import db
+from models import HistoricalData, ComprehensiveSymbolData, CandlestickPatternDetection
+from services.db_utils import bulk_upsert
+from services.jalali_calendar import gregorian_to_jalali
+from services.market_panel import MarketPanel, load_market_panel
+
+logger = logging.getLogger(__name__)
+
+CANDLESTICK_PATTERNS = (
+    'Hammer', 'Bullish Engulfing', 'Doji', 'Piercing Line', 'Morning Star', 'Three White Soldiers',
+)
+
+DOWNTREND_WINDOW = 10 # closes (including today) used by the Hammer downtrend check
+WARMUP_BARS = DOWNTREND_WINDOW - 1 # bars of each symbol loaded before the scan window, so every pattern sees its full history
+DEFAULT_LOOKBACK_DAYS = 30
+
+
+def _config_value(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def _previous(values, symbol_ids, lag):
+    """values shifted by `lag` bars within each symbol; NaN where the symbol has fewer earlier bars."""
+    shifted = np.full(len(values), np.nan)
+    if len(values) > lag:
+        shifted[lag:] = values[:-lag]
+        shifted[lag:][symbol_ids[lag:] != symbol_ids[:-lag]] = np.nan
+    return shifted
+
+
+def scan_candlestick_patterns(symbol_ids, open_, high, low, close):
+    """
+    Evaluates every pattern in CANDLESTICK_PATTERNS on every bar at once. Pure function.
+
+    Args:
+        symbol_ids (array): Symbol of each bar; bars are sorted by symbol then date.
+        open_, high, low, close (array): Prices of each bar.
+
+    Returns:
+        dict: {pattern name: boolean array, True where the pattern completes on that bar}.
+    """
+    symbol_ids = np.asarray(symbol_ids)
+    o, h, l, c = (np.asarray(values, dtype=np.float64) for values in (open_, high, low, close))
+    o1, c1, h1, l1 = (_previous(values, symbol_ids, 1) for values in (o, c, h, l))
+    o2, c2 = _previous(o, symbol_ids, 2), _previous(c, symbol_ids, 2)
+
+    body, candle_range = np.abs(c - o), h - l
+    body1, body2 = np.abs(c1 - o1), np.abs(c2 - o2)
+    bullish, bullish1, bullish2 = c > o, c1 > o1, c2 > o2
+    bearish1, bearish2 = c1 < o1, c2 < o2
+
+    # Downtrend (Hammer): close within 2% of the 10-bar low and below the close 9 bars earlier
+    downtrend = np.zeros(len(c), dtype=bool)
+    if len(c) >= DOWNTREND_WINDOW:
+        windows = np.lib.stride_tricks.sliding_window_view(c, DOWNTREND_WINDOW)
+        window_min = windows.min(axis=1)
+        same_symbol = symbol_ids[DOWNTREND_WINDOW - 1:] == symbol_ids[:len(c) - DOWNTREND_WINDOW + 1]
+        downtrend[DOWNTREND_WINDOW - 1:] = same_symbol & (window_min > 0) & \
+            (c[DOWNTREND_WINDOW - 1:] <= window_min * 1.02) & (windows[:, 0] > c[DOWNTREND_WINDOW - 1:])
+
+    with np.errstate(invalid='ignore'):
+        lower_shadow = np.minimum(o, c) - l
+        upper_shadow = h - np.maximum(o, c)
+        patterns = {
+            # Small body, long lower shadow, almost no upper shadow, at the end of a downtrend
+            'Hammer': (candle_range > 0) & (body > 0) & (body < 0.3 * candle_range) &
+                      (lower_shadow >= 2 * body) & (upper_shadow < 0.1 * body) & downtrend,
+            # Bullish body that engulfs the previous bearish body
+            'Bullish Engulfing': bearish1 & bullish & (o < c1) & (c > o1),
+            # Open and close (almost) equal
+            'Doji': (candle_range > 0) & (body <= 0.1 * candle_range),
+            # Opens below the previous bearish close and closes above its body's midpoint (but not above its open)
+            'Piercing Line': bearish1 & (body1 >= 0.5 * (h1 - l1)) & bullish & (o < c1) &
+                             (c > (o1 + c1) / 2) & (c < o1),
+            # Long bearish bar, a small-bodied bar at or below its close, then a bullish close above its midpoint
+            'Morning Star': bearish2 & (body2 > 0) & (body1 <= 0.3 * body2) & (np.maximum(o1, c1) <= c2) &
+                            bullish & (c > (o2 + c2) / 2),
+            # Three rising bullish bars, each opening inside the previous body and closing near its high
+            'Three White Soldiers': bullish2 & bullish1 & bullish & (c1 > c2) & (c > c1) &
+                                    (o1 > o2) & (o1 <= c2) & (o > o1) & (o <= c1) &
+                                    (upper_shadow <= 0.3 * body) & (h1 - c1 <= 0.3 * body1),
+        }
+    return patterns
+
+
+def find_candlestick_patterns(bars):
+    """
+    Runs the scanner over the bars of many symbols and lists the detections.
+
+    Args:
+        bars (MarketPanel or DataFrame): open, high, low, close of each bar, sorted by symbol then
+            date; a DataFrame also has symbol_id and jdate (a panel's jdate comes from its dates).
+
+    Returns:
+        DataFrame: symbol_id, jdate, pattern_name; one row per detected pattern.
+    """
+    if bars.empty:
+        return pd.DataFrame(columns=['symbol_id', 'jdate', 'pattern_name'])
+    if isinstance(bars, MarketPanel):
+        symbol_keys, symbol_ids = bars.codes, bars.symbols[bars.codes]
+    else:
+        symbol_keys = symbol_ids = bars['symbol_id'].to_numpy()
+    patterns = scan_candlestick_patterns(symbol_keys, *(np.asarray(bars[column], dtype=float)
+                                                        for column in ('open', 'high', 'low', 'close')))
+
+    def jdates(mask):
+        if isinstance(bars, MarketPanel):
+            return gregorian_to_jalali(bars.dates[mask])
+        return bars['jdate'].to_numpy()[mask]
+
+    detections = [
+        pd.DataFrame({'symbol_id': symbol_ids[mask], 'jdate': jdates(mask), 'pattern_name': pattern_name})
+        for pattern_name, mask in patterns.items() if mask.any()
+    ]
+    if not detections:
+        return pd.DataFrame(columns=['symbol_id', 'jdate', 'pattern_name'])
+    return pd.concat(detections, ignore_index=True)
+
+
+def _warmup_conditions(start_date):
+    """
+    Per-symbol filters for the bars since start_date plus the WARMUP_BARS trading bars before it
+    (a halted symbol's previous bars may be months older). The first warm-up date of each symbol
+    is a correlated index lookup; symbols are grouped by it, so there are few conditions.
+    """
+    warmup_date = select(HistoricalData.date) \
+        .where(HistoricalData.symbol_id == ComprehensiveSymbolData.symbol_id, HistoricalData.date < start_date) \
+        .order_by(HistoricalData.date.desc()).limit(1).offset(WARMUP_BARS - 1) \
+        .correlate(ComprehensiveSymbolData).scalar_subquery()
+    by_warmup_date = {}
+    for symbol_id, first_date in db.session.query(ComprehensiveSymbolData.symbol_id, warmup_date).all():
+        by_warmup_date.setdefault(first_date, []).append(symbol_id)
+
+    conditions = []
+    for first_date, ids in by_warmup_date.items():
+        for start in range(0, len(ids), 500):
+            # No warm-up date: the symbol has fewer earlier bars, load them all
+            conditions.append(HistoricalData.symbol_id.in_(ids[start:start + 500]) if first_date is None else
+                              and_(HistoricalData.symbol_id.in_(ids[start:start + 500]), HistoricalData.date >= first_date))
+    return conditions
+
+
+def _load_bars(start_date=None):
+    """Loads OHLC bars of every symbol (since start_date plus warm-up bars, or the whole history) as a MarketPanel."""
+    conditions = None if start_date is None else _warmup_conditions(start_date)
+    return load_market_panel(db.session, ['open', 'high', 'low', 'close'], conditions=conditions)
+
+
+def run_candlestick_pattern_scan(lookback_days=None, full_history=False):
+    """
+    Scans the bars of the last `lookback_days` (default Config.CANDLESTICK_SCAN_LOOKBACK_DAYS), or
+    the whole history, of all symbols and replaces the detections of that window in
+    candlestick_pattern_detection with a bulk insert. Idempotent.
+
+    Returns:
+        Tuple[int, str]: Number of detections written and a summary message.
+    """
+    lookback_days = lookback_days or _config_value('CANDLESTICK_SCAN_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS)
+    start_date = None if full_history else date.today() - timedelta(days=lookback_days)
+    logger.info(f"Starting candlestick pattern scan ({'full history' if full_history else f'since {start_date}'}).")
+
+    try:
+        bars = _load_bars(start_date)
+        detections = find_candlestick_patterns(bars)
+
+        delete_query = CandlestickPatternDetection.query
+        if start_date is not None:
+            in_window = bars.dates >= np.datetime64(start_date, 'D')
+            if not in_window.any():
+                return 0, f"Candlestick pattern scan: no bars since {start_date}."
+            first_jdate = gregorian_to_jalali(bars.dates[in_window].min())
+            detections = detections[detections['jdate'] >= first_jdate]
+            delete_query = delete_query.filter(CandlestickPatternDetection.jdate >= first_jdate)
+
+        delete_query.delete(synchronize_session=False)
+        written = bulk_upsert(db.session, CandlestickPatternDetection, detections.to_dict('records'),
+                              index_elements=['symbol_id', 'jdate', 'pattern_name'], update_columns=[])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during candlestick pattern scan: {e}", exc_info=True)
+        return 0, f"An error occurred during the candlestick pattern scan: {e}"
+
+    counts = detections['pattern_name'].value_counts().to_dict()
+    message = f"Candlestick pattern scan finished over {len(bars)} bars: {written} detections, per pattern: {counts or 'none'}."
+    logger.info(message)
+    return written, message
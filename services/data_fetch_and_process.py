@@ -5,25 +5,44 @@ from flask import current_app
 #import pytse_client as tse
 import pandas as pd
 from datetime import datetime, date, timedelta # Import date here too
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED, as_completed
+import multiprocessing
+import json
+import os
 import jdatetime
 from sqlalchemy import func
 import numpy as np
 #import requests
 from bs4 import BeautifulSoup # Import BeautifulSoup
 import lxml # lxml is the parser for BeautifulSoup
+from lxml import html as lxml_html
 
 #ماژول‌های pytse_client و requests را حذف کرده و توابع مورد نیاز از ماژول pytse_wrapper را ایمپورت کنید.
 from services.pytse_wrapper import (
     http_get, 
     Ticker, 
     download, 
+    download_since,
     safe_download_batch, 
     all_tickers, 
+    symbols_information,
     download_financial_indexes_safe
 )
 
 # Import utility functions - ensure calculate_atr is present in your utils.py
-from services.utils import convert_gregorian_to_jalali, normalize_value, calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands, calculate_volume_ma, calculate_atr, calculate_smart_money_flow # Added calculate_smart_money_flow here
+from services.utils import convert_gregorian_to_jalali, normalize_value, calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands, calculate_volume_ma, calculate_atr, calculate_smart_money_flow, get_symbol_id # Added calculate_smart_money_flow here
+
+from services.db_utils import bulk_upsert
+from services.jalali_calendar import gregorian_to_jalali, jalali_to_gregorian
+from services.price_store import append_to_price_store
+from services.response_cache import get_response_cache
+from services.ingestion_checkpoints import INGESTION_STAGES, load_finished_stages, record_checkpoint
+from services.data_quality import run_data_quality_checks
+from services.candlestick_scanner import run_candlestick_pattern_scan
+from services.indicator_state import advance_indicator_states, reset_indicator_states
+from services.smart_money_flow import update_smart_money_flow
+from services.bar_resampler import update_resampled_bars, reset_resampled_bars
+from services.indicator_registry import compute_indicators, history_bars, latest_history_records
 
 # تنظیمات لاگینگ برای این ماژول
 import logging
@@ -309,94 +328,196 @@ def _extract_market_type_from_loader_html(html_content):
     return 'نامشخص' # Return a default 'unspecified' market type if nothing is found
 
 
+LOADER_PAGE_URL = 'http://www.tsetmc.com/Loader.aspx?ParTree=111311&i={}'
+LOADER_PAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+}
+
+
 def _fetch_page_content(symbol_id):
     """
     Fetches the HTML content for a given symbol_id from TSETMC.
     Uses a standard user-agent to mimic a browser.
+    Served from the response cache while the cached page is fresh (or revalidated with a 304).
     """
-    url = f'http://www.tsetmc.com/Loader.aspx?ParTree=111311&i={symbol_id}'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-    }
-    try:
-        response = http_get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-        # TSETMC content is typically in utf-8, but we can verify
-        content = response.content.decode('utf-8')
-        return content
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching page for symbol ID {symbol_id}: {e}")
+    body, _ = get_response_cache().fetch(LOADER_PAGE_URL.format(symbol_id), 'loader_page', headers=LOADER_PAGE_HEADERS)
+    if body is None:
+        logger.error(f"Error fetching page for symbol ID {symbol_id}.")
         return None
+    # TSETMC content is typically in utf-8, but we can verify
+    return body.decode('utf-8', errors='replace')
 
 
-def get_market_type_for_symbol(symbol_id, symbol_name):
+def _market_type_from_flow(flow):
     """
-    Determines the market type for a given symbol by first trying pytse_client,
-    then falling back to HTML scraping if pytse_client doesn't provide it.
+    Maps a pytse_client flow value to our market type. Older pytse_client versions return
+    the numeric flow code, newer ones the market title; both are accepted.
+    """
+    if isinstance(flow, int) or (isinstance(flow, str) and flow.isdigit()):
+        return MARKET_TYPE_MAP.get(int(flow))
+    if isinstance(flow, str) and flow.strip():
+        return HTML_MARKET_TYPE_MAP.get(flow.strip(), flow.strip())
+    return None
+
+
+def _resolve_market_type(symbol_id, symbol_name):
+    """
+    Returns (market_type, flow) for a symbol: pytse_client's flow first, then the
+    Loader.aspx HTML page. Safe to call from worker threads (no db or app access).
     """
     try:
         # Step 1: Try to get market type from pytse_client
         ticker = Ticker(symbol_name)
-        if hasattr(ticker, 'flow') and isinstance(ticker.flow, int):
-            market_type = MARKET_TYPE_MAP.get(ticker.flow, 'نامشخص')
-            logger.debug(f"pytse_client: Determined market type for {symbol_name} (ID: {symbol_id}) as '{market_type}' from flow code {ticker.flow}.")
-            return market_type
-        
+        flow = getattr(ticker, 'flow', None) if ticker is not None else None
+        market_type = _market_type_from_flow(flow)
+        if market_type:
+            logger.debug(f"pytse_client: Determined market type for {symbol_name} (ID: {symbol_id}) as '{market_type}' from flow '{flow}'.")
+            return market_type, str(flow)
+
         # Fallback to HTML scraping if pytse_client doesn't have the flow code or it's not useful
         logger.info(f"pytse_client: No usable flow code for {symbol_name} (ID: {symbol_id}). Falling back to HTML scraping.")
-        html_content = _fetch_page_content(symbol_id)
-        if html_content:
-            return _extract_market_type_from_loader_html(html_content)
-        else:
-            logger.warning(f"Could not fetch HTML content for {symbol_name} (ID: {symbol_id}). Market type cannot be determined.")
-            return 'نامشخص'
+        market_type = get_response_cache().fetch_parsed(
+            LOADER_PAGE_URL.format(symbol_id), 'loader_page', _extract_market_type_from_loader_html, headers=LOADER_PAGE_HEADERS)
+        if market_type:
+            return market_type, None
+        logger.warning(f"Could not fetch HTML content for {symbol_name} (ID: {symbol_id}). Market type cannot be determined.")
+        return 'نامشخص', None
     except Exception as e:
         logger.error(f"Error in get_market_type_for_symbol for {symbol_name} (ID: {symbol_id}): {e}")
-        return 'نامشخص'
+        return 'نامشخص', None
+
+
+def get_market_type_for_symbol(symbol_id, symbol_name):
+    """
+    Determines the market type for a given symbol by first trying pytse_client,
+    then falling back to HTML scraping if pytse_client doesn't provide it.
+    """
+    return _resolve_market_type(symbol_id, symbol_name)[0]
+
+
+def _load_market_type_cache(cache_path):
+    """Reads the {symbol_id: {'flow': ..., 'market_type': ...}} cache file; missing or invalid files give {}."""
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable market type cache {cache_path}: {e}")
+        return {}
+
+
+def _save_market_type_cache(cache_path, cache):
+    """Writes the market type cache atomically (temp file + rename)."""
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write market type cache {cache_path}: {e}")
+
+
+def resolve_market_types(symbols, workers=None, cache_path=None):
+    """
+    Batch market type resolution for [(symbol_id, symbol_name), ...].
+    Symbols already in the local cache (Config.MARKET_TYPE_CACHE_FILE) are answered without
+    network access; the rest are resolved concurrently and successful results are added to
+    the cache, so re-runs only hit TSETMC for symbols that are still unknown.
+
+    Returns:
+        Dict[str, Tuple[str, str]]: symbol_id -> (market_type, flow).
+    """
+    cache_path = cache_path or current_app.config.get('MARKET_TYPE_CACHE_FILE')
+    workers = workers or current_app.config.get('DATA_UPDATE_FETCH_WORKERS', 8)
+    cache = _load_market_type_cache(cache_path) if cache_path else {}
+
+    resolved = {}
+    to_fetch = []
+    for symbol_id, symbol_name in symbols:
+        cached = cache.get(str(symbol_id))
+        if cached and cached.get('market_type'):
+            resolved[symbol_id] = (cached['market_type'], cached.get('flow'))
+        else:
+            to_fetch.append((symbol_id, symbol_name))
+    logger.info(f"Market types: {len(resolved)} symbols from cache, {len(to_fetch)} to resolve online.")
+
+    if to_fetch:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='market-type') as pool:
+            futures = {pool.submit(_resolve_market_type, symbol_id, symbol_name): symbol_id
+                       for symbol_id, symbol_name in to_fetch}
+            for i, future in enumerate(as_completed(futures), start=1):
+                symbol_id = futures[future]
+                market_type, flow = future.result()
+                resolved[symbol_id] = (market_type, flow)
+                if market_type and market_type != 'نامشخص':
+                    cache[str(symbol_id)] = {'flow': flow, 'market_type': market_type}
+                if i % 100 == 0:
+                    logger.info(f"Market types resolved online: {i}/{len(to_fetch)}.")
+                    if cache_path:
+                        _save_market_type_cache(cache_path, cache)
+
+        if cache_path:
+            _save_market_type_cache(cache_path, cache)
+    return resolved
+
+
+def _list_all_symbols():
+    """
+    Returns [(symbol_name, symbol_id)] for all tickers: pytse_client's all_tickers() when the
+    installed version provides it, otherwise the symbol list bundled with pytse_client.
+    """
+    tickers = all_tickers()
+    if tickers:
+        listing = []
+        for symbol_name, ticker_obj in tickers.items():
+            get_id = getattr(ticker_obj, 'get_tse_id', None)
+            listing.append((symbol_name, get_id() if get_id else getattr(ticker_obj, 'index', None)))
+        return listing
+    return [(symbol_name, info.get('index')) for symbol_name, info in symbols_information().items()]
 
 
 def populate_all_symbols_initial():
     """
     Populates the ComprehensiveSymbolData table with all unique symbols from TSETMC.
     This function should be run as a one-time initial population.
-    It fetches all tickers and then determines their market type.
+    Existing symbol IDs are loaded with a single query; market types of the new symbols are
+    resolved in one concurrent, cached batch (see resolve_market_types).
     It returns the number of symbols added and a message.
     """
     try:
         current_app.logger.info("Starting initial population of all symbols.")
-        tickers = all_tickers()
-        if not tickers:
+        listing = _list_all_symbols()
+        if not listing:
             return 0, "No tickers found from pytse_client."
 
-        added_count = 0
-        total_symbols = len(tickers)
-        for i, (symbol_name, ticker_obj) in enumerate(tickers.items()):
-            symbol_id = ticker_obj.get_tse_id()
+        existing_ids = {symbol_id for (symbol_id,) in db.session.query(ComprehensiveSymbolData.symbol_id)}
+        new_symbols = {}
+        for symbol_name, symbol_id in listing:
             if not symbol_id:
                 current_app.logger.warning(f"Skipping symbol '{symbol_name}' as it has no TSE ID.")
                 continue
+            symbol_id = str(symbol_id)
+            if symbol_id not in existing_ids and symbol_id not in new_symbols:
+                new_symbols[symbol_id] = symbol_name
+        current_app.logger.info(f"{len(listing)} tickers listed, {len(new_symbols)} not yet in the database.")
 
-            # Check if symbol already exists
-            existing_symbol = ComprehensiveSymbolData.query.filter_by(symbol_id=symbol_id).first()
-            if not existing_symbol:
-                # Determine market type for the new symbol
-                market_type = get_market_type_for_symbol(symbol_id, symbol_name)
-                
-                new_symbol = ComprehensiveSymbolData(
-                    symbol_id=symbol_id,
-                    symbol_name=symbol_name,
-                    market_type=market_type,
-                    is_active=True
-                )
-                db.session.add(new_symbol)
-                added_count += 1
-                if added_count % 100 == 0:
-                    current_app.logger.info(f"Processed {added_count}/{total_symbols} symbols. Committing so far...")
-                    db.session.commit()
-            
-            # Log progress
-            if (i + 1) % 50 == 0:
-                current_app.logger.info(f"Progress: {i+1}/{total_symbols} symbols checked.")
+        market_types = resolve_market_types(list(new_symbols.items()))
+
+        added_count = 0
+        for symbol_id, symbol_name in new_symbols.items():
+            market_type, flow = market_types.get(symbol_id, ('نامشخص', None))
+            db.session.add(ComprehensiveSymbolData(
+                symbol_id=symbol_id,
+                symbol_name=symbol_name,
+                market_type=market_type,
+                flow=flow,
+            ))
+            added_count += 1
+            if added_count % 500 == 0:
+                current_app.logger.info(f"Processed {added_count}/{len(new_symbols)} symbols. Committing so far...")
+                db.session.commit()
 
         db.session.commit()
         final_message = f"Initial symbol population finished. {added_count} new symbols added to the database."
@@ -409,44 +530,40 @@ def populate_all_symbols_initial():
         return 0, error_message
 
 
-def _fetch_historical_data(symbol_name, days_limit=None):
+def _fetch_historical_data(symbol_name, days_limit=None, symbol_id=None, since_date=None):
     """
     Fetches historical data for a given symbol using pytse_client.
-    Returns a pandas DataFrame.
+    Returns a pandas DataFrame in pytse_client's history layout
+    (date, open, high, low, adjClose, close, yesterday, volume, value, count),
+    which _prepare_historical_records maps onto stock_data.
+
+    When symbol_id and since_date (the last stored date) are given, only the missing days
+    are requested (pytse_wrapper.download_since). If the delta cannot be used, e.g. because
+    a price adjustment changed earlier prices, the whole adjusted history is downloaded
+    instead, so every stored row is rewritten on the same price basis.
     """
     try:
-        # Use a reasonable days_limit if not specified to prevent overly long requests
-        days = days_limit if days_limit is not None else 365
-        
-        # Get data with the specified number of days
-        df = download(symbols=[symbol_name], write_to_csv=False, adjust=True, days_limit=days)
-        
-        if df.empty or symbol_name not in df.columns.get_level_values(0):
-            logger.warning(f"No historical data found for {symbol_name} in the last {days} days.")
+        full_history = False
+        if symbol_id and since_date:
+            df = download_since(symbol_id, since_date)
+            if df is not None:
+                logger.debug(f"Fetched {df.shape[0]} new rows for {symbol_name} since {since_date}.")
+                return df
+            # Stored prices may need re-adjusting: rewrite all of them, not just the latest rows,
+            # or the older ones would stay on the pre-adjustment basis
+            full_history = True
+        else:
+            # Use a reasonable days_limit if not specified to prevent overly long requests
+            days_limit = days_limit if days_limit is not None else 365
+
+        data = download(symbols=[symbol_name], write_to_csv=False, adjust=True, days_limit=days_limit,
+                        full_history=full_history)
+        df = data.get(symbol_name) if isinstance(data, dict) else data
+        if df is None or df.empty:
+            logger.warning(f"No historical data found for {symbol_name}.")
             return pd.DataFrame()
 
-        # Clean up the DataFrame
-        df.columns = df.columns.get_level_values(1)
-        df = df.reset_index().rename(columns={'index': 'date'})
-        df['date'] = pd.to_datetime(df['date'])
-        
-        # Calculate `close` price if `adj_close` is available.
-        # This is important as some indicators use `close` and some use `adj_close`.
-        # pytse_client's `close` is adjusted already, but we will add a raw `close` for clarity.
-        # However, the library behavior seems to provide an adjusted close, so we will use it as is.
-        # The column is named 'adj_close' by the library, which is what we need.
-        df.rename(columns={'adj_close': 'close'}, inplace=True)
-        
-        # Add a new column for `value` which is `close * volume` for later calculations
-        df['value'] = df['close'] * df['volume']
-
-        # Ensure all required columns are present. If not, fill with 0s or NaNs.
-        required_cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'value']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = np.nan
-        
-        df = df[required_cols]
+        df = df.reset_index(drop=True)
         logger.debug(f"Fetched historical data for {symbol_name}: {df.shape[0]} rows.")
         return df
     except Exception as e:
@@ -454,52 +571,120 @@ def _fetch_historical_data(symbol_name, days_limit=None):
         return pd.DataFrame()
 
 
-def _update_or_create_historical_data(symbol_id, symbol_name, df, session):
+def _get_last_stored_dates(symbol_ids=None):
+    """
+    Returns {symbol_id: last stored stock_data date} with one grouped query,
+    optionally restricted to symbol_ids.
+    """
+    query = db.session.query(HistoricalData.symbol_id, func.max(HistoricalData.date))
+    if symbol_ids is not None:
+        query = query.filter(HistoricalData.symbol_id.in_(list(symbol_ids)))
+    return dict(query.group_by(HistoricalData.symbol_id).all())
+
+
+# Column names produced by pytse_client / the tickers_data CSVs -> stock_data columns.
+# pytse_client names the final (closing) price 'adjClose' and the last traded price 'close'.
+PYTSE_HISTORY_COLUMN_MAP = {
+    'adjClose': 'close',
+    'close': 'final',
+    'count': 'num_trades',
+    'yesterday': 'yesterday_price',
+}
+
+HISTORICAL_PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'final', 'yesterday_price']
+HISTORICAL_INTEGER_COLUMNS = ['volume', 'value', 'num_trades']
+
+
+def _prepare_historical_records(symbol_id, symbol_name, df):
+    """
+    Converts a downloaded history frame into stock_data row dicts, column-wise.
+    Accepts both the frame returned by _fetch_historical_data and raw pytse_client
+    output (adjClose/close/count/yesterday columns). Rows without a valid date are dropped.
     """
-    Updates or creates historical data records for a given symbol from a DataFrame.
+    if 'adjClose' in df.columns:
+        df = df.rename(columns=PYTSE_HISTORY_COLUMN_MAP)
+    else:
+        df = df.rename(columns={k: v for k, v in PYTSE_HISTORY_COLUMN_MAP.items() if k != 'close'})
+
+    frame = pd.DataFrame({'date': pd.to_datetime(df['date'], errors='coerce')})
+    for col in HISTORICAL_PRICE_COLUMNS + HISTORICAL_INTEGER_COLUMNS:
+        if col in df.columns:
+            frame[col] = pd.to_numeric(df[col], errors='coerce').replace([np.inf, -np.inf], np.nan)
+    frame = frame.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last')
+    if frame.empty:
+        return []
+
+    frame['jdate'] = gregorian_to_jalali(frame['date'])
+    frame['date'] = frame['date'].dt.date
+    frame = frame.dropna(subset=['jdate'])
+    frame['symbol_id'] = symbol_id
+    frame['symbol_name'] = symbol_name
+
+    # Build plain-Python column lists (NaN -> None) and zip them into row dicts
+    columns = list(frame.columns)
+    column_values = []
+    for col in columns:
+        values = frame[col].tolist()
+        if col in HISTORICAL_INTEGER_COLUMNS:
+            values = [None if v != v else int(round(v)) for v in values]
+        elif col in HISTORICAL_PRICE_COLUMNS:
+            values = [None if v != v else v for v in values]
+        column_values.append(values)
+    return [dict(zip(columns, row)) for row in zip(*column_values)]
+
+
+def reset_derived_history(session, rewritten_from):
+    """
+    Called by every stock_data write path that rewrote stored bars (a re-adjusted download,
+    an overwriting import, corrected rows): drops what was derived incrementally from the old
+    values (indicator states, weekly/monthly candles), so the next run rebuilds it from those
+    dates. Does not commit.
+
+    Args:
+        rewritten_from (dict): {symbol_id: earliest rewritten bar date}.
+    """
+    if rewritten_from:
+        reset_indicator_states(session, rewritten_from)
+        reset_resampled_bars(session, rewritten_from)
+
+
+def _update_or_create_historical_data(symbol_id, symbol_name, df, session, commit=True, written_records=None,
+                                      last_stored_date=None):
+    """
+    Upserts historical data records for a given symbol from a DataFrame.
+    The frame is converted column-wise and written with one batched native upsert
+    (see services.db_utils.bulk_upsert), so re-downloaded days overwrite the stored rows.
+    last_stored_date is the symbol's last stock_data date before this write; rows at or before
+    it rewrite stored history (e.g. after a price adjustment), see reset_derived_history.
+    With commit=False the caller owns the transaction: nothing is committed and
+    errors are re-raised instead of rolling back the session. The written rows are then
+    added to written_records (if given) for the caller to append to the price store once
+    its commit succeeded; with commit=True they are appended after the commit here.
     """
     if df.empty:
         return 0, f"No data to update for {symbol_name}."
 
-    added_count = 0
-    updated_count = 0
-
     try:
-        # Determine the last recorded date for the symbol
-        last_date = session.query(func.max(HistoricalData.date)).filter_by(symbol_id=symbol_id).scalar()
-        
-        # Filter the DataFrame to only include new data
-        if last_date:
-            df = df[df['date'] > last_date]
-        
-        if df.empty:
-            return 0, f"Historical data for {symbol_name} is already up to date."
-
-        # Process and add new records
-        for index, row in df.iterrows():
-            gregorian_date = row['date'].date()
-            jalali_date = convert_gregorian_to_jalali(gregorian_date)
-            
-            new_record = HistoricalData(
-                symbol_id=symbol_id,
-                date=gregorian_date,
-                jalali_date=jalali_date,
-                open_price=normalize_value(row['open']),
-                high_price=normalize_value(row['high']),
-                low_price=normalize_value(row['low']),
-                close_price=normalize_value(row['close']),
-                volume=normalize_value(row['volume']),
-                value=normalize_value(row['value']),
-                count=normalize_value(row.get('count', 0)) # Assuming 'count' might not always be present
-            )
-            session.add(new_record)
-            added_count += 1
-        
-        session.commit()
-        
-        return added_count, f"Historical data for {symbol_name} updated successfully. {added_count} new records added, {updated_count} records updated."
+        records = _prepare_historical_records(symbol_id, symbol_name, df)
+        if not records:
+            return 0, f"No valid historical rows to update for {symbol_name}."
+
+        written_count = bulk_upsert(session, HistoricalData, records, index_elements=['symbol_id', 'date'])
+        first_date = min(record['date'] for record in records)
+        if last_stored_date is not None and first_date <= last_stored_date:
+            reset_derived_history(session, {symbol_id: first_date})
+
+        if commit:
+            session.commit()
+            append_to_price_store(records)
+        elif written_records is not None:
+            written_records.extend(records)
+
+        return written_count, f"Historical data for {symbol_name} updated successfully. {written_count} records upserted."
     
     except Exception as e:
+        if not commit:
+            raise
         session.rollback()
         logger.error(f"Error updating historical data for {symbol_name}: {e}")
         return 0, f"An error occurred while updating historical data for {symbol_name}."
@@ -511,8 +696,9 @@ def update_historical_data_for_symbol(symbol_id, symbol_name, days_limit=365):
     """
     try:
         logger.info(f"Updating historical data for {symbol_name}...")
-        df = _fetch_historical_data(symbol_name, days_limit)
-        added_count, msg = _update_or_create_historical_data(symbol_id, symbol_name, df, db.session)
+        since_date = _get_last_stored_dates([symbol_id]).get(symbol_id)
+        df = _fetch_historical_data(symbol_name, days_limit, symbol_id=symbol_id, since_date=since_date)
+        added_count, msg = _update_or_create_historical_data(symbol_id, symbol_name, df, db.session, last_stored_date=since_date)
         logger.info(f"Historical data update for {symbol_name}: {msg}")
         return True, msg
     except Exception as e:
@@ -522,100 +708,26 @@ def update_historical_data_for_symbol(symbol_id, symbol_name, days_limit=365):
 
 def _update_technical_indicators(symbol_id, symbol_name, days_limit=365, session=db.session):
     """
-    Calculates and updates technical indicators for a given symbol.
+    Calculates and updates technical indicators for a given symbol: the last `days_limit` bars,
+    loaded with the warm-up TECHNICAL_INDICATORS declare in services/indicator_registry.
     """
     try:
         logger.info(f"Calculating and updating technical indicators for {symbol_name}...")
-        
-        # Fetch existing historical data from the database
-        query = session.query(HistoricalData).filter_by(symbol_id=symbol_id).order_by(HistoricalData.date)
-        
-        # Apply a days_limit to the query if it's specified, to prevent fetching too much data
-        if days_limit is not None:
-            # We need enough data to calculate indicators (e.g., 200 days for long-term SMA)
-            # Fetch a bit more than the days_limit to ensure calculations are correct
-            start_date = date.today() - timedelta(days=days_limit + 100) # Buffer of 100 days
-            query = query.filter(HistoricalData.date >= start_date)
-            
-        historical_records = query.all()
-        
-        if not historical_records:
+
+        hist_df = _load_indicator_history(symbol_id, days_limit)
+        if hist_df.empty:
             logger.warning(f"No historical data found for {symbol_name} to calculate indicators.")
             return 0, f"No historical data to calculate technical indicators for {symbol_name}."
 
-        # Convert records to a DataFrame for easier calculation
-        df = pd.DataFrame([rec.__dict__ for rec in historical_records])
-        df = df.sort_values('date')
-        df['date'] = pd.to_datetime(df['date'])
-        
-        # Calculate indicators
-        df['rsi'] = calculate_rsi(df['close_price'])
-        df['macd'], df['macd_signal'] = calculate_macd(df['close_price'])
-        df['sma_20'] = calculate_sma(df['close_price'], window=20)
-        df['sma_50'] = calculate_sma(df['close_price'], window=50)
-        df['sma_200'] = calculate_sma(df['close_price'], window=200)
-        df['bollinger_upper'], df['bollinger_middle'], df['bollinger_lower'] = calculate_bollinger_bands(df['close_price'])
-        df['volume_ma'] = calculate_volume_ma(df['volume'])
-        df['atr'] = calculate_atr(df['high_price'], df['low_price'], df['close_price'])
-        df['smf'] = calculate_smart_money_flow(df['close_price'], df['volume'])
-
-        # Now, update the database with the calculated indicators
-        added_count = 0
-        
-        # Get the last date for technical indicators to update only new ones
-        last_indicator_date = session.query(func.max(TechnicalIndicatorData.date)).filter_by(symbol_id=symbol_id).scalar()
-        
-        # Filter the DataFrame to only include new data points for indicators
-        if last_indicator_date:
-            df = df[df['date'].dt.date > last_indicator_date]
-        
-        if df.empty:
+        db_symbol_id = _resolve_db_symbol_id(symbol_id)
+        if not db_symbol_id:
+            return 0, f"Symbol {symbol_name} not found."
+
+        hist_df = _compute_technical_indicators(hist_df, symbol_name, symbol_id, output_bars=days_limit)
+        added_count = _save_technical_indicators(db_symbol_id, hist_df, session)
+        if not added_count:
             return 0, f"Technical indicators for {symbol_name} are already up to date."
 
-        for index, row in df.iterrows():
-            gregorian_date = row['date'].date()
-            jalali_date = convert_gregorian_to_jalali(gregorian_date)
-            
-            # Use `merge` to check for existing record and update, otherwise add new one
-            existing_indicator = session.query(TechnicalIndicatorData).filter_by(symbol_id=symbol_id, date=gregorian_date).first()
-            
-            if existing_indicator:
-                # Update existing record
-                existing_indicator.rsi = row['rsi']
-                existing_indicator.macd = row['macd']
-                existing_indicator.macd_signal = row['macd_signal']
-                existing_indicator.sma_20 = row['sma_20']
-                existing_indicator.sma_50 = row['sma_50']
-                existing_indicator.sma_200 = row['sma_200']
-                existing_indicator.bollinger_upper = row['bollinger_upper']
-                existing_indicator.bollinger_middle = row['bollinger_middle']
-                existing_indicator.bollinger_lower = row['bollinger_lower']
-                existing_indicator.volume_ma = row['volume_ma']
-                existing_indicator.atr = row['atr']
-                existing_indicator.smf = row['smf']
-                # added_count += 1 # We're only adding, not updating for now.
-            else:
-                # Add new record
-                new_indicator = TechnicalIndicatorData(
-                    symbol_id=symbol_id,
-                    date=gregorian_date,
-                    jalali_date=jalali_date,
-                    rsi=row['rsi'],
-                    macd=row['macd'],
-                    macd_signal=row['macd_signal'],
-                    sma_20=row['sma_20'],
-                    sma_50=row['sma_50'],
-                    sma_200=row['sma_200'],
-                    bollinger_upper=row['bollinger_upper'],
-                    bollinger_middle=row['bollinger_middle'],
-                    bollinger_lower=row['bollinger_lower'],
-                    volume_ma=row['volume_ma'],
-                    atr=row['atr'],
-                    smf=row['smf']
-                )
-                session.add(new_indicator)
-                added_count += 1
-        
         session.commit()
         return added_count, f"Technical indicators for {symbol_name} updated successfully. {added_count} new records added."
     
@@ -637,10 +749,94 @@ def update_technical_data_for_symbol(symbol_id, symbol_name, days_limit=365):
         return False, f"Full technical data update failed due to an internal error."
 
 
+# (label in the first cell, field, type) for the rows of the fundamental page tables.
+# Order matters: the first label contained in a row's first cell wins ('P/E گروه' before 'P/E').
+FUNDAMENTAL_FINANCIAL_FIELDS = [
+    ('سود هر سهم', 'eps', float),
+    ('P/E گروه', 'pe_group', float),
+    ('P/E', 'pe_ratio', float),
+    ('نسبت P/B', 'pb_ratio', float),
+    ('نسبت P/S', 'ps_ratio', float),
+    ('حجم مبنا', 'base_volume', int),
+]
+FUNDAMENTAL_SPEC_FIELDS = [
+    ('قیمت پایانی', 'closing_price', float),
+    ('تعداد سهام', 'total_shares', int),
+]
+
+_INFO_TABLE_XPATH = "//table[contains(concat(' ', normalize-space(@class), ' '), ' InfoTbl ')]"
+
+
+def _single_string(element):
+    """lxml equivalent of BeautifulSoup's Tag.string: the text of an element whose only content is one string."""
+    while True:
+        children = list(element)
+        if not children:
+            return element.text
+        if len(children) > 1 or element.text or children[0].tail:
+            return None
+        element = children[0]
+
+
+def _parse_label_table(tree, div_id, fields, data):
+    """Reads (label, value) rows of the first table inside div#div_id into data."""
+    divs = tree.xpath(f"//div[@id='{div_id}']")
+    tables = divs[0].xpath('.//table') if divs else []
+    if not tables:
+        return
+    for row in tables[0].iter('tr'):
+        cells = row.xpath('.//*[self::td or self::th]')
+        if not cells:
+            continue
+        label = ''.join(cells[0].itertext()).strip()
+        for text, field, cast in fields:
+            if text in label:
+                try:
+                    data[field] = cast(''.join(cells[1].itertext()).strip().replace(',', ''))
+                except (ValueError, IndexError):
+                    data[field] = None
+                break
+
+
+def _parse_fundamental_html(html_content):
+    """
+    Parses key financial metrics from the HTML of a TSETMC fundamental (ParTree=111C1411) page.
+    Uses lxml XPath to visit only the target tables and cells instead of building a
+    BeautifulSoup tree; benchmarks/bench_fundamental_parser.py checks it against the original.
+    Returns a dict (empty if nothing was found).
+    """
+    if isinstance(html_content, bytes):
+        tree = lxml_html.fromstring(html_content, parser=lxml_html.HTMLParser(encoding='utf-8'))
+    else:
+        tree = lxml_html.fromstring(html_content)
+
+    data = {}
+    # "اثرات مالی" (Financial effects) and "مشخصات" (Specifications) tables
+    _parse_label_table(tree, 'MainContent_C2P', FUNDAMENTAL_FINANCIAL_FIELDS, data)
+    _parse_label_table(tree, 'MainContent_C1P', FUNDAMENTAL_SPEC_FIELDS, data)
+
+    # Market value (ارزش بازار) in the header table
+    info_tables = tree.xpath(_INFO_TABLE_XPATH)
+    if info_tables:
+        for row in info_tables[0].iter('tr'):
+            text = _single_string(row)
+            if text and 'ارزش بازار' in text:
+                value_cells = row.xpath("following-sibling::td[1]")
+                if value_cells:
+                    try:
+                        data['market_value'] = int(''.join(value_cells[0].itertext()).strip().replace(',', ''))
+                    except ValueError:
+                        data['market_value'] = None
+                break
+    return data
+
+
 def _get_fundamental_data_from_tsetmc(symbol_id, session):
     """
     Fetches fundamental data from TSETMC's html page for a specific symbol.
     Parses key financial metrics.
+    The page and its parsed result are kept in the response cache (services/response_cache),
+    so an unchanged page is neither downloaded nor parsed again.
     Returns a dict of parsed data or None on failure.
     """
     url = f'http://www.tsetmc.com/Loader.aspx?ParTree=111C1411&i={symbol_id}'
@@ -649,108 +845,11 @@ def _get_fundamental_data_from_tsetmc(symbol_id, session):
     }
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'lxml')
-        
-        data = {}
-        
-        # --- Parsing the "اثرات مالی" (Financial effects) table ---
-        financial_table_div = soup.find('div', id='MainContent_C2P')
-        if financial_table_div:
-            table = financial_table_div.find('table')
-            if table:
-                rows = table.find_all('tr')
-                for row in rows:
-                    cols = row.find_all(['td', 'th'])
-                    cols = [ele.text.strip() for ele in cols]
-                    
-                    # The table has multiple rows with different data
-                    # Let's map based on the label in the first column
-                    if 'سود هر سهم' in cols[0]:
-                        try:
-                            # EPS is in the 2nd column
-                            data['eps'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['eps'] = None
-                    elif 'P/E گروه' in cols[0]:
-                        try:
-                            data['pe_group'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['pe_group'] = None
-                    elif 'P/E' in cols[0]:
-                        try:
-                            data['pe_ratio'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['pe_ratio'] = None
-                    elif 'نسبت P/B' in cols[0]:
-                        try:
-                            data['pb_ratio'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['pb_ratio'] = None
-                    elif 'نسبت P/S' in cols[0]:
-                        try:
-                            data['ps_ratio'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['ps_ratio'] = None
-                    elif 'حجم مبنا' in cols[0]:
-                        try:
-                            # حجم مبنا is an integer, but sometimes has commas
-                            data['base_volume'] = int(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['base_volume'] = None
-
-        # --- Parsing the "مشخصات" (Specifications) and other divs ---
-        # These are usually in `div`s with specific `id`s. We can iterate and find them.
-        specs_div = soup.find('div', id='MainContent_C1P')
-        if specs_div:
-            table = specs_div.find('table')
-            if table:
-                rows = table.find_all('tr')
-                for row in rows:
-                    cols = row.find_all(['td', 'th'])
-                    cols = [ele.text.strip() for ele in cols]
-
-                    if 'قیمت پایانی' in cols[0]:
-                        try:
-                            data['closing_price'] = float(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['closing_price'] = None
-                    elif 'تعداد سهام' in cols[0]:
-                        try:
-                            data['total_shares'] = int(cols[1].replace(',', ''))
-                        except (ValueError, IndexError):
-                            data['total_shares'] = None
-
-        # --- Parsing data from the main header area (usually has a table or spans) ---
-        main_header_table = soup.find('table', class_='InfoTbl')
-        if main_header_table:
-            # Finding the market value (ارزش بازار)
-            market_value_row = main_header_table.find('tr', string=lambda text: 'ارزش بازار' in text)
-            if market_value_row:
-                try:
-                    market_value_td = market_value_row.find_next_sibling('td')
-                    if market_value_td:
-                        data['market_value'] = int(market_value_td.text.strip().replace(',', ''))
-                except (ValueError, IndexError, AttributeError):
-                    data['market_value'] = None
-        
-        # We can also parse from the JavaScript data at the top of the page.
-        # This is a more robust approach for real-time data.
-        # Let's find the `t111C1411_t1` object from script tags.
-        script_tag = soup.find('script', text=lambda text: 't111C1411_t1=' in text)
-        if script_tag:
-            js_code = script_tag.string
-            # A simple regex to extract JSON-like data. Not perfect, but can work.
-            import re
-            match = re.search(r'var t111C1411_t1=(.+?);', js_code)
-            if match:
-                js_data = match.group(1)
-                # This is a raw JavaScript object. It needs careful parsing.
-                # A simple and fragile way is to use eval, but that's a security risk.
-                # A safer way is to replace single quotes with double quotes and parse it.
-                # We'll skip this for now as it's complex and the HTML parsing is sufficient.
-        
+        data = get_response_cache().fetch_parsed(url, 'fundamental_page', _parse_fundamental_html, headers=headers)
+        if data is None:
+            logger.error(f"Error fetching fundamental data page for symbol ID {symbol_id}.")
+            return None
+
         # Check if we have enough data
         if not data:
             logger.warning(f"Fundamental data extraction failed for symbol ID {symbol_id}. No data found.")
@@ -759,17 +858,15 @@ def _get_fundamental_data_from_tsetmc(symbol_id, session):
         logger.debug(f"Successfully fetched fundamental data for {symbol_id}: {data}")
         return data
         
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching fundamental data for symbol ID {symbol_id}: {e}")
-        return None
     except Exception as e:
         logger.error(f"Error parsing fundamental data for symbol ID {symbol_id}: {e}")
         return None
 
 
-def _update_or_create_fundamental_data(symbol_id, data, session):
+def _update_or_create_fundamental_data(symbol_id, data, session, commit=True):
     """
     Updates or creates a fundamental data record for a given symbol.
+    With commit=False the caller owns the transaction (see _update_or_create_historical_data).
     """
     if not data:
         return False, "No data to update."
@@ -811,16 +908,132 @@ def _update_or_create_fundamental_data(symbol_id, data, session):
             session.add(new_record)
             logger.debug(f"Added new fundamental data record for {symbol_id} for today.")
         
-        session.commit()
+        if commit:
+            session.commit()
         return True, "Fundamental data updated successfully."
     
     except Exception as e:
+        if not commit:
+            raise
         session.rollback()
         logger.error(f"Error updating fundamental data for {symbol_id}: {e}")
         return False, "An error occurred while updating fundamental data."
 
 
 
+TECHNICAL_INDICATOR_COLUMNS = [
+    'close_price', 'RSI', 'MACD', 'MACD_Signal', 'MACD_Hist', 'SMA_20', 'SMA_50',
+    'Volume_MA_20', 'Bollinger_High', 'Bollinger_Low', 'Bollinger_MA', 'ATR',
+]
+
+# services/indicator_registry indicators behind TECHNICAL_INDICATOR_COLUMNS
+TECHNICAL_INDICATORS = ['RSI', 'MACD', 'SMA_20', 'SMA_50', 'Volume_MA_20', 'Bollinger', 'ATR']
+
+
+def _load_indicator_history(symbol_id, limit_days=120):
+    """
+    Loads the historical rows used for technical analysis of a symbol as a DataFrame: the
+    latest `limit_days` bars (all of them if None) plus the warm-up bars TECHNICAL_INDICATORS
+    need before them. Returns an empty DataFrame if the symbol has no history.
+    """
+    bars = None if limit_days is None else history_bars(TECHNICAL_INDICATORS, last_values=limit_days)
+    historical_records = latest_history_records(symbol_id, bars)
+    if not historical_records:
+        return pd.DataFrame()
+    return pd.DataFrame([rec.__dict__ for rec in historical_records]).drop(columns=['_sa_instance_state'], errors='ignore')
+
+
+def _compute_technical_indicators(hist_df, symbol_name, symbol_id=None, output_bars=None):
+    """
+    CPU stage of technical analysis: prepares the history frame and adds the indicator
+    columns stored in TechnicalIndicatorData. Pure function (no database access), so it
+    can run in a separate worker process. Indicators go through the shared indicator cache.
+    With output_bars, only the last output_bars rows are returned (the rows before them are
+    the warm-up loaded by _load_indicator_history and are not written).
+    """
+    hist_df = hist_df.copy()
+
+    # Ensure 'jdate' is properly converted for sorting and calculations
+    hist_df['gregorian_date'] = jalali_to_gregorian(hist_df['jdate'])
+    hist_df = hist_df.sort_values(by='gregorian_date', ascending=True).reset_index(drop=True)
+    hist_df = hist_df.dropna(subset=['gregorian_date']) # Drop rows with invalid dates
+
+    # Ensure numeric columns are indeed numeric and fill NaNs
+    numeric_cols = ['close', 'open', 'high', 'low', 'volume', 'final']
+    for col in numeric_cols:
+        if col in hist_df.columns:
+            hist_df[col] = pd.to_numeric(hist_df[col], errors='coerce')
+            # Replace NaN with 0 after conversion
+            hist_df[col] = hist_df[col].replace([np.inf, -np.inf], np.nan).fillna(0)
+        else:
+            logger.warning(f"Column '{col}' not found in historical data for {symbol_name}. This may affect indicator calculations.")
+            hist_df[col] = 0 # Add column with zeros if missing
+
+    # Calculate indicators (one registry pass, cached per symbol and last bar)
+    cache_symbol = symbol_id or symbol_name
+    last_bar_date = hist_df['gregorian_date'].iloc[-1] if not hist_df.empty else None
+    indicators = compute_indicators(hist_df, TECHNICAL_INDICATORS, cache_symbol, last_bar_date)
+    for column in TECHNICAL_INDICATOR_COLUMNS[1:]:
+        hist_df[column] = indicators[column]
+
+    # Bollinger Bands need enough data (typically 20 periods); the kernels leave shorter histories NaN
+    if len(hist_df) < 20:
+        logger.warning(f"Not enough data for Bollinger Bands for {symbol_name}. Setting to NaN.")
+    # ATR (Average True Range) needs at least the previous close
+    if len(hist_df) <= 1:
+        logger.warning(f"Not enough data for ATR for {symbol_name}. Setting to NaN.")
+
+    if output_bars is not None:
+        hist_df = hist_df.iloc[-output_bars:]
+    return hist_df
+
+
+def _resolve_db_symbol_id(symbol_id):
+    """
+    Resolves the symbol_id used in TechnicalIndicatorData once per symbol:
+    an exact ComprehensiveSymbolData.symbol_id match first, then get_symbol_id
+    (symbol name / ISIN / company name lookup).
+    """
+    if db.session.query(ComprehensiveSymbolData.id).filter_by(symbol_id=symbol_id).first():
+        return symbol_id
+    return get_symbol_id(symbol_id)
+
+
+def _save_technical_indicators(db_symbol_id, hist_df, session=db.session):
+    """
+    Writes the indicator rows computed by _compute_technical_indicators, set-based:
+    existing rows for the symbol are loaded in one query and only new or changed
+    rows are upserted in one batch. Does not commit; returns the number of rows written.
+    """
+    frame = hist_df.rename(columns={'close': 'close_price'})
+    frame = frame.dropna(subset=['jdate']).drop_duplicates(subset=['jdate'], keep='last')
+    values = frame[TECHNICAL_INDICATOR_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0.0).astype(float)
+    values.index = frame['jdate'].values
+
+    existing_rows = session.query(
+        TechnicalIndicatorData.jdate,
+        *[getattr(TechnicalIndicatorData, col) for col in TECHNICAL_INDICATOR_COLUMNS]
+    ).filter(
+        TechnicalIndicatorData.symbol_id == db_symbol_id,
+        TechnicalIndicatorData.jdate.in_(values.index.tolist())
+    ).all()
+
+    if existing_rows:
+        existing = pd.DataFrame(existing_rows, columns=['jdate'] + TECHNICAL_INDICATOR_COLUMNS).set_index('jdate')
+        existing = existing.apply(pd.to_numeric, errors='coerce').reindex(values.index)
+        # Rows missing from the table come back as NaN after reindex, so they count as changed
+        is_changed = ~np.isclose(values.values, existing.values, rtol=1e-9, atol=1e-9).all(axis=1)
+        values = values[is_changed]
+
+    if values.empty:
+        return 0
+
+    values = values.reset_index().rename(columns={'index': 'jdate'})
+    values.insert(0, 'symbol_id', db_symbol_id)
+    records = values.to_dict('records')
+    return bulk_upsert(session, TechnicalIndicatorData, records, index_elements=['symbol_id', 'jdate'])
+
+
 def analyze_technical_data_for_symbol(symbol_id, symbol_name, limit_days=120):
     """
     Analyzes technical indicators for a given symbol based on historical data
@@ -836,106 +1049,18 @@ def analyze_technical_data_for_symbol(symbol_id, symbol_name, limit_days=120):
     """
     logger.info(f"Analyzing technical data for {symbol_name} ({symbol_id}).")
     try:
-        # Fetch historical data for technical analysis
-        # Ensure we fetch enough data for indicators (e.g., SMA_50 needs 50 days lookback)
-        historical_records = HistoricalData.query.filter_by(symbol_id=symbol_id)\
-                                                .order_by(HistoricalData.jdate.asc())\
-                                                .limit(limit_days).all()
-
-        if not historical_records:
+        hist_df = _load_indicator_history(symbol_id, limit_days)
+        if hist_df.empty:
             logger.warning(f"No historical data found for technical analysis for {symbol_name} ({symbol_id}).")
             return False, f"No historical data for {symbol_name}."
 
-        hist_df = pd.DataFrame([rec.__dict__ for rec in historical_records]).drop(columns=['_sa_instance_state'], errors='ignore')
-        
-        # Ensure 'jdate' is properly converted for sorting and calculations
-        hist_df['gregorian_date'] = hist_df['jdate'].apply(
-            lambda x: jdatetime.date(*map(int, x.split('-'))).togregorian() if pd.notna(x) and isinstance(x, str) else pd.NaT
-        )
-        hist_df = hist_df.sort_values(by='gregorian_date', ascending=True).reset_index(drop=True)
-        hist_df = hist_df.dropna(subset=['gregorian_date']) # Drop rows with invalid dates
-
-        # Ensure numeric columns are indeed numeric and fill NaNs
-        numeric_cols = ['close', 'open', 'high', 'low', 'volume', 'final']
-        for col in numeric_cols:
-            if col in hist_df.columns:
-                hist_df[col] = pd.to_numeric(hist_df[col], errors='coerce')
-                # Replace NaN with 0 after conversion
-                hist_df[col] = hist_df[col].replace([np.inf, -np.inf], np.nan).fillna(0)
-            else:
-                logger.warning(f"Column '{col}' not found in historical data for {symbol_name}. This may affect indicator calculations.")
-                hist_df[col] = 0 # Add column with zeros if missing
-
-        # Calculate indicators
-        hist_df['RSI'] = calculate_rsi(hist_df['close'])
-        macd, macd_signal, macd_hist = calculate_macd(hist_df['close'])
-        hist_df['MACD'] = macd
-        hist_df['MACD_Signal'] = macd_signal
-        hist_df['MACD_Hist'] = macd_hist
-        hist_df['SMA_20'] = calculate_sma(hist_df['close'], window=20)
-        hist_df['SMA_50'] = calculate_sma(hist_df['close'], window=50)
-        hist_df['Volume_MA_20'] = calculate_volume_ma(hist_df['volume'], window=20)
-        
-        # Bollinger Bands need enough data (typically 20 periods)
-        if len(hist_df) >= 20:
-            hist_df['Bollinger_MA'], hist_df['Bollinger_High'], hist_df['Bollinger_Low'] = calculate_bollinger_bands(hist_df['close'], window=20)
-        else:
-            hist_df['Bollinger_MA'] = np.nan
-            hist_df['Bollinger_High'] = np.nan
-            hist_df['Bollinger_Low'] = np.nan
-            logger.warning(f"Not enough data for Bollinger Bands for {symbol_name}. Setting to NaN.")
-        
-        # ATR (Average True Range) - Ensure 'high', 'low', 'close' are available and numeric
-        if len(hist_df) > 1: # ATR needs at least previous close
-            hist_df['ATR'] = calculate_atr(hist_df['high'], hist_df['low'], hist_df['close'])
-        else:
-            hist_df['ATR'] = np.nan
-            logger.warning(f"Not enough data for ATR for {symbol_name}. Setting to NaN.")
+        db_symbol_id = _resolve_db_symbol_id(symbol_id)
+        if not db_symbol_id:
+            logger.warning(f"Resolved symbol_id not found for {symbol_id}. Skipping technical data update.")
+            return False, f"Symbol {symbol_name} not found."
 
-        # --- MODIFIED: Iterate and save all calculated technical indicator rows ---
-        processed_tech_rows = 0
-        for index, row in hist_df.iterrows():
-            current_jdate_str = row['jdate']
-            
-            # Ensure symbol_id is consistent
-            db_symbol_id = get_symbol_id(symbol_id)
-            if not db_symbol_id:
-                logger.warning(f"Resolved symbol_id not found for {symbol_id}. Skipping technical data update for this row.")
-                continue
-
-            existing_record = TechnicalIndicatorData.query.filter_by(
-                symbol_id=db_symbol_id,
-                jdate=current_jdate_str
-            ).first()
-
-            record_data = {
-                'symbol_id': db_symbol_id,
-                'jdate': current_jdate_str,
-                'close_price': float(row.get('close')) if pd.notna(row.get('close')) else 0.0,
-                'RSI': float(row.get('RSI')) if pd.notna(row.get('RSI')) else 0.0,
-                'MACD': float(row.get('MACD')) if pd.notna(row.get('MACD')) else 0.0,
-                'MACD_Signal': float(row.get('MACD_Signal')) if pd.notna(row.get('MACD_Signal')) else 0.0,
-                'MACD_Hist': float(row.get('MACD_Hist')) if pd.notna(row.get('MACD_Hist')) else 0.0,
-                'SMA_20': float(row.get('SMA_20')) if pd.notna(row.get('SMA_20')) else 0.0,
-                'SMA_50': float(row.get('SMA_50')) if pd.notna(row.get('SMA_50')) else 0.0,
-                'Volume_MA_20': float(row.get('Volume_MA_20')) if pd.notna(row.get('Volume_MA_20')) else 0.0,
-                'Bollinger_High': float(row.get('Bollinger_High')) if pd.notna(row.get('Bollinger_High')) else 0.0,
-                'Bollinger_Low': float(row.get('Bollinger_Low')) if pd.notna(row.get('Bollinger_Low')) else 0.0,
-                'Bollinger_MA': float(row.get('Bollinger_MA')) if pd.notna(row.get('Bollinger_MA')) else 0.0,
-                'ATR': float(row.get('ATR')) if pd.notna(row.get('ATR')) else 0.0,
-            }
-
-            if existing_record:
-                for key, value in record_data.items():
-                    setattr(existing_record, key, value)
-                existing_record.updated_at = datetime.now()
-                db.session.add(existing_record)
-            else:
-                new_record = TechnicalIndicatorData(
-                    **record_data
-                )
-                db.session.add(new_record)
-            processed_tech_rows += 1
+        hist_df = _compute_technical_indicators(hist_df, symbol_name, symbol_id, output_bars=limit_days)
+        processed_tech_rows = _save_technical_indicators(db_symbol_id, hist_df)
 
         db.session.commit()
         logger.info(f"Successfully updated/added {processed_tech_rows} technical indicator data rows for {symbol_name}.")
@@ -966,68 +1091,292 @@ def update_comprehensive_data_for_symbol(symbol_id, symbol_name):
         return False, f"Full fundamental data update failed due to an internal error."
 
 
-def run_full_data_update(days_limit=120):
+# --- Staged pipeline used by run_full_data_update ---
+# fetch (thread pool, network I/O) -> compute (process pool, indicators) -> write (single writer, batched commits)
+
+def _fetch_symbol_payload(symbol_id, symbol_name, days_limit, since_date=None, stages=INGESTION_STAGES):
+    """
+    Network stage of the full data update: downloads historical bars (only the days after
+    since_date when it is known) and fundamental data for one symbol, limited to the
+    stages still pending for it. Runs in a worker thread, so it must not touch db.session or current_app.
+    """
+    return {
+        'symbol_id': symbol_id,
+        'symbol_name': symbol_name,
+        'stages': stages,
+        'historical_df': _fetch_historical_data(symbol_name, days_limit, symbol_id=symbol_id, since_date=since_date)
+                         if 'historical' in stages else None,
+        'fundamental_data': _get_fundamental_data_from_tsetmc(symbol_id, None) if 'fundamental' in stages else None,
+    }
+
+
+def _iter_fetched_payloads(fetch_pool, symbols, days_limit, max_in_flight, last_dates=None):
+    """
+    Submits fetch jobs with at most max_in_flight outstanding downloads and yields
+    payloads in completion order, keeping memory bounded regardless of the symbol count.
+    symbols is a list of (symbol_id, symbol_name, pending_stages).
+    last_dates ({symbol_id: last stored date}) switches symbols to delta downloads.
+    """
+    last_dates = last_dates or {}
+    symbols_iter = iter(symbols)
+    pending = {}
+
+    def _submit_next():
+        for symbol_id, symbol_name, stages in symbols_iter:
+            future = fetch_pool.submit(_fetch_symbol_payload, symbol_id, symbol_name, days_limit, last_dates.get(symbol_id), stages)
+            pending[future] = (symbol_id, symbol_name, stages)
+            return True
+        return False
+
+    while len(pending) < max_in_flight and _submit_next():
+        pass
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            symbol_id, symbol_name, stages = pending.pop(future)
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"Fetch stage failed for {symbol_name} ({symbol_id}): {e}")
+                yield {'symbol_id': symbol_id, 'symbol_name': symbol_name, 'stages': stages,
+                       'historical_df': pd.DataFrame() if 'historical' in stages else None, 'fundamental_data': None}
+            _submit_next()
+
+
+def _write_technical_result(symbol_id, symbol_name, future):
+    """
+    Writer stage for a finished indicator computation. Returns (success, message).
+    """
+    try:
+        hist_df = future.result()
+        db_symbol_id = _resolve_db_symbol_id(symbol_id)
+        if not db_symbol_id:
+            return False, f"Symbol {symbol_name} not found."
+        with db.session.begin_nested():
+            processed_tech_rows = _save_technical_indicators(db_symbol_id, hist_df)
+        return True, f"Successfully analyzed and saved {processed_tech_rows} technical data rows for {symbol_name}."
+    except Exception as e:
+        logger.error(f"Error analyzing technical data for {symbol_name} ({symbol_id}): {e}", exc_info=True)
+        return False, f"Error analyzing technical data for {symbol_name}: {str(e)}"
+
+
+def run_full_data_update(days_limit=120, fetch_workers=None, compute_workers=None, write_batch_size=None,
+                         resume=True, retry_failed=False, incremental_indicators=None):
     """
     Runs a full data update for all symbols: historical, technical, and fundamental.
     This should be run periodically (e.g., daily).
+
+    The work is split into three stages that overlap: a bounded thread pool downloads
+    data from TSETMC, indicator calculations run in a process pool, and the calling
+    thread is the only database writer, committing every `write_batch_size` symbols.
+    Stage sizes default to the DATA_UPDATE_* settings in Config.
+
+    Every symbol/stage outcome is recorded in IngestionCheckpoint and committed with the
+    data it describes. With resume, stages already handled today are skipped, so a run
+    restarted after a crash continues with the unfinished symbols; historical bars are
+    also skipped for symbols whose last stored date is already today.
+
+    With incremental_indicators (Config.INDICATOR_INCREMENTAL_UPDATE), the per-symbol technical
+    stage is replaced by one market-wide pass at the end that advances the stored indicator
+    states (services/indicator_state.py) by the new bars only. The smart money flow metrics
+    of the new bars (services/smart_money_flow.py) are always computed in one pass at the end.
     
     Args:
-        days_limit (int): Number of days to fetch historical data for each symbol.
+        days_limit (int): Number of days to fetch for symbols without stored history; symbols
+            that already have bars only download the days after their last stored date.
+        fetch_workers (int): Number of concurrent network fetches.
+        compute_workers (int): Number of indicator worker processes (1 computes in-process).
+        write_batch_size (int): Number of symbols written per database commit.
+        resume (bool): Skip symbol stages already handled today.
+        retry_failed (bool): When resuming, redo stages that ended as 'failed' or 'no_data' today.
+        incremental_indicators (bool): Advance indicator states instead of recomputing per symbol.
         
     Returns:
         Tuple[int, str]: Total processed count and a summary message.
     """
-    logger.info(f"Starting full data update for all symbols for the last {days_limit} days.")
+    fetch_workers = fetch_workers or current_app.config.get('DATA_UPDATE_FETCH_WORKERS', 8)
+    compute_workers = compute_workers or current_app.config.get('DATA_UPDATE_COMPUTE_WORKERS', 2)
+    write_batch_size = write_batch_size or current_app.config.get('DATA_UPDATE_WRITE_BATCH_SIZE', 50)
+    if incremental_indicators is None:
+        incremental_indicators = current_app.config.get('INDICATOR_INCREMENTAL_UPDATE', True)
+    run_stages = tuple(stage for stage in INGESTION_STAGES if not (incremental_indicators and stage == 'technical'))
+    logger.info(f"Starting full data update for all symbols for the last {days_limit} days "
+                f"(fetch_workers={fetch_workers}, compute_workers={compute_workers}, write_batch_size={write_batch_size}).")
     
+    compute_pool = None
     try:
-        symbols_to_process = ComprehensiveSymbolData.query.all()
+        all_symbols = [(s.symbol_id, s.symbol_name) for s in ComprehensiveSymbolData.query.order_by(ComprehensiveSymbolData.id).all()]
         
-        if not symbols_to_process:
+        if not all_symbols:
             logger.warning("No symbols found in ComprehensiveSymbolData. Please run initial population first.")
             return 0, "No symbols to process."
 
+        # Symbols that already have bars only download the days after their last stored date
+        last_dates = _get_last_stored_dates()
+
+        run_date = date.today()
+        finished_stages = load_finished_stages(run_date, retry_failed=retry_failed) if resume else {}
+        symbols_to_process = []
+        for symbol_id, symbol_name in all_symbols:
+            stages = tuple(
+                stage for stage in run_stages
+                if stage not in finished_stages.get(symbol_id, ())
+                and not (stage == 'historical' and last_dates.get(symbol_id) and last_dates[symbol_id] >= run_date)
+            )
+            if stages:
+                symbols_to_process.append((symbol_id, symbol_name, stages))
+        if len(symbols_to_process) < len(all_symbols):
+            logger.info(f"Resuming: {len(all_symbols) - len(symbols_to_process)} of {len(all_symbols)} symbols are already up to date for {run_date}.")
+
         total_processed_count = 0
-        
-        for symbol in symbols_to_process:
-            # 1. Update Historical Data
-            # آرگومان 'limit_days' به 'days_limit' تغییر یافت تا با تابع update_historical_data_for_symbol هماهنگ شود
-            success_hist, msg_hist = update_historical_data_for_symbol(symbol.symbol_id, symbol.symbol_name, days_limit=days_limit)
-            if success_hist:
-                total_processed_count += 1
-                logger.info(f"Historical data update for {symbol.symbol_name}: {msg_hist}")
+        pending_technical = {}
+        symbols_in_batch = 0
+        # Bars of the current batch, appended to the price store only after the batch commit succeeded
+        price_store_records = []
+
+        if compute_workers > 1:
+            # spawn: the writer thread holds DB connections and the fetch threads are running
+            compute_pool = ProcessPoolExecutor(max_workers=compute_workers, mp_context=multiprocessing.get_context('spawn'))
+
+        def _drain_technical(block):
+            nonlocal total_processed_count
+            if not pending_technical:
+                return
+            if block:
+                done, _ = wait(pending_technical, return_when=FIRST_COMPLETED)
             else:
-                logger.warning(f"Failed historical data update for {symbol.symbol_name}: {msg_hist}")
-
-            # 2. Analyze Technical Data
-            # فراخوانی تابع analyze_technical_data_for_symbol با آرگومان days_limit
-            success_tech, msg_tech = analyze_technical_data_for_symbol(symbol.symbol_id, symbol.symbol_name, limit_days=days_limit)
-            if success_tech:
-                total_processed_count += 1
-                logger.info(f"Technical analysis for {symbol.symbol_name}: {msg_tech}")
-            else:
-                logger.warning(f"Failed technical data analysis for {symbol.symbol_name}: {msg_tech}")
+                done = [f for f in pending_technical if f.done()]
+            for future in done:
+                symbol_id, symbol_name = pending_technical.pop(future)
+                success_tech, msg_tech = _write_technical_result(symbol_id, symbol_name, future)
+                if success_tech:
+                    total_processed_count += 1
+                    logger.info(f"Technical analysis for {symbol_name}: {msg_tech}")
+                else:
+                    logger.warning(f"Failed technical data analysis for {symbol_name}: {msg_tech}")
+                record_checkpoint(db.session, symbol_id, 'technical', run_date,
+                                  status='done' if success_tech else 'failed', message=None if success_tech else msg_tech)
+
+        with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='data-fetch') as fetch_pool:
+            for payload in _iter_fetched_payloads(fetch_pool, symbols_to_process, days_limit, max_in_flight=fetch_workers * 2, last_dates=last_dates):
+                symbol_id, symbol_name, stages = payload['symbol_id'], payload['symbol_name'], payload['stages']
+
+                # 1. Update Historical Data
+                historical_df = payload['historical_df']
+                if 'historical' in stages:
+                    try:
+                        symbol_records = []
+                        with db.session.begin_nested():
+                            added_count, msg_hist = _update_or_create_historical_data(
+                                symbol_id, symbol_name, historical_df, db.session, commit=False, written_records=symbol_records,
+                                last_stored_date=last_dates.get(symbol_id))
+                            last_data_date = None
+                            if not historical_df.empty:
+                                last_data_date = pd.to_datetime(historical_df['date']).max().date()
+                                ComprehensiveSymbolData.query.filter_by(symbol_id=symbol_id).update(
+                                    {'last_historical_update_date': last_data_date}, synchronize_session=False)
+                        price_store_records.extend(symbol_records)
+                        total_processed_count += 1
+                        logger.info(f"Historical data update for {symbol_name}: {msg_hist}")
+                        record_checkpoint(db.session, symbol_id, 'historical', run_date,
+                                          status='done' if added_count else 'no_data', last_data_date=last_data_date)
+                    except Exception as e:
+                        logger.warning(f"Failed historical data update for {symbol_name}: {e}")
+                        record_checkpoint(db.session, symbol_id, 'historical', run_date, status='failed', message=str(e))
+
+                # 2. Analyze Technical Data (computed off-thread, written when ready)
+                try:
+                    hist_df = _load_indicator_history(symbol_id, days_limit) if 'technical' in stages else None
+                    if hist_df is None:
+                        pass
+                    elif hist_df.empty:
+                        logger.warning(f"Failed technical data analysis for {symbol_name}: No historical data for {symbol_name}.")
+                        record_checkpoint(db.session, symbol_id, 'technical', run_date, status='no_data')
+                    else:
+                        if compute_pool is not None:
+                            future = compute_pool.submit(_compute_technical_indicators, hist_df, symbol_name, symbol_id, days_limit)
+                        else:
+                            future = Future()
+                            try:
+                                future.set_result(_compute_technical_indicators(hist_df, symbol_name, symbol_id, days_limit))
+                            except Exception as e:
+                                future.set_exception(e)
+                        pending_technical[future] = (symbol_id, symbol_name)
+                except Exception as e:
+                    logger.warning(f"Failed technical data analysis for {symbol_name}: {e}")
+                    record_checkpoint(db.session, symbol_id, 'technical', run_date, status='failed', message=str(e))
+
+                # 3. Update Fundamental Data
+                fundamental_data = payload['fundamental_data']
+                if 'fundamental' not in stages:
+                    pass
+                elif not fundamental_data:
+                    logger.warning(f"Failed fundamental data update for {symbol_name}: Failed to fetch fundamental data from source.")
+                    record_checkpoint(db.session, symbol_id, 'fundamental', run_date, status='no_data')
+                else:
+                    try:
+                        with db.session.begin_nested():
+                            success_fund, msg_fund = _update_or_create_fundamental_data(symbol_id, fundamental_data, db.session, commit=False)
+                        total_processed_count += 1
+                        logger.info(f"Fundamental data update for {symbol_name}: {msg_fund}")
+                        record_checkpoint(db.session, symbol_id, 'fundamental', run_date)
+                    except Exception as e:
+                        logger.warning(f"Failed fundamental data update for {symbol_name}: {e}")
+                        record_checkpoint(db.session, symbol_id, 'fundamental', run_date, status='failed', message=str(e))
+
+                # Keep the compute stage bounded and write whatever has finished
+                _drain_technical(block=len(pending_technical) >= compute_workers * 2)
+
+                symbols_in_batch += 1
+                if symbols_in_batch >= write_batch_size:
+                    db.session.commit()
+                    append_to_price_store(price_store_records)
+                    price_store_records = []
+                    symbols_in_batch = 0
 
-            # 3. Update Fundamental Data (using the comprehensive update function)
-            success_fund, msg_fund = update_comprehensive_data_for_symbol(symbol.symbol_id, symbol.symbol_name)
-            if success_fund:
-                total_processed_count += 1
-                logger.info(f"Fundamental data update for {symbol.symbol_name}: {msg_fund}")
-            else:
-                logger.warning(f"Failed fundamental data update for {symbol.symbol_name}: {msg_fund}")
+        while pending_technical:
+            _drain_technical(block=True)
+        db.session.commit()
+        append_to_price_store(price_store_records)
+        price_store_records = []
+
+        if incremental_indicators:
+            written, symbol_count = advance_indicator_states(db.session)
+            db.session.commit()
+            total_processed_count += symbol_count
+            logger.info(f"Incremental indicator update: {written} indicator rows written for {symbol_count} symbols.")
+
+        # Real/legal money flow of the new bars, for the whole market in one pass
+        written, symbol_count = update_smart_money_flow(db.session)
+        db.session.commit()
+        logger.info(f"Smart money flow update: {written} rows written for {symbol_count} symbols.")
+
+        # Jalali weekly / monthly candles: the latest period of every symbol is rebuilt with the new bars
+        written, symbol_count = update_resampled_bars(db.session)
+        db.session.commit()
+        logger.info(f"Bar resampling: {written} weekly/monthly candles written for {symbol_count} symbols.")
 
         final_message = f"Full data update summary: Total processed operations: {total_processed_count}. Check logs for details on each symbol."
         current_app.logger.info(final_message)
         return total_processed_count, final_message
 
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error during full data update: {e}", exc_info=True)
         return 0, f"An error occurred during the full data update process: {e}"
+    finally:
+        if compute_pool is not None:
+            compute_pool.shutdown(wait=True, cancel_futures=True)
 
 
 def initial_populate_all_symbols_and_data():
     """
     Initial population of ComprehensiveSymbolData and then fetches historical/technical/fundamental data for them.
     This should be run once to seed the database.
+    Also scheduled nightly; the data update resumes from its checkpoints if a run for today was interrupted.
+    Ends with the market-wide data-quality checks, which refresh the quarantine list used by the screeners,
+    and the candlestick pattern scan of the recent bars.
     """
     current_app.logger.info("Starting initial population of all symbols and their data.")
     
@@ -1039,6 +1388,12 @@ def initial_populate_all_symbols_and_data():
     processed_count, msg_data_update = run_full_data_update(days_limit=365) 
     current_app.logger.info(msg_data_update)
 
+    _, msg_quality = run_data_quality_checks()
+    current_app.logger.info(msg_quality)
+
+    _, msg_candlestick = run_candlestick_pattern_scan()
+    current_app.logger.info(msg_candlestick)
+
     final_message = f"Initial population process finished. Added {total_comp_symbols_added} new symbols and updated data for all symbols. Total data update operations: {processed_count}."
     current_app.logger.info(final_message)
     return total_comp_symbols_added, processed_count, final_message
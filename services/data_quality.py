@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# services/data_quality.py
+# اعتبارسنجی کیفیت داده‌های stock_data برای کل بازار در یک گذر برداری (pandas/numpy) پس از به‌روزرسانی شبانه.
+# نتیجه در جدول data_quality_flags ذخیره می‌شود تا اسکرینرها نمادهای قرنطینه‌شده را با یک پرس‌وجو کنار بگذارند.
+
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from extensions import db
+from models import HistoricalData, DataQualityFlag
+from services.db_utils import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+# check_name -> severity. نمادهای دارای پرچم 'error' قرنطینه می‌شوند؛ 'warning' فقط گزارش می‌شود
+# (توقف نماد در بورس تهران رایج است، پس شکاف بین معاملات به‌تنهایی دلیل قرنطینه نیست).
+QUALITY_CHECKS = {
+    'invalid_close': 'error',     # close خالی یا صفر/منفی
+    'high_below_low': 'error',    # high < low
+    'duplicate_jdate': 'error',   # دو بار با یک jdate (تبدیل تاریخ نادرست)
+    'stale': 'error',             # آخرین بار نماد از آخرین روز معاملاتی بازار عقب‌تر از حد مجاز است
+    'gap': 'warning',             # فاصله دو بار متوالی بیش از حد مجاز روز معاملاتی
+}
+
+DEFAULT_LOOKBACK_DAYS = 120
+DEFAULT_MAX_GAP_DAYS = 5
+DEFAULT_STALE_DAYS = 10
+
+
+def _config_value(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def _load_bars(start_date):
+    """Loads the columns checked here for every symbol since start_date with one query, sorted by symbol then date."""
+    query = db.session.query(
+        HistoricalData.symbol_id, HistoricalData.date, HistoricalData.jdate,
+        HistoricalData.high, HistoricalData.low, HistoricalData.close
+    ).filter(HistoricalData.date >= start_date).order_by(HistoricalData.symbol_id, HistoricalData.date)
+    frame = pd.DataFrame(query.all(), columns=['symbol_id', 'date', 'jdate', 'high', 'low', 'close'])
+    for col in ('high', 'low', 'close'):
+        frame[col] = pd.to_numeric(frame[col], errors='coerce')
+    frame['date'] = pd.to_datetime(frame['date'])
+    return frame
+
+
+def _summarize(symbol_ids, dates, counts, check_name, details):
+    """Groups flagged bars by symbol into DataQualityFlag rows (bad_bars, first/last bad date)."""
+    if len(symbol_ids) == 0:
+        return []
+    summary = pd.DataFrame({'symbol_id': symbol_ids, 'date': dates, 'count': counts}) \
+                .groupby('symbol_id').agg(bad_bars=('count', 'sum'), first=('date', 'min'), last=('date', 'max'))
+    severity = QUALITY_CHECKS[check_name]
+    return [
+        {
+            'symbol_id': symbol_id,
+            'check_name': check_name,
+            'severity': severity,
+            'bad_bars': int(bad_bars),
+            'first_bad_date': first.date() if pd.notna(first) else None,
+            'last_bad_date': last.date() if pd.notna(last) else None,
+            'details': details,
+        }
+        for symbol_id, bad_bars, first, last in zip(summary.index, summary['bad_bars'], summary['first'], summary['last'])
+    ]
+
+
+def find_data_quality_issues(bars, last_dates, max_gap_days=DEFAULT_MAX_GAP_DAYS, stale_days=DEFAULT_STALE_DAYS):
+    """
+    Runs every check over the whole market at once. Pure function (no database access).
+
+    Args:
+        bars (DataFrame): symbol_id, date (datetime64), jdate, high, low, close; sorted by symbol then date.
+        last_dates (dict): {symbol_id: last stored bar date} over the full history, for the stale check.
+        max_gap_days (int): Missing trading days between two bars of a symbol tolerated before a 'gap' flag.
+        stale_days (int): Trading days a symbol may lag the market's latest bar before a 'stale' flag.
+
+    Returns:
+        list[dict]: DataQualityFlag rows, one per symbol and failed check.
+    """
+    flags = []
+    if bars.empty:
+        return flags
+
+    symbol_ids = bars['symbol_id'].to_numpy()
+    dates = bars['date'].to_numpy()
+    ones = np.ones(len(bars), dtype=np.int64)
+
+    # Per-bar checks
+    close = bars['close'].to_numpy(dtype=float)
+    mask = ~(close > 0)  # NaN compares False, so missing closes are caught too
+    flags += _summarize(symbol_ids[mask], dates[mask], ones[mask], 'invalid_close', 'close is missing, zero or negative')
+
+    high, low = bars['high'].to_numpy(dtype=float), bars['low'].to_numpy(dtype=float)
+    mask = high < low
+    flags += _summarize(symbol_ids[mask], dates[mask], ones[mask], 'high_below_low', 'high is below low')
+
+    mask = bars.duplicated(subset=['symbol_id', 'jdate'], keep=False).to_numpy()
+    flags += _summarize(symbol_ids[mask], dates[mask], ones[mask], 'duplicate_jdate', 'several bars share one jdate')
+
+    # Gaps, measured in market trading days (the union of dates any symbol traded on)
+    market_dates = np.unique(dates)
+    positions = np.searchsorted(market_dates, dates)
+    same_symbol = np.zeros(len(bars), dtype=bool)
+    same_symbol[1:] = symbol_ids[1:] == symbol_ids[:-1]
+    missing = np.zeros(len(bars), dtype=np.int64)
+    missing[1:] = positions[1:] - positions[:-1] - 1
+    mask = same_symbol & (missing > max_gap_days)
+    flags += _summarize(symbol_ids[mask], dates[mask], missing[mask], 'gap',
+                        f'more than {max_gap_days} trading days without a bar')
+
+    # Staleness, over every symbol with stored history (also those with no bar in the window)
+    if last_dates:
+        stale_ids = np.array(list(last_dates.keys()), dtype=object)
+        stale_last = pd.to_datetime(pd.Series(list(last_dates.values()))).to_numpy()
+        behind = len(market_dates) - np.searchsorted(market_dates, stale_last, side='right')
+        mask = behind > stale_days
+        flags += _summarize(stale_ids[mask], stale_last[mask], behind[mask], 'stale',
+                            f'no bar in the last {stale_days} market trading days')
+
+    return flags
+
+
+def run_data_quality_checks(lookback_days=None, max_gap_days=None, stale_days=None):
+    """
+    Validates the last `lookback_days` of stock_data for all symbols in one vectorized pass
+    and replaces the contents of data_quality_flags with the result.
+    Defaults come from the DATA_QUALITY_* settings in Config.
+
+    Returns:
+        Tuple[int, str]: Number of quarantined symbols and a summary message.
+    """
+    lookback_days = lookback_days or _config_value('DATA_QUALITY_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS)
+    max_gap_days = max_gap_days or _config_value('DATA_QUALITY_MAX_GAP_DAYS', DEFAULT_MAX_GAP_DAYS)
+    stale_days = stale_days or _config_value('DATA_QUALITY_STALE_DAYS', DEFAULT_STALE_DAYS)
+    logger.info(f"Starting data-quality checks (lookback_days={lookback_days}, max_gap_days={max_gap_days}, stale_days={stale_days}).")
+
+    try:
+        bars = _load_bars(date.today() - timedelta(days=lookback_days))
+        last_dates = dict(db.session.query(HistoricalData.symbol_id, func.max(HistoricalData.date))
+                                    .group_by(HistoricalData.symbol_id).all())
+        flags = find_data_quality_issues(bars, last_dates, max_gap_days=max_gap_days, stale_days=stale_days)
+
+        DataQualityFlag.query.delete(synchronize_session=False)
+        bulk_upsert(db.session, DataQualityFlag, flags, index_elements=['symbol_id', 'check_name'])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during data-quality checks: {e}", exc_info=True)
+        return 0, f"An error occurred during the data-quality checks: {e}"
+
+    quarantined = {flag['symbol_id'] for flag in flags if flag['severity'] == 'error'}
+    counts = pd.Series([flag['check_name'] for flag in flags], dtype=object).value_counts().to_dict()
+    message = (f"Data-quality checks finished over {len(bars)} bars of {len(last_dates)} symbols: "
+               f"{len(quarantined)} quarantined, flags per check: {counts or 'none'}.")
+    logger.info(message)
+    return len(quarantined), message
+
+
+def get_quarantined_symbol_ids():
+    """Returns the set of symbol_ids with an 'error' flag from the last data-quality run (one query)."""
+    try:
+        rows = db.session.query(DataQualityFlag.symbol_id).filter(DataQualityFlag.severity == 'error').distinct().all()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not load quarantined symbols, screening all symbols: {e}")
+        return set()
+    return {symbol_id for symbol_id, in rows}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# services/db_utils.py - توابع کمکی برای نوشتن دسته‌ای در پایگاه داده
+
+import logging
+from datetime import datetime
+
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+# تعداد ردیف‌های هر دسته executemany
+DEFAULT_UPSERT_BATCH_SIZE = 1000
+
+
+def bulk_upsert(session, model, records, index_elements, update_columns=None, batch_size=DEFAULT_UPSERT_BATCH_SIZE):
+    """
+    Inserts a list of row dicts into the model's table in batched statements, using the
+    dialect's native upsert: INSERT ... ON CONFLICT on SQLite/PostgreSQL and
+    INSERT ... ON DUPLICATE KEY UPDATE on MySQL. Other dialects fall back to session.merge.
+
+    Args:
+        session: SQLAlchemy session (db.session). The caller commits.
+        model: Mapped model class (e.g. HistoricalData).
+        records (list[dict]): Rows keyed by column name; all rows must share the same keys.
+        index_elements (list[str]): Columns of the primary key / unique constraint to conflict on.
+        update_columns (list[str]): Columns overwritten on conflict. Defaults to every non-key
+            column present in the records; an empty list means conflicting rows are skipped.
+        batch_size (int): Rows per executemany batch.
+
+    Returns:
+        int: Number of rows sent to the database.
+    """
+    if not records:
+        return 0
+
+    table = model.__table__
+    if update_columns is None:
+        update_columns = [col for col in records[0] if col not in index_elements]
+    dialect_name = session.get_bind().dialect.name
+
+    if dialect_name in ('sqlite', 'postgresql'):
+        insert_fn = sqlite.insert if dialect_name == 'sqlite' else postgresql.insert
+        stmt = insert_fn(table)
+        if update_columns:
+            set_ = {col: stmt.excluded[col] for col in update_columns}
+            if 'updated_at' in table.c and 'updated_at' not in set_:
+                set_['updated_at'] = datetime.now()
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    elif dialect_name == 'mysql':
+        stmt = mysql.insert(table)
+        # MySQL has no DO NOTHING; re-assigning a key column is the usual no-op update
+        set_ = {col: stmt.inserted[col] for col in (update_columns or index_elements[:1])}
+        if update_columns and 'updated_at' in table.c and 'updated_at' not in set_:
+            set_['updated_at'] = datetime.now()
+        stmt = stmt.on_duplicate_key_update(set_)
+    else:
+        logger.warning(f"Dialect '{dialect_name}' has no native upsert support here. Falling back to session.merge for {table.name}.")
+        for record in records:
+            session.merge(model(**record))
+        return len(records)
+
+    for start in range(0, len(records), batch_size):
+        session.execute(stmt, records[start:start + batch_size])
+    return len(records)
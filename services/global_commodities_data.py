@@ -3,6 +3,7 @@ import requests
 import logging
 import json
 from flask import current_app
+from services.http_client import get_http_client
 
 # تنظیم لاگینگ
 logger = logging.getLogger(__name__)
@@ -21,7 +22,7 @@ def fetch_global_commodities():
     url = f"https://api.metals.dev/v1/latest?api_key={METALS_DEV_API_KEY}&currency=USD&unit=toz"
     prices = {}
     try:
-        response = requests.get(url, headers={"Accept": "application/json"}, timeout=10)
+        response = get_http_client().get(url, headers={"Accept": "application/json"}, timeout=10)
         response.raise_for_status()
         data = response.json()
 
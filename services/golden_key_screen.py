@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# services/golden_key_screen.py
+# موتور غربال برداری کلید طلایی: آخرین GOLDEN_KEY_HISTORY_BARS بار همه نمادها یک بار در یک MarketPanel بارگذاری و به
+# ماتریس‌های symbols x bars تبدیل می‌شود (راست‌چین؛ ستون آخر آخرین بار هر نماد است). اندیکاتورها با indicator_kernels
+# برای کل بازار یک‌جا حساب می‌شوند و هر فیلتر کلید طلایی یک بردار بولی روی همه نمادهاست؛ امتیاز، رتبه و انتخاب
+# top_n_symbols هم با عملیات آرایه‌ای انجام می‌شود (run_golden_key_analysis_and_save در services/golden_key_service).
+# قواعد فیلترها همان قواعد قبلی تک‌نمادی است؛ توضیح فیلترها برای کاربر در get_golden_key_filter_definitions است.
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from extensions import db
+from services.candlestick_scanner import DOWNTREND_WINDOW, scan_candlestick_patterns
+from services.indicator_kernels import macd_kernel, rsi_kernel, sma_kernel, smart_money_kernel
+from services.indicator_registry import history_bars
+from services.jalali_calendar import gregorian_to_jalali
+from services.market_panel import latest_bars_conditions, load_market_panel
+from services.pattern_kernels import double_bottom_breakout_panel, descending_trendline_breakout_panel
+
+logger = logging.getLogger(__name__)
+
+# Indicators of the filters below (services/indicator_registry); the crossover filters read the last two values
+GOLDEN_KEY_INDICATORS = ['RSI', 'MACD', 'SMA_20', 'SMA_50', 'Volume_MA_5', 'Volume_MA_20', 'Volume_MA_120', 'ATR']
+# Bars loaded per symbol: the indicators' warm-up, and at least the 120 bars of the six-month volume check
+GOLDEN_KEY_HISTORY_BARS = max(history_bars(GOLDEN_KEY_INDICATORS, last_values=2), 120)
+# Symbols with fewer complete bars are not screened
+GOLDEN_KEY_MIN_BARS = 120
+# Jalali months (current one included) of the monthly volume filter
+MONTHLY_VOLUME_PERIODS = 6
+
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+FLOW_COLUMNS = ['buy_i_volume', 'sell_i_volume', 'buy_count_i', 'sell_count_i']
+
+# Filters in evaluation order (the order of satisfied_filters); negative scores are warning signs
+GOLDEN_KEY_FILTERS = [
+    {"name": "فیلتر شکست مقاومت + عبور از MA50", "score": 10, "category": "روند قیمت", "reason": "شکست مقاومت مهم و عبور از میانگین متحرک ۵۰ روزه"},
+    {"name": "واگرایی مثبت RSI + افزایش حجم", "score": 12, "category": "واگرایی", "reason": "واگرایی مثبت RSI و افزایش حجم چشمگیر"},
+    {"name": "تقاطع طلایی MA20/MA50", "score": 15, "category": "میانگین‌ها", "reason": "تقاطع طلایی میانگین‌های متحرک ۲۰ و ۵۰ روزه"},
+    {"name": "کندل چکشی یا دوجی با حجم بالا در کف", "score": 10, "category": "الگوهای کلاسیک", "reason": "تشکیل کندل چکشی یا دوجی با حجم بالا در کف روند نزولی"},
+    {"name": "افزایش قدرت خریدار حقیقی + ورود پول", "score": 18, "category": "جریان وجوه", "reason": "افزایش قدرت خریدار حقیقی و ورود پول هوشمند به سهم"},
+    {"name": "الگوی کف دوقلو + شکست گردن", "score": 15, "category": "الگوهای کلاسیک", "reason": "تشکیل الگوی کف دوقلو و شکست خط گردن"},
+    {"name": "شکست خط روند نزولی با کندل تایید", "score": 13, "category": "روند قیمت", "reason": "شکست خط روند نزولی با کندل تأییدکننده"},
+    {"name": "واگرایی مکدی + تقاطع صعودی", "score": 14, "category": "واگرایی", "reason": "واگرایی مثبت MACD و تقاطع صعودی خط سیگنال"},
+    {"name": "عبور RSI از ناحیه اشباع فروش", "score": 11, "category": "روند قیمت", "reason": "عبور RSI از ناحیه اشباع فروش با افزایش قیمت"},
+    {"name": "میانگین حجم ماه بالاتر از میانگین ۶ماهه + کندل صعودی", "score": 9, "category": "حجم", "reason": "میانگین حجم ماه جاری بالاتر از میانگین ۶ ماهه با کندل صعودی قوی"},
+    {"name": "حمایت شکسته", "score": -8, "category": "روند قیمت", "reason": "شکست حمایت مهم"},
+    {"name": "RSI اشباع خرید", "score": -10, "category": "روند قیمت", "reason": "شاخص قدرت نسبی (RSI) بالای ۷۰ است."},
+    {"name": "تقاطع MACD نزولی", "score": -12, "category": "واگرایی", "reason": "تقاطع نزولی MACD"},
+]
+
+
+def load_golden_key_bars(symbol_ids=None):
+    """
+    The last GOLDEN_KEY_HISTORY_BARS stock_data rows with a price and volume of every symbol (or
+    symbol_ids) in one MarketPanel. Columns are float64: the last close is stored as the
+    recommendation price, and NULL flows stay NaN.
+    """
+    conditions = latest_bars_conditions(db.session, GOLDEN_KEY_HISTORY_BARS, symbol_ids, required=OHLCV_COLUMNS)
+    columns = OHLCV_COLUMNS + FLOW_COLUMNS
+    return load_market_panel(db.session, columns, conditions=conditions, required=OHLCV_COLUMNS,
+                             dtypes={column: np.float64 for column in columns})
+
+
+def _latest_buy_power(symbols, last_jdates, flows, latest_flows):
+    """
+    Individual buy power of each symbol's last bar: the stored smart_money_flow_data row when it is
+    for that bar (see services/smart_money_flow.latest_smart_money_flow), otherwise computed from the bar.
+    """
+    computed = smart_money_kernel(*(flows[column][:, -1] for column in FLOW_COLUMNS))['individual_buy_power']
+    stored = [latest_flows.get(symbol_id) for symbol_id in symbols]
+    return np.array([
+        (np.nan if row['individual_buy_power'] is None else row['individual_buy_power'])
+        if row is not None and row['jdate'] == jdate else value
+        for row, jdate, value in zip(stored, last_jdates, computed)
+    ], dtype=np.float64)
+
+
+def _monthly_volume_averages(symbols, last_jdates, monthly_bars):
+    """
+    Mean daily volume of the current Jalali month and of the last MONTHLY_VOLUME_PERIODS months from
+    the stored monthly candles (services/bar_resampler); NaN for symbols whose candles are missing,
+    too few or not up to their last daily bar.
+    """
+    missing = np.full(len(symbols), np.nan)
+    if not monthly_bars:
+        return missing, missing
+    candles = pd.concat(monthly_bars.values(), ignore_index=True)
+    candles = candles.groupby('symbol_id', sort=False).tail(MONTHLY_VOLUME_PERIODS)
+    months = candles.groupby('symbol_id', sort=False).agg(
+        periods=('volume', 'size'), volume=('volume', 'sum'), bar_count=('bar_count', 'sum'),
+        last_volume=('volume', 'last'), last_bar_count=('bar_count', 'last'), last_jdate=('last_jdate', 'last'),
+    ).reindex(symbols)
+    usable = ((months['periods'] >= MONTHLY_VOLUME_PERIODS) & (months['last_jdate'] == last_jdates)).to_numpy()
+    avg_1_month = (months['last_volume'] / months['last_bar_count']).to_numpy(dtype=np.float64)
+    avg_6_month = (months['volume'] / months['bar_count']).to_numpy(dtype=np.float64)
+    return np.where(usable, avg_1_month, np.nan), np.where(usable, avg_6_month, np.nan)
+
+
+def evaluate_golden_key_filters(bars, latest_flows=None, monthly_bars=None):
+    """
+    Evaluates every filter of GOLDEN_KEY_FILTERS on the last bar of every symbol at once.
+
+    Args:
+        bars (MarketPanel): At least the last GOLDEN_KEY_HISTORY_BARS bars of each symbol with the
+            OHLCV and FLOW columns (see load_golden_key_bars).
+        latest_flows (dict): get_latest_smart_money_flow() result; the buy power is computed from the
+            last bar where it has no row for that bar.
+        monthly_bars (dict): get_latest_resampled_bars('monthly', MONTHLY_VOLUME_PERIODS) result; months
+            are approximated as the last 20 and 120 bars where it has no usable candles.
+
+    Returns:
+        Tuple[DataFrame, Series]: Boolean filter matrix (symbols with at least GOLDEN_KEY_MIN_BARS bars
+        x filter names) and the last close of those symbols.
+    """
+    symbols, counts, last_dates, aligned = bars.to_aligned(OHLCV_COLUMNS + FLOW_COLUMNS, GOLDEN_KEY_HISTORY_BARS)
+    enough = counts >= GOLDEN_KEY_MIN_BARS
+    symbols, last_jdates = symbols[enough], gregorian_to_jalali(last_dates[enough])
+    open_, high, low, close, volume = (aligned[column][enough].astype(np.float64) for column in OHLCV_COLUMNS)
+    flows = {column: aligned[column][enough] for column in FLOW_COLUMNS}
+    names = [definition['name'] for definition in GOLDEN_KEY_FILTERS]
+    if not len(symbols):
+        return pd.DataFrame(columns=names, dtype=bool), pd.Series(dtype=np.float64)
+
+    # Market-wide indicators; column -1 is each symbol's last bar, -2 the one before
+    rsi = rsi_kernel(close)
+    macd, macd_signal, _ = macd_kernel(close)
+    sma_20, sma_50 = sma_kernel(close, 20), sma_kernel(close, 50)
+    volume_ma_5 = sma_kernel(volume, 5)[:, -1]
+    c, c_prev, o, h, l, v = close[:, -1], close[:, -2], open_[:, -1], high[:, -1], low[:, -1], volume[:, -1]
+
+    def hammer():
+        # check_candlestick_patterns only ever reports Hammer (and Bullish Engulfing), never Doji
+        window = [panel[:, -DOWNTREND_WINDOW:].ravel() for panel in (open_, high, low, close)]
+        keys = np.repeat(np.arange(len(symbols)), DOWNTREND_WINDOW)
+        return scan_candlestick_patterns(keys, *window)['Hammer'].reshape(len(symbols), DOWNTREND_WINDOW)[:, -1]
+
+    def monthly_volume():
+        avg_1_month, avg_6_month = _monthly_volume_averages(symbols, last_jdates, monthly_bars)
+        avg_1_month = np.where(np.isnan(avg_1_month), volume[:, -20:].mean(axis=1), avg_1_month)
+        avg_6_month = np.where(np.isnan(avg_6_month), volume[:, -120:].mean(axis=1), avg_6_month)
+        strong_bullish = (h - l > 0) & (c - o > 0.5 * (h - l)) & (c > o)
+        return (avg_1_month > avg_6_month * 1.2) & strong_bullish
+
+    macd_buy = (macd[:, -1] > macd_signal[:, -1]) & (macd[:, -2] <= macd_signal[:, -2])
+    filter_functions = {
+        "فیلتر شکست مقاومت + عبور از MA50": lambda: (c > high[:, -21:-1].max(axis=1)) & (c > sma_50[:, -1]),
+        "واگرایی مثبت RSI + افزایش حجم": lambda: (rsi[:, -1] < 30) & (v > volume_ma_5 * 2.0),
+        "تقاطع طلایی MA20/MA50": lambda: (c > sma_20[:, -1]) & (c > sma_50[:, -1]) & (sma_20[:, -1] > sma_50[:, -1]) &
+                                        (sma_20[:, -2] <= sma_50[:, -2]),
+        "کندل چکشی یا دوجی با حجم بالا در کف": lambda: hammer() & (v > volume_ma_5 * 1.5),
+        "افزایش قدرت خریدار حقیقی + ورود پول": lambda: _latest_buy_power(symbols, last_jdates, flows, latest_flows or {}) > 2.0,
+        "الگوی کف دوقلو + شکست گردن": lambda: double_bottom_breakout_panel(close, volume),
+        # Open prices were never passed to this filter; the close stands in for the open, as it always has
+        "شکست خط روند نزولی با کندل تایید": lambda: descending_trendline_breakout_panel(close, close, high, low, volume),
+        "واگرایی مکدی + تقاطع صعودی": lambda: macd_buy & (c < c_prev) & (macd[:, -1] > macd[:, -2]),
+        "عبور RSI از ناحیه اشباع فروش": lambda: (rsi[:, -1] > 30) & (rsi[:, -2] <= 30) & (c > c_prev),
+        "میانگین حجم ماه بالاتر از میانگین ۶ماهه + کندل صعودی": monthly_volume,
+        "حمایت شکسته": lambda: c < low[:, -21:-1].min(axis=1),
+        "RSI اشباع خرید": lambda: rsi[:, -1] > 70,
+        "تقاطع MACD نزولی": lambda: (macd[:, -1] < macd_signal[:, -1]) & (macd[:, -2] >= macd_signal[:, -2]),
+    }
+
+    passed = {}
+    for name in names:
+        try:
+            with np.errstate(invalid='ignore'):
+                passed[name] = np.asarray(filter_functions[name](), dtype=bool)
+        except Exception as e:
+            logger.warning(f"Error applying filter '{name}' to the market panel: {e}", exc_info=True)
+            passed[name] = np.zeros(len(symbols), dtype=bool)
+    return pd.DataFrame(passed, index=symbols), pd.Series(c, index=symbols)
+
+
+def score_golden_key_filters(passed):
+    """Total score of each symbol: the scores of its passed filters, as one matrix-vector product."""
+    scores = np.array([definition['score'] for definition in GOLDEN_KEY_FILTERS])
+    return pd.Series(passed[[definition['name'] for definition in GOLDEN_KEY_FILTERS]].to_numpy(dtype=np.int64) @ scores,
+                     index=passed.index)
+
+
+def rank_golden_key(scores, top_n_symbols):
+    """
+    Orders symbols by score, highest first; ties keep the order of `scores`. Returns the ordered
+    index and a boolean array flagging the top_n_symbols (the Golden Keys).
+    """
+    order = np.argsort(-scores.to_numpy(), kind='stable')
+    return scores.index[order], np.arange(len(order)) < top_n_symbols
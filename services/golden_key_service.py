@@ -5,7 +5,6 @@ from flask import current_app
 import pandas as pd
 import logging
 from datetime import datetime, timedelta, date
-import jdatetime # Ensure jdatetime is imported for Jalali to Gregorian conversion
 import numpy as np
 import json 
 from sqlalchemy import func 
@@ -14,298 +13,17 @@ from sqlalchemy import func
 logger = logging.getLogger(__name__)
 
 # Import utility functions - ONLY import functions that are actually present in services/utils.py
-from services.utils import (
-    get_today_jdate_str, normalize_value, calculate_rsi, calculate_macd, 
-    calculate_sma, calculate_bollinger_bands, calculate_volume_ma, get_symbol_id,
-    calculate_atr, 
-    calculate_smart_money_flow, # This function is in your provided utils.py
-    check_candlestick_patterns # This function is in your provided utils.py
+from services.utils import get_today_jdate_str, normalize_value
+from services.data_quality import get_quarantined_symbol_ids
+from services.db_utils import bulk_upsert
+from services.smart_money_flow import get_latest_smart_money_flow
+from services.bar_resampler import get_latest_resampled_bars
+from services.jalali_calendar import gregorian_to_jalali, jalali_to_gregorian
+from services.golden_key_screen import (
+    GOLDEN_KEY_FILTERS, GOLDEN_KEY_MIN_BARS, MONTHLY_VOLUME_PERIODS,
+    load_golden_key_bars, evaluate_golden_key_filters, score_golden_key_filters, rank_golden_key,
 )
 
-# --- Helper Functions for Filters ---
-def is_resistance_breakout(df_high, current_close, days_window=20):
-    """
-    Checks for resistance breakout: current close > max high of last `days_window` days.
-    """
-    if len(df_high) < days_window:
-        logger.debug(f"is_resistance_breakout: Not enough data ({len(df_high)} < {days_window})")
-        return False
-    # Get high prices for the last 'days_window' excluding current day
-    recent_highs = df_high.iloc[-days_window-1:-1].max() if days_window + 1 <= len(df_high) else df_high.iloc[:-1].max()
-    result = current_close > recent_highs if pd.notna(current_close) and pd.notna(recent_highs) else False
-    logger.debug(f"Resistance Breakout: current_close={current_close}, recent_highs={recent_highs}, Result={result}")
-    return result
-
-def is_support_breakdown(df_low, current_close, days_window=20):
-    """
-    Checks for support breakdown: current close < min low of last `days_window` days.
-    """
-    if len(df_low) < days_window:
-        logger.debug(f"is_support_breakdown: Not enough data ({len(df_low)} < {days_window})")
-        return False
-    # Get low prices for the last 'days_window' excluding current day
-    recent_lows = df_low.iloc[-days_window-1:-1].min() if days_window + 1 <= len(df_low) else df_low.iloc[:-1].min()
-    result = current_close < recent_lows if pd.notna(current_close) and pd.notna(recent_lows) else False
-    logger.debug(f"Support Breakdown: current_close={current_close}, recent_lows={recent_lows}, Result={result}")
-    return result
-
-def is_high_volume(current_volume, avg_volume, multiplier=1.5):
-    """
-    Checks if current volume is significantly higher than average volume.
-    """
-    result = current_volume > (avg_volume * multiplier) if pd.notna(current_volume) and pd.notna(avg_volume) else False
-    logger.debug(f"High Volume: current_volume={current_volume}, avg_volume={avg_volume}, Result={result}")
-    return result
-
-def is_rsi_oversold(rsi_value, threshold=30):
-    """
-    Checks if RSI indicates oversold conditions.
-    """
-    result = rsi_value < threshold if pd.notna(rsi_value) else False
-    logger.debug(f"RSI Oversold: rsi_value={rsi_value}, Result={result}")
-    return result
-
-def is_rsi_overbought(rsi_value, threshold=70):
-    """
-    Checks if RSI indicates overbought conditions.
-    """
-    result = rsi_value > threshold if pd.notna(rsi_value) else False
-    logger.debug(f"RSI Overbought: rsi_value={rsi_value}, Result={result}")
-    return result
-
-def is_macd_buy_signal(macd_line, signal_line):
-    """
-    Checks for MACD buy signal (MACD crosses above Signal Line).
-    """
-    if macd_line.empty or signal_line.empty or len(macd_line) < 2 or len(signal_line) < 2:
-        logger.debug("MACD Buy Signal: Not enough data for cross-over check.")
-        return False
-    
-    current_macd = macd_line.iloc[-1]
-    current_signal = signal_line.iloc[-1]
-    prev_macd = macd_line.iloc[-2]
-    prev_signal = signal_line.iloc[-2]
-
-    if pd.isna(current_macd) or pd.isna(current_signal) or \
-       pd.isna(prev_macd) or pd.isna(prev_signal):
-        logger.debug("MACD Buy Signal: NaN values encountered.")
-        return False
-
-    result = (current_macd > current_signal) and (prev_macd <= prev_signal)
-    logger.debug(f"MACD Buy Signal: current_macd={current_macd}, current_signal={current_signal}, prev_macd={prev_macd}, prev_signal={prev_signal}, Result={result}")
-    return result
-
-def is_macd_sell_signal(macd_line, signal_line):
-    """
-    Checks for MACD sell signal (MACD crosses below Signal Line).
-    """
-    if macd_line.empty or signal_line.empty or len(macd_line) < 2 or len(signal_line) < 2:
-        logger.debug("MACD Sell Signal: Not enough data for cross-over check.")
-        return False
-
-    current_macd = macd_line.iloc[-1]
-    current_signal = signal_line.iloc[-1]
-    prev_macd = macd_line.iloc[-2]
-    prev_signal = signal_line.iloc[-2]
-
-    if pd.isna(current_macd) or pd.isna(current_signal) or \
-       pd.isna(prev_macd) or pd.isna(prev_signal):
-        logger.debug("MACD Sell Signal: NaN values encountered.")
-        return False
-
-    result = (current_macd < current_signal) and (prev_macd >= prev_signal)
-    logger.debug(f"MACD Sell Signal: current_macd={current_macd}, current_signal={current_signal}, prev_macd={prev_macd}, prev_signal={prev_signal}, Result={result}")
-    return result
-
-# --- Internal Implementations for Complex Filters ---
-
-def _check_double_bottom_pattern(close_prices_array, high_prices_array, volume_array):
-    """
-    Checks for a simplified Double Bottom pattern + Neckline Breakout.
-    Converts input arrays to pandas Series for easier processing.
-    """
-    logger.debug("Checking for Double Bottom pattern (simplified internal implementation).")
-    
-    # Convert numpy arrays to pandas Series
-    close_series = pd.Series(close_prices_array).dropna()
-    high_series = pd.Series(high_prices_array).dropna()
-    volume_series = pd.Series(volume_array).dropna()
-
-    if len(close_series) < 40 or close_series.empty or high_series.empty or volume_series.empty: 
-        logger.debug("Double Bottom: Insufficient or invalid data after conversion/dropna.")
-        return False
-
-    recent_closes = close_series.iloc[-40:]
-    
-    first_half = recent_closes.iloc[:20]
-    if first_half.empty: 
-        logger.debug("Double Bottom: First half of recent closes is empty.")
-        return False
-    bottom1_idx = first_half.idxmin()
-    bottom1_price = first_half.min()
-
-    second_half = recent_closes.iloc[20:]
-    if second_half.empty: 
-        logger.debug("Double Bottom: Second half of recent closes is empty.")
-        return False
-    bottom2_idx = second_half.idxmin()
-    bottom2_price = second_half.min()
-
-    if not (0.95 * bottom1_price <= bottom2_price <= 1.05 * bottom1_price):
-        logger.debug("Double Bottom: Bottoms are not at similar levels.")
-        return False
-
-    # Ensure indices are valid for slicing
-    if bottom1_idx > bottom2_idx: # Ensure bottom1 is before bottom2
-        bottom1_idx, bottom2_idx = bottom2_idx, bottom1_idx # Swap if out of order
-
-    neckline_segment = close_series.loc[bottom1_idx:bottom2_idx]
-    if neckline_segment.empty: 
-        logger.debug("Double Bottom: Neckline segment is empty.")
-        return False
-    neckline_price = neckline_segment.max()
-
-    if close_series.empty or volume_series.empty: # Re-check after potential empty slice
-        return False
-
-    current_close = close_series.iloc[-1]
-    current_volume = volume_series.iloc[-1]
-    
-    if len(volume_series) < 10: # Ensure enough data for avg_volume_recent
-        logger.debug("Double Bottom: Not enough volume data for recent average.")
-        return False
-    
-    avg_volume_recent = volume_series.iloc[-10:].mean() 
-
-    if pd.isna(current_close) or pd.isna(neckline_price) or pd.isna(current_volume) or pd.isna(avg_volume_recent):
-        logger.debug("Double Bottom: NaN values in critical data points.")
-        return False
-
-    if current_close > neckline_price and current_volume > (avg_volume_recent * 1.5):
-        logger.debug(f"Double Bottom detected: Bottom1={bottom1_price:.2f}, Bottom2={bottom2_price:.2f}, Neckline={neckline_price:.2f}, Current Close={current_close:.2f}, Current Volume={current_volume:.0f}")
-        return True
-    
-    return False
-
-def _check_descending_trendline_breakout(close_prices_array, high_prices_array, low_prices_array, volume_array):
-    """
-    Checks for a simplified Descending Trendline Breakout with confirmation candle.
-    Converts input arrays to pandas Series for faster processing.
-    """
-    logger.debug("Checking for Descending Trendline Breakout (simplified internal implementation).")
-    
-    # Convert numpy arrays to pandas Series
-    close_series = pd.Series(close_prices_array).dropna()
-    high_series = pd.Series(high_prices_array).dropna()
-    low_series = pd.Series(low_prices_array).dropna()
-    volume_series = pd.Series(volume_array).dropna()
-
-    if len(close_series) < 30 or close_series.empty or high_series.empty or low_series.empty or volume_series.empty: 
-        logger.debug("Descending Trendline: Insufficient or invalid data after conversion/dropna.")
-        return False
-
-    recent_highs = high_series.iloc[-30:]
-    
-    peaks = recent_highs[recent_highs == recent_highs.rolling(window=3, center=True).max()]
-    peaks = peaks.dropna() 
-    
-    descending_peaks = []
-    if len(peaks) >= 2:
-        # Filter for truly descending peaks
-        for i in range(len(peaks) - 1):
-            if peaks.iloc[i] > peaks.iloc[i+1]:
-                descending_peaks.append((peaks.index[i], peaks.iloc[i]))
-                descending_peaks.append((peaks.index[i+1], peaks.iloc[i+1]))
-        
-        descending_peaks = sorted(list(set(descending_peaks)), key=lambda x: x[0])
-        
-        if len(descending_peaks) >= 2:
-            peak1_idx, peak1_price = descending_peaks[-2]
-            peak2_idx, peak2_price = descending_peaks[-1]
-
-            if peak2_idx <= peak1_idx: # Ensure peaks are chronologically ordered
-                logger.debug("Descending Trendline: Peaks are not in chronological order.")
-                return False
-
-            # Calculate slope of the trendline (price change per index unit)
-            slope = (peak2_price - peak1_price) / (peak2_idx - peak1_idx)
-            
-            # Trendline must be descending (negative slope)
-            if slope >= 0:
-                logger.debug(f"Descending Trendline: Slope is not negative ({slope:.2f}).")
-                return False
-
-            current_idx = close_series.index[-1]
-            projected_trendline_value = peak2_price + slope * (current_idx - peak2_idx)
-
-            current_close = close_series.iloc[-1]
-            current_open = close_series.iloc[-1] 
-            current_volume = volume_series.iloc[-1]
-            
-            if len(volume_series) < 10: # Ensure enough data for avg_volume_recent
-                logger.debug("Descending Trendline: Not enough volume data for recent average.")
-                return False
-            
-            avg_volume_recent = volume_series.iloc[-10:].mean()
-
-            if pd.isna(current_close) or pd.isna(projected_trendline_value) or \
-               pd.isna(current_open) or pd.isna(current_volume) or pd.isna(avg_volume_recent):
-                logger.debug("Descending Trendline: NaN values in critical data points.")
-                return False
-
-
-            # Check for breakout and confirmation candle (strong bullish candle with high volume)
-            if current_close > projected_trendline_value and \
-               current_close > current_open and \
-               abs(current_close - current_open) > (high_series.iloc[-1] - low_series.iloc[-1]) * 0.5 and \
-               current_volume > (avg_volume_recent * 1.5):
-                logger.debug(f"Descending Trendline Breakout detected: Trendline Value={projected_trendline_value:.2f}, Current Close={current_close:.2f}, Current Volume={current_volume:.0f}")
-                return True
-    return False
-
-def _check_monthly_volume_vs_six_month_avg(volume_array, today_candle_data):
-    """
-    Checks if current month's average volume is higher than 6-month average volume
-    combined with a strong bullish candle.
-    Converts input array to pandas Series for faster processing.
-    """
-    logger.debug("Checking for Monthly Volume vs. Six Month Avg (simplified internal implementation).")
-    
-    # Convert numpy array to pandas Series
-    volume_series = pd.Series(volume_array).dropna()
-
-    if len(volume_series) < 120 or volume_series.empty: 
-        logger.debug("Monthly Volume: Insufficient or invalid volume data after conversion/dropna.")
-        return False
-
-    avg_volume_1_month = volume_series.iloc[-20:].mean()
-    avg_volume_6_month = volume_series.iloc[-120:].mean()
-
-    open_t = today_candle_data.get('open')
-    close_t = today_candle_data.get('close')
-    high_t = today_candle_data.get('high')
-    low_t = today_candle_data.get('low')
-
-    is_strong_bullish_candle = False
-    if pd.notna(open_t) and pd.notna(close_t) and pd.notna(high_t) and pd.notna(low_t):
-        body_size = close_t - open_t
-        total_range = high_t - low_t
-        if total_range > 0 and body_size > 0.5 * total_range and close_t > open_t: 
-            is_strong_bullish_candle = True
-    else:
-        logger.debug("Monthly Volume: Missing or NaN candle data for bullish candle check.")
-
-    if pd.isna(avg_volume_1_month) or pd.isna(avg_volume_6_month):
-        logger.debug("Monthly Volume: NaN average volume values.")
-        return False
-
-    if avg_volume_1_month > avg_volume_6_month * 1.2 and is_strong_bullish_candle: 
-        logger.debug(f"Monthly Volume vs. Six Month Avg: 1M Avg={avg_volume_1_month:.0f}, 6M Avg={avg_volume_6_month:.0f}. Strong Bullish Candle: {is_strong_bullish_candle}")
-        return True
-    
-    return False
-
-
 # --- Main Golden Key Logic ---
 
 def run_golden_key_analysis_and_save(top_n_symbols=8): 
@@ -341,313 +59,76 @@ def run_golden_key_analysis_and_save(top_n_symbols=8):
                 db.session.rollback()
                 logger.error(f"Error deleting old fund/rights results: {e}", exc_info=True)
     
-    current_day_results = []
-
+    quarantined_ids = get_quarantined_symbol_ids()
+    candidates = []
     for symbol_data in all_symbols:
-        symbol_id = symbol_data.symbol_id
-        symbol_name = symbol_data.symbol_name 
-
-        if any(keyword in symbol_name for keyword in fund_keywords):
-            logger.debug(f"Skipping {symbol_name}: Identified as an investment fund or right based on keywords. (Symbol ID: {symbol_id})")
-            continue
-        
-        logger.debug(f"Analyzing symbol: {symbol_name} ({symbol_id})")
-
-        historical_records = HistoricalData.query.filter_by(symbol_id=symbol_id).order_by(HistoricalData.jdate.asc()).all()
-        
-        if not historical_records or len(historical_records) < 120: 
-            logger.debug(f"Skipping {symbol_name}: Insufficient historical data ({len(historical_records)} records). Minimum 120 required for complex filters.")
-            continue
-
-        df = pd.DataFrame([r.__dict__ for r in historical_records])
-        
-        if df.empty:
-            logger.debug(f"Skipping {symbol_name}: DataFrame is empty after conversion from historical records.")
-            continue
-
-        if 'jdate' not in df.columns:
-            logger.error(f"Column 'jdate' not found in DataFrame for {symbol_name}. Cannot process dates. Skipping.")
-            continue
-            
-        df['gregorian_date'] = df['jdate'].apply(lambda x: jdatetime.datetime.strptime(x, '%Y-%m-%d').togregorian())
-        df = df.set_index(pd.to_datetime(df['gregorian_date'])) 
-        df = df.sort_index() 
-
-        columns_to_convert = [
-            'open', 'high', 'low', 'close', 'final', 'yesterday_price', 'volume', 'value', 'num_trades',
-            'plc', 'plp', 'pcc', 'pcp', 'mv', 
-            'buy_count_i', 'buy_count_n', 'sell_count_i', 'sell_count_n',
-            'buy_i_volume', 'buy_n_volume', 'sell_i_volume', 'sell_n_volume',
-            'zd1', 'qd1', 'pd1', 'zo1', 'qo1', 'po1',
-            'zd2', 'qd2', 'pd2', 'zo2', 'qo2', 'po2',
-            'zd3', 'qd3', 'pd3', 'zo3', 'qo3', 'po3', 
-            'zd4', 'qd4', 'pd4', 'zo4', 'qo4', 'po4',
-            'zd5', 'qd5', 'pd5', 'zo5', 'qo5', 'po5'
-        ]
-        
-        for col in columns_to_convert:
-            if col in df.columns: 
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            else:
-                logger.warning(f"Column '{col}' not found in DataFrame for {symbol_name}. This might affect calculations.")
-        
-        critical_ohlcv_cols = ['open', 'high', 'low', 'close', 'volume']
-        missing_critical_cols_after_conversion = [col for col in critical_ohlcv_cols if col not in df.columns]
-        if missing_critical_cols_after_conversion:
-            logger.error(f"Critical OHLCV columns missing from DataFrame for {symbol_name} after numeric conversion: {missing_critical_cols_after_conversion}. Skipping analysis for this symbol.")
-            continue 
-        
-        df.dropna(subset=critical_ohlcv_cols, inplace=True)
-
-        if df.empty:
-            logger.debug(f"Skipping {symbol_name}: Historical data became empty after cleaning critical OHLCV NaNs.")
-            continue
-        
-        # Re-check minimum length after dropping NaNs, especially for patterns needing longer history
-        if len(df) < 120: 
-            logger.debug(f"Skipping {symbol_name}: Insufficient historical data ({len(df)} records) after NaN removal for full indicator calculation. Minimum 120 required.")
-            continue
-
-        current_close = df['close'].iloc[-1]
-        current_volume = df['volume'].iloc[-1]
-        
-        if len(df) < 2: 
-            logger.debug(f"Skipping {symbol_name}: Not enough data for candlestick patterns (need at least 2 days).")
-            today_candle_data = {}
-            yesterday_candle_data = {}
-        else:
-            today_candle_data = {
-                'open': df['open'].iloc[-1],
-                'high': df['high'].iloc[-1],
-                'low': df['low'].iloc[-1],
-                'close': df['close'].iloc[-1],
-                'volume': df['volume'].iloc[-1]
-            }
-            yesterday_candle_data = {
-                'open': df['open'].iloc[-2],
-                'high': df['high'].iloc[-2],
-                'low': df['low'].iloc[-2],
-                'close': df['close'].iloc[-2],
-                'volume': df['volume'].iloc[-2]
-            }
-        
-        pe_ratio_val = symbol_data.pe_ratio if hasattr(symbol_data, 'pe_ratio') else np.nan 
-        eps_val = symbol_data.eps if hasattr(symbol_data, 'eps') else np.nan 
-
-        rsi_val = calculate_rsi(df['close']) 
-        macd_line, signal_line, _ = calculate_macd(df['close']) 
-        sma_20 = calculate_sma(df['close'], window=20) 
-        sma_50 = calculate_sma(df['close'], window=50) 
-        volume_ma_5_day = calculate_volume_ma(df['volume'], window=5) 
-        volume_ma_1_month = calculate_volume_ma(df['volume'], window=20) # Approx 1 month (20 trading days)
-        volume_ma_6_month = calculate_volume_ma(df['volume'], window=120) # Approx 6 months (120 trading days)
-        atr_val = calculate_atr(df['high'], df['low'], df['close']) 
-        
-        # --- Call smart money flow calculation (assuming utils.py expects non-_hist names) ---
-        smart_money_flow_df_result = calculate_smart_money_flow(df) 
-        
-        latest_individual_buy_power = np.nan
-        if not smart_money_flow_df_result.empty and 'individual_buy_power' in smart_money_flow_df_result.columns:
-            latest_individual_buy_power = smart_money_flow_df_result['individual_buy_power'].iloc[-1]
+        if symbol_data.symbol_id in quarantined_ids:
+            logger.debug(f"Skipping {symbol_data.symbol_name}: Quarantined by the data-quality checks. (Symbol ID: {symbol_data.symbol_id})")
+        elif any(keyword in symbol_data.symbol_name for keyword in fund_keywords):
+            logger.debug(f"Skipping {symbol_data.symbol_name}: Identified as an investment fund or right based on keywords. (Symbol ID: {symbol_data.symbol_id})")
         else:
-            logger.warning(f"Could not calculate 'individual_buy_power' for {symbol_name}. Result DataFrame from calculate_smart_money_flow was empty or missing column. This might be due to missing or incorrectly named columns in your HistoricalData.")
-        
-        # NEW: Log the latest_individual_buy_power value
-        logger.debug(f"  Individual Buy Power for {symbol_name}: {latest_individual_buy_power:.2f}")
-        # --- End of smart money flow column handling ---
-
-        latest_rsi = rsi_val.iloc[-1] if not rsi_val.empty else np.nan
-        latest_macd = macd_line.iloc[-1] if not macd_line.empty else np.nan
-        latest_signal_line = signal_line.iloc[-1] if not signal_line.empty else np.nan
-        latest_sma_20 = sma_20.iloc[-1] if not sma_20.empty else np.nan 
-        latest_sma_50 = sma_50.iloc[-1] if not sma_50.empty else np.nan 
-        latest_volume_ma_5_day = volume_ma_5_day.iloc[-1] if not volume_ma_5_day.empty else np.nan 
-        latest_volume_ma_1_month = volume_ma_1_month.iloc[-1] if not volume_ma_1_month.empty else np.nan 
-        latest_volume_ma_6_month = volume_ma_6_month.iloc[-1] if not volume_ma_6_month.empty else np.nan 
-        latest_atr = atr_val.iloc[-1] if not atr_val.empty else np.nan
-        
-        satisfied_filters = []
-        total_score = 0
-        reason_phrases = []
-
-        # Filter definitions and their criteria (with updated scores and logic)
-        filter_definitions = {
-            "فیلتر شکست مقاومت + عبور از MA50": {
-                "func": lambda high_df, current_close_val, sma_50_val: is_resistance_breakout(high_df, current_close_val) and pd.notna(sma_50_val) and current_close_val > sma_50_val, 
-                "args": [df['high'], current_close, latest_sma_50], 
-                "score": 10, "category": "روند قیمت", "reason": "شکست مقاومت مهم و عبور از میانگین متحرک ۵۰ روزه"
-            }, 
-            "واگرایی مثبت RSI + افزایش حجم": {
-                "func": lambda rsi_val, vol, vol_ma_5: pd.notna(rsi_val) and is_rsi_oversold(rsi_val, threshold=30) and is_high_volume(vol, vol_ma_5, multiplier=2.0), 
-                "args": [latest_rsi, current_volume, latest_volume_ma_5_day], 
-                "score": 12, "category": "واگرایی", "reason": "واگرایی مثبت RSI و افزایش حجم چشمگیر"
-            }, 
-            "تقاطع طلایی MA20/MA50": {
-                "func": lambda c, sma20, sma50: pd.notna(c) and pd.notna(sma20) and pd.notna(sma50) and \
-                                            c > sma20 and c > sma50 and \
-                                            sma20 > sma50 and \
-                                            (sma_20.iloc[-2] <= sma_50.iloc[-2] if len(sma_20) >= 2 and len(sma_50) >= 2 else False), # Check for actual cross
-                "args": [current_close, latest_sma_20, latest_sma_50], 
-                "score": 15, "category": "میانگین‌ها", "reason": "تقاطع طلایی میانگین‌های متحرک ۲۰ و ۵۰ روزه"
-            }, 
-            "کندل چکشی یا دوجی با حجم بالا در کف": {
-                "func": lambda tcd, ycd, cls_series_arr, vol, vol_ma: ("Hammer" in check_candlestick_patterns(tcd, ycd, cls_series_arr) or "Doji" in check_candlestick_patterns(tcd, ycd, cls_series_arr)) and is_high_volume(vol, vol_ma, multiplier=1.5), 
-                "args": [today_candle_data, yesterday_candle_data, df['close'].values, current_volume, latest_volume_ma_5_day], 
-                "score": 10, "category": "الگوهای کلاسیک", "reason": "تشکیل کندل چکشی یا دوجی با حجم بالا در کف روند نزولی"
-            }, 
-            "افزایش قدرت خریدار حقیقی + ورود پول": {
-                "func": lambda val: pd.notna(val) and val > 2.0, 
-                "args": [latest_individual_buy_power], 
-                "score": 18, "category": "جریان وجوه", "reason": "افزایش قدرت خریدار حقیقی و ورود پول هوشمند به سهم"
-            }, 
-            "الگوی کف دوقلو + شکست گردن": {
-                "func": _check_double_bottom_pattern, 
-                "args": [df['close'].values, df['high'].values, df['volume'].values], 
-                "score": 15, "category": "الگوهای کلاسیک", "reason": "تشکیل الگوی کف دوقلو و شکست خط گردن"
-            }, 
-            "شکست خط روند نزولی با کندل تایید": {
-                "func": _check_descending_trendline_breakout, 
-                "args": [df['close'].values, df['high'].values, df['low'].values, df['volume'].values], 
-                "score": 13, "category": "روند قیمت", "reason": "شکست خط روند نزولی با کندل تأییدکننده"
-            }, 
-            "واگرایی مکدی + تقاطع صعودی": {
-                "func": lambda macd, signal, close_series: is_macd_buy_signal(macd, signal) and \
-                                                        (close_series.iloc[-1] < close_series.iloc[-2] and macd.iloc[-1] > macd.iloc[-2]), 
-                "args": [macd_line, signal_line, df['close']], 
-                "score": 14, "category": "واگرایی", "reason": "واگرایی مثبت MACD و تقاطع صعودی خط سیگنال"
-            }, 
-            "عبور RSI از ناحیه اشباع فروش": {
-                "func": lambda rsi_val, current_close_val, prev_close_val: pd.notna(rsi_val) and rsi_val > 30 and \
-                                                                    (calculate_rsi(df['close'].iloc[:-1]).iloc[-1] <= 30 if len(df['close']) >= 2 else False) and \
-                                                                    current_close_val > prev_close_val, 
-                "args": [latest_rsi, current_close, df['close'].iloc[-2] if len(df['close']) >= 2 else np.nan], 
-                "score": 11, "category": "روند قیمت", "reason": "عبور RSI از ناحیه اشباع فروش با افزایش قیمت"
-            }, 
-            "میانگین حجم ماه بالاتر از میانگین ۶ماهه + کندل صعودی": {
-                "func": _check_monthly_volume_vs_six_month_avg, 
-                "args": [df['volume'].values, today_candle_data], 
-                "score": 9, "category": "حجم", "reason": "میانگین حجم ماه جاری بالاتر از میانگین ۶ ماهه با کندل صعودی قوی"
-            },
-
-            "حمایت شکسته": {"func": is_support_breakdown, "args": [df['low'], current_close], "score": -8, "category": "روند قیمت", "reason": "شکست حمایت مهم"}, 
-            "RSI اشباع خرید": {"func": is_rsi_overbought, "args": [latest_rsi], "score": -10, "category": "روند قیمت", "reason": "شاخص قدرت نسبی (RSI) بالای ۷۰ است."},
-            "تقاطع MACD نزولی": {"func": is_macd_sell_signal, "args": [macd_line, signal_line], "score": -12, "category": "واگرایی", "reason": "تقاطع نزولی MACD"},
-        }
+            candidates.append(symbol_data)
+    symbol_names = {symbol_data.symbol_id: symbol_data.symbol_name for symbol_data in candidates}
+
+    # One panel load and one vectorized pass over all candidates (services/golden_key_screen)
+    bars = load_golden_key_bars(list(symbol_names))
+    passed, last_close = evaluate_golden_key_filters(
+        bars, latest_flows=get_latest_smart_money_flow(),
+        monthly_bars=get_latest_resampled_bars('monthly', MONTHLY_VOLUME_PERIODS))
+    skipped = len(candidates) - len(passed)
+    if skipped:
+        logger.debug(f"Skipped {skipped} symbols with fewer than {GOLDEN_KEY_MIN_BARS} complete historical records.")
+
+    # Ties keep the ComprehensiveSymbolData order, as the per-symbol loop did
+    passed = passed.reindex([symbol_id for symbol_id in symbol_names if symbol_id in passed.index])
+    scores = score_golden_key_filters(passed)
+    ranked_ids, is_golden_key = rank_golden_key(scores, top_n_symbols)
+    filter_names = np.array([definition['name'] for definition in GOLDEN_KEY_FILTERS])
+    filter_reasons = np.array([definition['reason'] for definition in GOLDEN_KEY_FILTERS])
+    passed_matrix = passed.loc[ranked_ids].to_numpy()
 
-        for filter_name, filter_info in filter_definitions.items():
-            try:
-                filter_passed = filter_info["func"](*filter_info["args"])
-                logger.debug(f"    Filter '{filter_name}' evaluation for {symbol_name}: Result={filter_passed}")
-
-                if filter_passed:
-                    satisfied_filters.append(filter_name)
-                    total_score += filter_info["score"]
-                    reason_phrases.append(filter_info["reason"])
-                    logger.debug(f"    Filter '{filter_name}' SATISFIED for {symbol_name}. Score added: {filter_info['score']}")
-                else:
-                    logger.debug(f"    Filter '{filter_name}' NOT SATISFIED for {symbol_name}.")
-
-            except Exception as e:
-                logger.warning(f"Error applying filter '{filter_name}' for {symbol_name}: {e}", exc_info=True)
-        
-        # Initial reason string without status
-        initial_reason_str = ", ".join(reason_phrases) if reason_phrases else "بدون دلیل خاص"
-        
-        symbol_result_data = {
-            "symbol_id": symbol_id,
-            "symbol_name": symbol_name,
-            "jdate": today_jdate_str,
-            "score": total_score,
-            "satisfied_filters": json.dumps(satisfied_filters),
-            "reason": initial_reason_str, # Store the initial reason string
-            "profit_loss_percentage": 0.0, 
-            "recommendation_price": current_close,
-            "recommendation_jdate": today_jdate_str,
-            "final_price": current_close,
-            "status": "active", 
-            "probability_percent": 0.0, 
-            "timestamp": datetime.now()
-        }
-        current_day_results.append(symbol_result_data)
-        logger.debug(f"Analyzed {symbol_name}: Score={total_score}, Filters={satisfied_filters}")
-
-    current_day_results.sort(key=lambda x: x['score'], reverse=True)
-
-    # --- NEW DEBUG LOGGING (Before DB Save) ---
     logger.info("--- Top 10 Symbols after analysis and sorting (before DB save) ---")
-    for idx, res in enumerate(current_day_results[:10]):
-        logger.info(f"  Rank {idx+1}: Symbol: {res['symbol_name']}, Score: {res['score']}, Filters: {json.loads(res['satisfied_filters'])}, Proposed is_golden_key: {idx < top_n_symbols}")
+    for idx, symbol_id in enumerate(ranked_ids[:10]):
+        logger.info(f"  Rank {idx+1}: Symbol: {symbol_names[symbol_id]}, Score: {scores[symbol_id]}, Filters: {filter_names[passed_matrix[idx]].tolist()}, Proposed is_golden_key: {is_golden_key[idx]}")
     logger.info("-----------------------------------------------------------------")
-    # --- END NEW DEBUG LOGGING ---
-
-    new_results_count = 0
-    updated_results_count = 0
-
-    for i, result_data in enumerate(current_day_results):
-        logger.debug(f"Processing for DB save: Symbol: {result_data['symbol_name']}, Index: {i}, Score: {result_data['score']}")
-        existing_result = GoldenKeyResult.query.filter_by(
-            symbol_id=result_data['symbol_id'],
-            jdate=result_data['jdate']
-        ).first()
-
-        is_golden_key_flag = False
-        signal_status = "❌ سیگنال ضعیف یا بی‌اثر"
 
+    timestamp = datetime.now()
+    records = []
+    for idx, symbol_id in enumerate(ranked_ids):
+        score = int(scores[symbol_id])
         # A symbol is a "Golden Key" if it's in the top N, regardless of its score.
-        if i < top_n_symbols: 
-            is_golden_key_flag = True
-            if result_data['score'] >= 50:
+        signal_status = "❌ سیگنال ضعیف یا بی‌اثر"
+        if is_golden_key[idx]:
+            if score >= 50:
                 signal_status = "📈 سیگنال قوی خرید"
-            elif result_data['score'] >= 30: 
+            elif score >= 30:
                 signal_status = "⚠️ احتمال رشد"
-            # If score is < 30, it will remain "❌ سیگنال ضعیف یا بی‌اثر" but still be is_golden_key=True
-            logger.debug(f"  {result_data['symbol_name']} qualifies for is_golden_key=True. Score: {result_data['score']}, Index: {i}, Top N: {top_n_symbols}. Final status: {signal_status}")
-        else:
-            logger.debug(f"  {result_data['symbol_name']} does NOT qualify for is_golden_key=True. Score: {result_data['score']}, Index: {i}, Top N: {top_n_symbols}.")
+        current_close = float(last_close[symbol_id])
+        records.append({
+            "symbol_id": symbol_id,
+            "symbol_name": symbol_names[symbol_id],
+            "jdate": today_jdate_str,
+            "score": score,
+            "satisfied_filters": json.dumps(filter_names[passed_matrix[idx]].tolist()),
+            "reason": ", ".join([f"وضعیت سیگنال: {signal_status}"] + filter_reasons[passed_matrix[idx]].tolist()),
+            "profit_loss_percentage": 0.0,
+            "recommendation_price": current_close,
+            "recommendation_jdate": today_jdate_str,
+            "final_price": current_close,
+            "status": signal_status,
+            "probability_percent": 0.0,
+            "is_golden_key": bool(is_golden_key[idx]),
+            "timestamp": timestamp,
+        })
 
-        # Prepare the final reason string by prepending the status
-        final_reason_parts = []
-        if result_data['reason'] and result_data['reason'] != "بدون دلیل خاص":
-            final_reason_parts = [r.strip() for r in result_data['reason'].split(',') if r.strip()]
-        
-        final_reason_parts.insert(0, f"وضعیت سیگنال: {signal_status}")
-        final_reason_str = ", ".join(final_reason_parts)
-
-        if existing_result:
-            existing_result.score = result_data['score']
-            existing_result.satisfied_filters = result_data['satisfied_filters']
-            existing_result.reason = final_reason_str # Use the final reason string
-            existing_result.is_golden_key = is_golden_key_flag # Explicitly set the flag
-            existing_result.recommendation_price = result_data['recommendation_price']
-            existing_result.recommendation_jdate = result_data['recommendation_jdate']
-            existing_result.final_price = result_data['final_price']
-            existing_result.status = signal_status # Explicitly set the status
-            existing_result.timestamp = datetime.now()
-            db.session.add(existing_result)
-            updated_results_count += 1
-            logger.debug(f"  Updated existing result for {result_data['symbol_name']}. is_golden_key={is_golden_key_flag}, status={signal_status}")
-        else:
-            new_result = GoldenKeyResult(
-                symbol_id=result_data['symbol_id'],
-                symbol_name=result_data['symbol_name'],
-                jdate=result_data['jdate'],
-                score=result_data['score'],
-                satisfied_filters=result_data['satisfied_filters'],
-                reason=final_reason_str, # Use the final reason string
-                profit_loss_percentage=result_data['profit_loss_percentage'],
-                recommendation_price=result_data['recommendation_price'],
-                recommendation_jdate=result_data['recommendation_jdate'],
-                final_price=result_data['final_price'],
-                status=signal_status, # Explicitly set the status for new record
-                probability_percent=result_data['probability_percent'],
-                is_golden_key=is_golden_key_flag, # Explicitly set the flag for new record
-                timestamp=datetime.now()
-            )
-            db.session.add(new_result)
-            new_results_count += 1
-            logger.debug(f"  Created new result for {result_data['symbol_name']}. is_golden_key={is_golden_key_flag}, status={signal_status}")
-        
     try:
+        updated_results_count = GoldenKeyResult.query.filter(GoldenKeyResult.jdate == today_jdate_str,
+                                                             GoldenKeyResult.symbol_id.in_(list(ranked_ids))).count()
+        new_results_count = len(records) - updated_results_count
+        # Existing rows of today keep their name, profit/loss and probability, as before
+        bulk_upsert(db.session, GoldenKeyResult, records, index_elements=['symbol_id', 'jdate'],
+                    update_columns=['score', 'satisfied_filters', 'reason', 'is_golden_key', 'recommendation_price',
+                                    'recommendation_jdate', 'final_price', 'status', 'timestamp'])
         db.session.commit()
         # --- NEW LOGGING AFTER COMMIT ---
         logger.info("--- Verifying is_golden_key status in DB after commit ---")
@@ -794,14 +275,11 @@ def calculate_golden_key_win_rate():
     logger.info("Starting Golden Key Win-Rate calculation and signal status update.")
     
     today_gregorian = datetime.now().date()
-    today_jdate_obj = jdatetime.date.fromgregorian(date=today_gregorian)
-    today_jdate_str = today_jdate_obj.strftime('%Y-%m-%d')
 
     # Fetch all active Golden Key signals that were recommended up to 7 days ago
     # We want to close signals that have been active for at least 7 days
     seven_days_ago_greg = today_gregorian - timedelta(days=7)
-    seven_days_ago_jdate_obj = jdatetime.date.fromgregorian(date=seven_days_ago_greg)
-    seven_days_ago_jdate_str = seven_days_ago_jdate_obj.strftime('%Y-%m-%d')
+    today_jdate_str, seven_days_ago_jdate_str = gregorian_to_jalali([today_gregorian, seven_days_ago_greg])
 
 
     active_golden_key_signals = GoldenKeyResult.query.filter(
@@ -822,13 +300,14 @@ def calculate_golden_key_win_rate():
         update_aggregated_performance_for_today(0, 0, 0.0, 0.0, 0.0)
         return True, "No active Golden Key signals found to evaluate win rate."
 
-    for signal in active_golden_key_signals:
-        try:
-            rec_jdate_obj = jdatetime.date.strptime(signal.recommendation_jdate, '%Y-%m-%d')
-            rec_gregorian_date = rec_jdate_obj.togregorian()
-        except (ValueError, TypeError) as e:
-            logger.error(f"Error parsing recommendation_jdate '{signal.recommendation_jdate}' for signal {signal.symbol_name}: {e}. Skipping signal evaluation.", exc_info=True)
-            continue 
+    # Convert every recommendation date in one lookup instead of parsing them per signal
+    rec_gregorian_dates = jalali_to_gregorian([signal.recommendation_jdate for signal in active_golden_key_signals])
+
+    for signal, rec_timestamp in zip(active_golden_key_signals, rec_gregorian_dates):
+        if pd.isna(rec_timestamp):
+            logger.error(f"Error parsing recommendation_jdate '{signal.recommendation_jdate}' for signal {signal.symbol_name}. Skipping signal evaluation.")
+            continue
+        rec_gregorian_date = rec_timestamp.date()
 
         # Fetch latest historical data for the symbol
         latest_historical_data = HistoricalData.query.filter_by(symbol_id=signal.symbol_id)\
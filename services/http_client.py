@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# services/http_client.py
+# لایه مشترک HTTP برای همه دریافت‌کننده‌های خروجی (TSETMC، BRSAPI، tgju، ...):
+# اتصال‌های keep-alive، محدودکننده نرخ token-bucket برای هر میزبان، بودجه تلاش مجدد با jitter
+# و circuit breaker برای جلوگیری از throttle یا مسدود شدن توسط سرورها هنگام دریافت موازی.
+#
+# تنظیمات از متغیرهای محیطی خوانده می‌شوند تا این ماژول در سرویس مستقل tgju هم (بدون Flask و config.py) کار کند.
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, Timeout, ConnectionError, HTTPError
+
+logger = logging.getLogger(__name__)
+
+# کدهای وضعیتی که ارزش تلاش مجدد دارند
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RequestException):
+    """Raised without contacting the host while its circuit breaker is open."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `capacity` stored.
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of recent requests to a host (plus a small floor), so a
+    struggling server sees a bounded amount of extra load instead of a retry storm.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=3, window_seconds=10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self):
+        """Returns True (and records the retry) if the budget allows another retry."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= max(self.min_retries, self.ratio * len(self._requests)):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects requests for
+    `reset_timeout` seconds; then lets one trial request through (half-open) and closes
+    again on success.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True  # half-open
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Lets another half-open trial through after one that ended without a verdict on the host."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def _parse_host_limits(spec):
+    """Parses 'host=rate:burst,host2=rate' into {host: (rate, burst)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        try:
+            host, values = item.split('=', 1)
+            rate, _, burst = values.partition(':')
+            limits[host.strip().lower()] = (float(rate), float(burst or rate))
+        except ValueError:
+            logger.warning(f"Ignoring invalid HTTP host rate limit entry: '{item}'")
+    return limits
+
+
+class HttpClient:
+    """
+    Shared HTTP client: one keep-alive connection pool, and per host a token bucket,
+    a retry budget and a circuit breaker. Retries use exponential backoff with full jitter.
+    """
+
+    def __init__(self, pool_size=20, timeout=10, max_retries=3, backoff_base=0.5, backoff_max=10.0,
+                 default_rate=5.0, default_burst=10.0, host_limits=None, retry_budget_ratio=0.2,
+                 failure_threshold=5, reset_timeout=60.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.host_limits = host_limits or {}
+        self.retry_budget_ratio = retry_budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_state(self, host):
+        """Returns (bucket, budget, breaker) for a host, created on first use."""
+        with self._hosts_lock:
+            if host not in self._hosts:
+                rate, burst = self.default_rate, self.default_burst
+                # «tsetmc.com» برای cdn.tsetmc.com و www.tsetmc.com هم اعمال می‌شود
+                for pattern, limits in self.host_limits.items():
+                    if host == pattern or host.endswith('.' + pattern):
+                        rate, burst = limits
+                        break
+                self._hosts[host] = (
+                    TokenBucket(rate, burst),
+                    RetryBudget(ratio=self.retry_budget_ratio),
+                    CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                )
+            return self._hosts[host]
+
+    def set_host_limit(self, host, rate, burst=None):
+        """Sets the request rate (per second) and burst of a host (and its subdomains) at runtime."""
+        host = host.lower()
+        burst = burst or max(1.0, rate)
+        with self._hosts_lock:
+            self.host_limits[host] = (float(rate), float(burst))
+            for known_host, (bucket, _, _) in self._hosts.items():
+                if known_host == host or known_host.endswith('.' + host):
+                    with bucket._lock:
+                        bucket.rate, bucket.capacity = float(rate), float(burst)
+                        bucket._tokens = min(bucket._tokens, bucket.capacity)
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        return delay
+
+    def request(self, method, url, headers=None, params=None, timeout=None, max_retries=None, **kwargs):
+        """
+        Sends a request through the host's limiter, budget and breaker.
+
+        Returns:
+            requests.Response for 2xx/3xx responses.
+
+        Raises:
+            CircuitOpenError if the host's breaker is open, HTTPError for non-retryable
+            status codes, or the last network error once retries (or the budget) run out.
+            All of these are requests.exceptions.RequestException subclasses.
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        bucket, budget, breaker = self._host_state(host)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        timeout = timeout or self.timeout
+
+        attempt = 0
+        error = None
+        while True:
+            if not breaker.allow_request():
+                if error is not None:
+                    # مدار در میانه تلاش‌های مجدد همین درخواست باز شد؛ خطای واقعی را برمی‌گردانیم
+                    raise error
+                raise CircuitOpenError(f"Circuit breaker open for {host}; skipping {url}.")
+
+            bucket.acquire()
+            budget.record_request()
+            response = None
+            try:
+                response = self.session.request(method, url, headers=headers, params=params, timeout=timeout, **kwargs)
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                breaker.record_success()
+                response.raise_for_status()  # 4xx غیرقابل تکرار: خطای سمت ما، نه خرابی میزبان
+                return response
+            except HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise
+                breaker.record_failure()
+                error = e
+            except (Timeout, ConnectionError) as e:
+                breaker.record_failure()
+                error = e
+            except RequestException:
+                # ChunkedEncodingError، TooManyRedirects، ...: بدون تلاش مجدد، ولی trial نیمه‌باز باید آزاد شود
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release_trial()
+                raise
+
+            if attempt >= max_retries or not budget.try_spend():
+                logger.error(f"Request to {url} failed after {attempt + 1} attempt(s): {error}")
+                raise error
+
+            delay = self._backoff(attempt, response)
+            logger.info(f"Retrying {url} in {delay:.2f}s (attempt {attempt + 2}/{max_retries + 1}) after: {error}")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Returns the process-wide HttpClient, configured from HTTP_* environment variables."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(
+                pool_size=int(os.environ.get('HTTP_POOL_SIZE', 20)),
+                timeout=float(os.environ.get('HTTP_TIMEOUT', 10)),
+                max_retries=int(os.environ.get('HTTP_MAX_RETRIES', 3)),
+                default_rate=float(os.environ.get('HTTP_RATE_PER_HOST', 5)),
+                default_burst=float(os.environ.get('HTTP_BURST_PER_HOST', 10)),
+                # مثال: HTTP_HOST_RATE_LIMITS="tsetmc.com=4:8,tgju.org=1:2,api.brsapi.ir=2"
+                host_limits=_parse_host_limits(os.environ.get('HTTP_HOST_RATE_LIMITS', '')),
+                retry_budget_ratio=float(os.environ.get('HTTP_RETRY_BUDGET_RATIO', 0.2)),
+                failure_threshold=int(os.environ.get('HTTP_CIRCUIT_FAILURE_THRESHOLD', 5)),
+                reset_timeout=float(os.environ.get('HTTP_CIRCUIT_RESET_SECONDS', 60)),
+            )
+        return _client
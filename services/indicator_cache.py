@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# services/indicator_cache.py
+# کش مشترک اندیکاتورها برای اسکرینرها (کلید گلدن، پیش‌بینی ML و تحلیل تکنیکال روزانه): هر اندیکاتور برای یک نماد
+# در یک روز فقط یک بار با توابع calculate_* در services/utils محاسبه می‌شود. فراخواننده‌ها پنجره‌های تاریخچه با طول
+# متفاوت (تا همان آخرین بار) بارگذاری می‌کنند؛ کش بلندترین پنجره را نگه می‌دارد و به پنجره‌های کوتاه‌تر انتهای همان
+# سری را برمی‌گرداند. حافظه با سیاست LRU محدود می‌شود و در صورت تنظیم INDICATOR_CACHE_DIR، نتایج روی دیسک هم
+# ذخیره می‌شوند تا پردازه‌های دیگر (workerهای مرحله تکنیکال، پیش‌بینی ML) هم از آن استفاده کنند.
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from services.utils import (
+    calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands,
+    calculate_volume_ma, calculate_atr,
+)
+
+logger = logging.getLogger(__name__)
+
+# indicator name -> function of services/utils (Series in, Series or tuple of Series out)
+INDICATOR_FUNCTIONS = {
+    'rsi': calculate_rsi,
+    'macd': calculate_macd,
+    'sma': calculate_sma,
+    'bollinger': calculate_bollinger_bands,
+    'volume_ma': calculate_volume_ma,
+    'atr': calculate_atr,
+}
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def _input_values(inputs):
+    """The input series as float64 arrays (NaN for missing values)."""
+    return tuple(pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan) for series in inputs)
+
+
+def _is_tail(values, stored):
+    """True if every input array equals the end of the stored one, i.e. it is a shorter window ending on the same bar."""
+    return all(len(array) <= len(full) and np.array_equal(array, full[len(full) - len(array):], equal_nan=True)
+               for array, full in zip(values, stored))
+
+
+class IndicatorCache:
+    """
+    Memoizes indicator results under (symbol_id, last_bar_date, indicator, params).
+    Each entry keeps the longest input window computed so far with its result; a caller whose
+    inputs are the tail of that window (a shorter history ending on the same bar) gets the tail
+    of the stored result, which is the same or better warmed up than computing it on its own
+    window. Results are kept as NumPy arrays and rebuilt as Series on the caller's index, so
+    callers with differently indexed frames can share them. Thread-safe.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.pkl")
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Ignoring unreadable indicator cache entry {key}: {e}")
+            return None
+        self._put_memory(key, value)
+        return value
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put(self, key, value):
+        self._put_memory(key, value)
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not persist indicator cache entry {key}: {e}")
+
+    def get_indicator(self, indicator, symbol_id, last_bar_date, *inputs, **params):
+        """
+        Returns INDICATOR_FUNCTIONS[indicator](*inputs, **params), computing it only on a cache miss.
+        The result is a Series (or tuple of Series) on the index of the first input, as the
+        function itself returns.
+        """
+        function = INDICATOR_FUNCTIONS[indicator]
+        index = inputs[0].index
+        key = (str(symbol_id), str(last_bar_date), indicator, tuple(sorted(params.items())))
+        input_values = _input_values(inputs)
+
+        entry = self._get(key)
+        if entry is not None and _is_tail(input_values, entry[0]):
+            self.hits += 1
+            values = entry[1]
+        else:
+            self.misses += 1
+            result = function(*inputs, **params)
+            values = tuple(series.to_numpy() for series in result) if isinstance(result, tuple) else result.to_numpy()
+            # A shorter or different window does not replace a longer stored one
+            if entry is None or len(input_values[0]) >= len(entry[0][0]):
+                self._put(key, (input_values, values))
+
+        count = len(index)
+        if isinstance(values, tuple):
+            return tuple(pd.Series(array[len(array) - count:], index=index) for array in values)
+        return pd.Series(values[len(values) - count:], index=index)
+
+    def clear(self):
+        """Drops the in-memory entries and the persisted files."""
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_indicator_cache():
+    """
+    Returns the process-wide IndicatorCache configured by Config.INDICATOR_CACHE_SIZE and
+    Config.INDICATOR_CACHE_DIR (read from the app config when an app context is available,
+    so it also works in indicator worker processes).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                from flask import current_app
+                config = current_app.config
+                max_entries, disk_dir = config.get('INDICATOR_CACHE_SIZE'), config.get('INDICATOR_CACHE_DIR')
+            except RuntimeError:
+                from config import Config
+                max_entries, disk_dir = Config.INDICATOR_CACHE_SIZE, Config.INDICATOR_CACHE_DIR
+            _cache = IndicatorCache(max_entries or DEFAULT_MAX_ENTRIES, disk_dir)
+        return _cache
+
+
+def get_indicator(indicator, symbol_id, last_bar_date, *inputs, **params):
+    """Shortcut for get_indicator_cache().get_indicator(...)."""
+    return get_indicator_cache().get_indicator(indicator, symbol_id, last_bar_date, *inputs, **params)
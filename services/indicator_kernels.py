@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# services/indicator_kernels.py
+# نسخه‌های ماتریسی (symbols x days) اندیکاتورهای services/utils که اندیکاتور کل بازار را در یک فراخوانی حساب می‌کنند.
+# توابع calculate_* در services/utils پوشش نازکی روی همین کرنل‌ها هستند، پس نتیجه هر دو مسیر یکسان است.
+#
+# قرارداد ورودی: هر ردیف یک نماد و هر ستون یک روز است (مثل PriceStore.load_panel یا MarketPanel.to_dense؛ ورودی float32 هم پذیرفته می‌شود). خانه NaN یعنی نماد در آن روز
+# بار ندارد: هر ردیف فقط روی خانه‌های غیر NaN خود و به ترتیب محاسبه می‌شود، انگار آن روزها پشت‌سرهم بوده‌اند
+# (همان dropna سری‌ها در utils) و خانه‌های NaN در خروجی هم NaN می‌مانند. ردیفی که کمتر از `window` بار دارد
+# تماماً NaN برمی‌گردد.
+
+import numpy as np
+
+
+def _as_panel(values):
+    """Returns values as a float64 2-D array (a 1-D input becomes a single row)."""
+    panel = np.asarray(values, dtype=np.float64)
+    if panel.ndim == 1:
+        panel = panel[np.newaxis, :]
+    if panel.ndim != 2:
+        raise ValueError(f"Indicator kernels expect a 2-D (symbols x days) array, got {panel.ndim} dimensions.")
+    return panel
+
+
+def _compact(panels, bars):
+    """
+    Moves the bar cells of every row to the front, keeping their order, so each row becomes
+    a dense series followed by padding. Returns (compacted panels, order); order is None
+    when every cell is a bar and nothing had to move.
+    """
+    if bars.all():
+        return panels, None
+    order = np.argsort(~bars, axis=1, kind='stable')
+    return [np.take_along_axis(panel, order, axis=1) for panel in panels], order
+
+
+def _expand(result, order, bars):
+    """Inverse of _compact for one result panel: puts values back on their days, NaN elsewhere."""
+    if order is not None:
+        expanded = np.empty_like(result)
+        np.put_along_axis(expanded, order, result, axis=1)
+        result = expanded
+    result[~bars] = np.nan
+    return result
+
+
+def _blank_short_rows(result, bars, min_bars):
+    """Rows with fewer than min_bars bars get no values."""
+    result[bars.sum(axis=1) < min_bars] = np.nan
+    return result
+
+
+def forward_fill(panel):
+    """Row-wise forward fill of NaN cells with the last known value (leading NaNs stay NaN)."""
+    panel = _as_panel(panel)
+    known = ~np.isnan(panel)
+    index = np.where(known, np.arange(panel.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = np.take_along_axis(panel, index, axis=1)
+    filled[~np.maximum.accumulate(known, axis=1)] = np.nan
+    return filled
+
+
+def ewm_mean(panel, span):
+    """
+    Row-wise exponential moving average, equal to pandas `ewm(span=span, adjust=False).mean()`
+    on a dense series: y[0] = x[0], y[t] = (1 - a) * y[t-1] + a * x[t] with a = 2 / (span + 1).
+    """
+    panel = _as_panel(panel)
+    alpha = 2.0 / (span + 1.0)
+    result = np.empty_like(panel)
+    if panel.shape[1] == 0:
+        return result
+    result[:, 0] = panel[:, 0]
+    for t in range(1, panel.shape[1]):
+        result[:, t] = (1.0 - alpha) * result[:, t - 1] + alpha * panel[:, t]
+    return result
+
+
+def rolling_mean(panel, window):
+    """Row-wise trailing mean over `window` days of a dense panel; the first window-1 days are NaN."""
+    panel = _as_panel(panel)
+    result = np.full_like(panel, np.nan)
+    if panel.shape[1] < window:
+        return result
+    cumsum = np.cumsum(np.pad(panel, ((0, 0), (1, 0))), axis=1)
+    result[:, window - 1:] = (cumsum[:, window:] - cumsum[:, :-window]) / window
+    return result
+
+
+def rolling_std(panel, window):
+    """Row-wise trailing sample standard deviation (ddof=1) over `window` days of a dense panel."""
+    panel = _as_panel(panel)
+    result = np.full_like(panel, np.nan)
+    if panel.shape[1] < window:
+        return result
+    windows = np.lib.stride_tricks.sliding_window_view(panel, window, axis=1)
+    result[:, window - 1:] = windows.std(axis=-1, ddof=1)
+    return result
+
+
+def rsi_kernel(close, window=14):
+    """RSI of every row (see calculate_rsi): EMA of gains over EMA of losses, 0 where there are no losses."""
+    close = _as_panel(close)
+    bars = ~np.isnan(close)
+    (dense,), order = _compact([close], bars)
+
+    delta = np.diff(dense, axis=1, prepend=np.nan)
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    avg_gain = ewm_mean(gain, window)
+    avg_loss = ewm_mean(loss, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / np.where(avg_loss == 0, np.nan, avg_loss)
+    rs = np.where(np.isfinite(rs), rs, 0.0)
+    rsi = 100.0 - (100.0 / (1.0 + rs))
+    rsi = np.where(np.isfinite(rsi), rsi, 0.0)
+    return _blank_short_rows(_expand(rsi, order, bars), bars, window)
+
+
+def macd_kernel(close, short_window=12, long_window=26, signal_window=9):
+    """MACD line, signal line and histogram of every row (see calculate_macd)."""
+    close = _as_panel(close)
+    bars = ~np.isnan(close)
+    (dense,), order = _compact([close], bars)
+
+    macd = ewm_mean(dense, short_window) - ewm_mean(dense, long_window)
+    macd_signal = ewm_mean(macd, signal_window)
+    macd_hist = macd - macd_signal
+    return tuple(_blank_short_rows(_expand(result, order, bars), bars, long_window)
+                 for result in (macd, macd_signal, macd_hist))
+
+
+def sma_kernel(values, window):
+    """Simple moving average of every row over its last `window` bars (see calculate_sma)."""
+    values = _as_panel(values)
+    bars = ~np.isnan(values)
+    (dense,), order = _compact([values], bars)
+    return _blank_short_rows(_expand(rolling_mean(dense, window), order, bars), bars, window)
+
+
+def bollinger_kernel(close, window=20, num_std_dev=2):
+    """Bollinger middle, upper and lower bands of every row (see calculate_bollinger_bands)."""
+    close = _as_panel(close)
+    bars = ~np.isnan(close)
+    (dense,), order = _compact([close], bars)
+
+    ma = rolling_mean(dense, window)
+    std = rolling_std(dense, window)
+    return tuple(_blank_short_rows(_expand(result, order, bars), bars, window)
+                 for result in (ma, ma + std * num_std_dev, ma - std * num_std_dev))
+
+
+def atr_kernel(high, low, close, window=14, bars=None):
+    """
+    Average True Range of every row (see calculate_atr). A day is a bar when any of
+    high/low/close is known (or as given by the boolean `bars` mask); inside a row's bars,
+    missing prices are carried forward from the previous bar, and leading ones are 0.
+    """
+    high, low, close = _as_panel(high), _as_panel(low), _as_panel(close)
+    if bars is None:
+        bars = ~(np.isnan(high) & np.isnan(low) & np.isnan(close))
+    bars = np.broadcast_to(np.asarray(bars, dtype=bool), high.shape)
+    (high, low, close), order = _compact([high, low, close], bars)
+    high, low, close = (np.nan_to_num(forward_fill(panel), nan=0.0) for panel in (high, low, close))
+
+    prev_close = np.pad(close[:, :-1], ((0, 0), (1, 0)), constant_values=np.nan)
+    with np.errstate(invalid='ignore'):
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    true_range = np.nan_to_num(true_range, nan=0.0)
+    return _blank_short_rows(_expand(ewm_mean(true_range, window), order, bars), bars, 2)
+
+
+def _nan_to_zero(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), 0.0, values)
+
+
+def _ratio_or_zero(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / np.where(denominator == 0, np.nan, denominator)
+    return np.where(np.isfinite(ratio), ratio, 0.0)
+
+
+def smart_money_kernel(buy_i_volume, sell_i_volume, buy_count_i, sell_count_i, buy_n_volume=None, sell_n_volume=None):
+    """
+    Real (individual) money-flow metrics of every bar (see calculate_smart_money_flow). Works
+    element-wise on arrays of any shape, e.g. one long column of all symbols and days. Missing
+    inputs count as 0 and ratios with a zero denominator are 0. legal_net_flow is only returned
+    when the legal volumes are given.
+
+    Returns:
+        dict: {metric name: array}.
+    """
+    buy_i, sell_i, buy_count, sell_count = (_nan_to_zero(values) for values in (buy_i_volume, sell_i_volume, buy_count_i, sell_count_i))
+    metrics = {
+        'individual_buy_power': _ratio_or_zero(buy_i, sell_i),
+        'individual_net_flow': buy_i - sell_i,
+        'individual_buy_per_trade': _ratio_or_zero(buy_i, buy_count),
+        'individual_sell_per_trade': _ratio_or_zero(sell_i, sell_count),
+    }
+    if buy_n_volume is not None and sell_n_volume is not None:
+        metrics['legal_net_flow'] = _nan_to_zero(buy_n_volume) - _nan_to_zero(sell_n_volume)
+    return metrics
+
+
+def compute_indicator_panels(close, high, low, volume):
+    """
+    Computes every indicator stored in TechnicalIndicatorData for the whole market in one pass.
+
+    Args:
+        close, high, low, volume: 2-D (symbols x days) arrays on the same day axis; NaN where a
+            symbol has no bar.
+
+    Returns:
+        dict: {TechnicalIndicatorData column name: 2-D array}.
+    """
+    close = _as_panel(close)
+    bars = ~np.isnan(close)
+    macd, macd_signal, macd_hist = macd_kernel(close)
+    bollinger_ma, bollinger_high, bollinger_low = bollinger_kernel(close, window=20)
+    return {
+        'close_price': close,
+        'RSI': rsi_kernel(close),
+        'MACD': macd,
+        'MACD_Signal': macd_signal,
+        'MACD_Hist': macd_hist,
+        'SMA_20': sma_kernel(close, window=20),
+        'SMA_50': sma_kernel(close, window=50),
+        'Volume_MA_20': sma_kernel(np.where(bars, volume, np.nan), window=20),
+        'Bollinger_High': bollinger_high,
+        'Bollinger_Low': bollinger_low,
+        'Bollinger_MA': bollinger_ma,
+        'ATR': atr_kernel(high, low, close, bars=bars),
+    }
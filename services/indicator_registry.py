@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# services/indicator_registry.py
+# رجیستری اعلانی اندیکاتورها: هر اندیکاتور ورودی‌ها، پارامترها و طول گرم‌شدن (warm-up) خود را اعلام می‌کند.
+# سرویس‌ها به جای حدس زدن طول تاریخچه (limit(60)، ۲۰۰ روز، ...) فهرست اندیکاتورهای مورد نیاز خود را می‌دهند و
+# کمترین تعداد بار لازم را از history_bars / min_history می‌گیرند؛ compute_indicators گراف وابستگی را یک بار
+# (از طریق کش مشترک indicator_cache) ارزیابی می‌کند.
+#
+# دو طول برای هر اندیکاتور:
+#   min_bars: کمترین تعداد بار ورودی که مقدار تعریف‌شده می‌دهد (کمتر از آن NaN است، مثل _blank_short_rows).
+#   lookback: تعداد بارهای ورودی (تا خود بار) که مقدار آن بار به آن‌ها وابسته است. برای اندیکاتورهای نمایی (EMA)
+#             وزن بارهای قدیمی‌تر کمتر از EMA_TOLERANCE است، پس بارگذاری همین تعداد همان مقدار کل تاریخچه را می‌دهد.
+#             EMA_TOLERANCE آن‌قدر کوچک است که مقایسه با آستانه‌ها و تقاطع‌ها (RSI > 70، MACD و سیگنال) با بارگذاری
+#             کل تاریخچه فرقی نکند؛ با 1e-3 (حدود ۱۲۰ بار برای MACD) اختلاف ~0.01 در MACD تقاطع‌ها را جابه‌جا می‌کرد.
+
+import math
+
+from models import HistoricalData
+from services.indicator_cache import get_indicator
+
+EMA_TOLERANCE = 1e-8
+
+
+def ema_warmup(span, tolerance=EMA_TOLERANCE):
+    """
+    Number of values after which an EMA (adjust=False, a = 2 / (span + 1)) gives less than
+    `tolerance` of its weight to the values before them.
+    """
+    alpha = 2.0 / (span + 1.0)
+    return int(math.ceil(math.log(tolerance) / math.log(1.0 - alpha)))
+
+
+class IndicatorSpec:
+    """
+    Declaration of one indicator.
+
+    Args:
+        name (str): Registry key.
+        function (str or callable): An INDICATOR_FUNCTIONS name of services/indicator_cache (computed
+            through the shared cache) or a callable taking the input Series and params.
+        inputs (list): Frame columns or outputs of other registered indicators, in argument order.
+        outputs (list): Names of the returned Series (several for tuple results); defaults to [name].
+        params (dict): Keyword arguments of the function.
+        min_bars (int): Fewest input values that give a value.
+        lookback (int): Input values up to a bar that its value depends on (see the module header).
+    """
+
+    def __init__(self, name, function, inputs, outputs=None, params=None, min_bars=1, lookback=None):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs or [name])
+        self.params = dict(params or {})
+        self.min_bars = min_bars
+        self.lookback = lookback if lookback is not None else min_bars
+
+    def __repr__(self):
+        return f"IndicatorSpec({self.name!r}, inputs={self.inputs}, min_bars={self.min_bars}, lookback={self.lookback})"
+
+
+# registry name -> IndicatorSpec
+INDICATOR_REGISTRY = {}
+# output name -> registry name of the indicator producing it
+_OUTPUT_OWNERS = {}
+
+
+def register_indicator(name, function, inputs, outputs=None, params=None, min_bars=1, lookback=None):
+    """Adds (or replaces) an indicator in the registry and returns its IndicatorSpec."""
+    spec = IndicatorSpec(name, function, inputs, outputs, params, min_bars, lookback)
+    for output in INDICATOR_REGISTRY.get(name, spec).outputs:
+        _OUTPUT_OWNERS.pop(output, None)
+    INDICATOR_REGISTRY[name] = spec
+    for output in spec.outputs:
+        _OUTPUT_OWNERS[output] = name
+    return spec
+
+
+# Column names follow TechnicalIndicatorData where the indicator is stored there
+register_indicator('RSI', 'rsi', ['close'], min_bars=14, lookback=ema_warmup(14) + 1)
+register_indicator('MACD', 'macd', ['close'], outputs=['MACD', 'MACD_Signal', 'MACD_Hist'],
+                   min_bars=26, lookback=ema_warmup(26) + ema_warmup(9) - 1)
+register_indicator('SMA_20', 'sma', ['close'], params={'window': 20}, min_bars=20)
+register_indicator('SMA_50', 'sma', ['close'], params={'window': 50}, min_bars=50)
+register_indicator('Volume_MA_5', 'volume_ma', ['volume'], params={'window': 5}, min_bars=5)
+register_indicator('Volume_MA_20', 'volume_ma', ['volume'], params={'window': 20}, min_bars=20)
+register_indicator('Volume_MA_120', 'volume_ma', ['volume'], params={'window': 120}, min_bars=120)
+register_indicator('Bollinger', 'bollinger', ['close'], outputs=['Bollinger_MA', 'Bollinger_High', 'Bollinger_Low'],
+                   params={'window': 20}, min_bars=20)
+register_indicator('ATR', 'atr', ['high', 'low', 'close'], min_bars=2, lookback=ema_warmup(14) + 1)
+
+
+def _spec(name):
+    """IndicatorSpec of a registry name or of one of its outputs."""
+    spec = INDICATOR_REGISTRY.get(name) or INDICATOR_REGISTRY.get(_OUTPUT_OWNERS.get(name))
+    if spec is None:
+        raise KeyError(f"Unknown indicator '{name}'.")
+    return spec
+
+
+def resolve_indicators(names):
+    """Specs needed for `names` (registry names or outputs), each once, dependencies first."""
+    ordered, visiting = [], set()
+
+    def visit(spec):
+        if spec in ordered:
+            return
+        if spec.name in visiting:
+            raise ValueError(f"Indicator '{spec.name}' depends on itself.")
+        visiting.add(spec.name)
+        for source in spec.inputs:
+            if source in _OUTPUT_OWNERS:
+                visit(_spec(source))
+        visiting.discard(spec.name)
+        ordered.append(spec)
+
+    for name in names:
+        visit(_spec(name))
+    return ordered
+
+
+def _chain_bars(spec, attribute, bars_by_name):
+    """Input bars for one value of spec: its own length plus what its indicator inputs need, less the shared bar."""
+    if spec.name not in bars_by_name:
+        upstream = [_chain_bars(_spec(source), attribute, bars_by_name)
+                    for source in spec.inputs if source in _OUTPUT_OWNERS]
+        bars_by_name[spec.name] = getattr(spec, attribute) + max(upstream, default=1) - 1
+    return bars_by_name[spec.name]
+
+
+def history_bars(names, last_values=1):
+    """
+    Bars to load so the last `last_values` values of every indicator in `names` equal the
+    values computed over the whole history (within EMA_TOLERANCE of the older values' weight for exponential ones).
+    """
+    bars_by_name = {}
+    specs = resolve_indicators(names)
+    return max((_chain_bars(spec, 'lookback', bars_by_name) for spec in specs), default=1) + last_values - 1
+
+
+def min_history(names, last_values=1):
+    """Fewest bars for which the last `last_values` values of every indicator in `names` are defined."""
+    bars_by_name = {}
+    specs = resolve_indicators(names)
+    return max((_chain_bars(spec, 'min_bars', bars_by_name) for spec in specs), default=1) + last_values - 1
+
+
+def compute_indicators(frame, names, symbol_id=None, last_bar_date=None):
+    """
+    Evaluates the indicators in `names` and their dependencies on `frame`, each once.
+
+    Args:
+        frame (DataFrame): Bars sorted by date with the input columns (close, high, low, volume, ...).
+        names (list): Registry names or outputs.
+        symbol_id, last_bar_date: Key of the shared indicator cache.
+
+    Returns:
+        dict: {output name: Series on frame's index}, for every output of the evaluated indicators.
+    """
+    values = {}
+    for spec in resolve_indicators(names):
+        inputs = [values[source] if source in values else frame[source] for source in spec.inputs]
+        if callable(spec.function):
+            result = spec.function(*inputs, **spec.params)
+        else:
+            result = get_indicator(spec.function, symbol_id, last_bar_date, *inputs, **spec.params)
+        values.update(zip(spec.outputs, result if isinstance(result, tuple) else (result,)))
+    return values
+
+
+def latest_history_records(symbol_id, bars, until_date=None):
+    """The last `bars` HistoricalData rows of a symbol (all of them if None, up to until_date), oldest first."""
+    query = HistoricalData.query.filter(HistoricalData.symbol_id == symbol_id)
+    if until_date is not None:
+        query = query.filter(HistoricalData.date <= until_date)
+    return query.order_by(HistoricalData.date.desc()).limit(bars).all()[::-1]
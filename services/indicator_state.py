@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# services/indicator_state.py
+# به‌روزرسانی افزایشی اندیکاتورهای تکنیکال: وضعیت بازگشتی هر نماد (EMAهای RSI/MACD/ATR و مجموع پنجره‌های متحرک)
+# در جدول indicator_states نگه داشته می‌شود و هر بار جدید با چند عمل ثابت (مستقل از طول تاریخچه) به آن اضافه می‌شود.
+# گام‌ها روی آرایه‌های numpy و برای همه نمادها با هم اجرا می‌شوند، پس به‌روزرسانی روزانه کل بازار چند میلی‌ثانیه طول می‌کشد.
+#
+# مقدار هر اندیکاتور در یک روز برابر است با محاسبه services/indicator_kernels روی همه بارهای نماد تا همان روز.
+
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, or_
+
+from extensions import db
+from models import HistoricalData, ComprehensiveSymbolData, TechnicalIndicatorData, IndicatorState
+from services.db_utils import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+RSI_WINDOW = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+ATR_WINDOW = 14
+SMA_SHORT, SMA_LONG = 20, 50 # SMA_20 (and Bollinger), SMA_50
+VOLUME_MA_WINDOW = 20
+BOLLINGER_STD_DEV = 2
+
+SCALAR_STATE_FIELDS = [
+    'bar_count', 'volume_count', 'last_close', 'last_high', 'last_low',
+    'ema_gain', 'ema_loss', 'ema_fast', 'ema_slow', 'ema_signal', 'atr',
+    'sum_close_20', 'sum_close_50', 'sum_volume_20',
+]
+
+INDICATOR_COLUMNS = [
+    'close_price', 'RSI', 'MACD', 'MACD_Signal', 'MACD_Hist', 'SMA_20', 'SMA_50',
+    'Volume_MA_20', 'Bollinger_High', 'Bollinger_Low', 'Bollinger_MA', 'ATR',
+]
+
+
+def new_states(count):
+    """Returns empty state arrays for `count` symbols (no bar seen yet)."""
+    states = {field: np.zeros(count) for field in SCALAR_STATE_FIELDS}
+    states['bar_count'] = np.zeros(count, dtype=np.int64)
+    states['volume_count'] = np.zeros(count, dtype=np.int64)
+    states['close_window'] = np.full((count, SMA_LONG), np.nan)
+    states['volume_window'] = np.full((count, VOLUME_MA_WINDOW), np.nan)
+    return states
+
+
+def _ema_step(previous, value, first, span):
+    alpha = 2.0 / (span + 1.0)
+    return np.where(first, value, (1.0 - alpha) * previous + alpha * value)
+
+
+def _shift_in(window, value):
+    """Drops the oldest column of each row and appends value as the newest one."""
+    return np.concatenate([window[:, 1:], value[:, np.newaxis]], axis=1)
+
+
+def advance_states(states, idx, close, high, low, volume):
+    """
+    Folds one new bar per symbol into the states, in place, and returns that bar's indicators.
+
+    Args:
+        states (dict): State arrays from new_states / _states_from_rows.
+        idx (ndarray): Row of each bar's symbol in the state arrays (each symbol at most once).
+        close, high, low, volume (ndarray): The new bars; close must be known, missing high/low
+            are carried forward from the previous bar and a missing volume leaves Volume_MA_20 as is.
+
+    Returns:
+        dict: {TechnicalIndicatorData column: ndarray aligned with idx}; NaN while a symbol has
+        fewer bars than the indicator's window.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    first = states['bar_count'][idx] == 0
+    previous_close = states['last_close'][idx]
+    high = np.where(np.isnan(high), states['last_high'][idx], high)
+    low = np.where(np.isnan(low), states['last_low'][idx], low)
+
+    # RSI: EMAs of gains and losses
+    delta = np.where(first, 0.0, close - previous_close)
+    ema_gain = _ema_step(states['ema_gain'][idx], np.where(delta > 0, delta, 0.0), first, RSI_WINDOW)
+    ema_loss = _ema_step(states['ema_loss'][idx], np.where(delta < 0, -delta, 0.0), first, RSI_WINDOW)
+
+    # MACD: fast and slow EMAs of close, then the signal EMA of their difference
+    ema_fast = _ema_step(states['ema_fast'][idx], close, first, MACD_FAST)
+    ema_slow = _ema_step(states['ema_slow'][idx], close, first, MACD_SLOW)
+    macd = ema_fast - ema_slow
+    ema_signal = _ema_step(states['ema_signal'][idx], macd, first, MACD_SIGNAL)
+
+    # ATR: EMA of true range
+    with np.errstate(invalid='ignore'):
+        true_range = np.where(first, high - low,
+                              np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close))))
+    atr = _ema_step(states['atr'][idx], np.nan_to_num(true_range, nan=0.0), first, ATR_WINDOW)
+
+    # Rolling windows: add the new close, subtract the one leaving each window
+    close_window = states['close_window'][idx]
+    sum_close_20 = states['sum_close_20'][idx] + close - np.nan_to_num(close_window[:, -SMA_SHORT])
+    sum_close_50 = states['sum_close_50'][idx] + close - np.nan_to_num(close_window[:, 0])
+    close_window = _shift_in(close_window, close)
+
+    volume_window = states['volume_window'][idx]
+    volume_count = states['volume_count'][idx]
+    sum_volume_20 = states['sum_volume_20'][idx]
+    has_volume = ~np.isnan(volume)
+    volume_window = np.where(has_volume[:, np.newaxis], _shift_in(volume_window, volume), volume_window)
+    sum_volume_20 = np.where(has_volume, sum_volume_20 + np.nan_to_num(volume) - np.nan_to_num(states['volume_window'][idx][:, 0]),
+                             sum_volume_20)
+    volume_count = volume_count + has_volume
+
+    bar_count = states['bar_count'][idx] + 1
+    for field, values in (('bar_count', bar_count), ('volume_count', volume_count), ('last_close', close),
+                          ('last_high', high), ('last_low', low), ('ema_gain', ema_gain), ('ema_loss', ema_loss),
+                          ('ema_fast', ema_fast), ('ema_slow', ema_slow), ('ema_signal', ema_signal), ('atr', atr),
+                          ('sum_close_20', sum_close_20), ('sum_close_50', sum_close_50),
+                          ('sum_volume_20', sum_volume_20), ('close_window', close_window),
+                          ('volume_window', volume_window)):
+        states[field][idx] = values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = ema_gain / np.where(ema_loss == 0, np.nan, ema_loss)
+        rs = np.where(np.isfinite(rs), rs, 0.0)
+        rsi = 100.0 - (100.0 / (1.0 + rs))
+    rsi = np.where(np.isfinite(rsi), rsi, 0.0)
+
+    sma_20 = np.where(bar_count >= SMA_SHORT, sum_close_20 / SMA_SHORT, np.nan)
+    std_20 = np.full(len(idx), np.nan)
+    enough = bar_count >= SMA_SHORT
+    if enough.any():
+        std_20[enough] = close_window[enough, -SMA_SHORT:].std(axis=1, ddof=1)
+    macd_valid = bar_count >= MACD_SLOW
+
+    return {
+        'close_price': close,
+        'RSI': np.where(bar_count >= RSI_WINDOW, rsi, np.nan),
+        'MACD': np.where(macd_valid, macd, np.nan),
+        'MACD_Signal': np.where(macd_valid, ema_signal, np.nan),
+        'MACD_Hist': np.where(macd_valid, macd - ema_signal, np.nan),
+        'SMA_20': sma_20,
+        'SMA_50': np.where(bar_count >= SMA_LONG, sum_close_50 / SMA_LONG, np.nan),
+        'Volume_MA_20': np.where(has_volume & (volume_count >= VOLUME_MA_WINDOW), sum_volume_20 / VOLUME_MA_WINDOW, np.nan),
+        'Bollinger_High': sma_20 + std_20 * BOLLINGER_STD_DEV,
+        'Bollinger_Low': sma_20 - std_20 * BOLLINGER_STD_DEV,
+        'Bollinger_MA': sma_20,
+        'ATR': np.where(bar_count >= 2, atr, np.nan),
+    }
+
+
+def advance_bars(states, bars, symbol_index):
+    """
+    Folds a long frame of bars (symbol_id, close, high, low, volume; sorted by symbol then date)
+    into the states, one step per bar rank so every step is one vectorized update over all
+    symbols. Returns {column: ndarray aligned with the rows of bars}.
+    """
+    count = len(bars)
+    results = {column: np.full(count, np.nan) for column in INDICATOR_COLUMNS}
+    if count == 0:
+        return results
+
+    rows = bars['symbol_id'].map(symbol_index).to_numpy(dtype=np.int64)
+    rank = bars.groupby('symbol_id', sort=False).cumcount().to_numpy()
+    by_rank = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+    values = {column: bars[column].to_numpy(dtype=np.float64) for column in ('close', 'high', 'low', 'volume')}
+
+    for step in range(len(bounds) - 1):
+        positions = by_rank[bounds[step]:bounds[step + 1]]
+        step_result = advance_states(states, rows[positions], values['close'][positions], values['high'][positions],
+                                     values['low'][positions], values['volume'][positions])
+        for column, column_values in step_result.items():
+            results[column][positions] = column_values
+    return results
+
+
+def _states_from_rows(rows):
+    """Builds state arrays from IndicatorState rows, in row order."""
+    states = new_states(len(rows))
+    for i, row in enumerate(rows):
+        for field in SCALAR_STATE_FIELDS:
+            value = getattr(row, field)
+            states[field][i] = np.nan if value is None else value
+        for field, width in (('close_window', SMA_LONG), ('volume_window', VOLUME_MA_WINDOW)):
+            window = json.loads(getattr(row, field) or '[]')[-width:]
+            if window:
+                states[field][i, -len(window):] = window
+    return states
+
+
+def _state_records(states, positions, symbol_ids, last_dates, last_jdates):
+    """Builds IndicatorState rows for the given positions of the state arrays."""
+    records = []
+    for position, symbol_id, last_date, last_jdate in zip(positions, symbol_ids, last_dates, last_jdates):
+        record = {'symbol_id': symbol_id, 'last_date': last_date, 'last_jdate': last_jdate}
+        for field in SCALAR_STATE_FIELDS:
+            value = states[field][position]
+            record[field] = int(value) if field.endswith('_count') else (None if np.isnan(value) else float(value))
+        for field in ('close_window', 'volume_window'):
+            window = states[field][position]
+            record[field] = json.dumps(window[~np.isnan(window)].tolist())
+        records.append(record)
+    return records
+
+
+def _load_new_bars(session, state_rows, symbol_ids=None):
+    """
+    Loads the bars of every symbol that are newer than its stored state (the whole history for
+    symbols without a state), sorted by symbol then date. Symbols are grouped by state date, so
+    each condition is a (symbol_id IN ..., date > ...) range on the stock_data primary key; on a
+    normal day all states share one date and a day without new bars costs almost nothing.
+    """
+    columns = (HistoricalData.symbol_id, HistoricalData.date, HistoricalData.jdate,
+               HistoricalData.close, HistoricalData.high, HistoricalData.low, HistoricalData.volume)
+    candidates = session.query(ComprehensiveSymbolData.symbol_id)
+    if symbol_ids is not None:
+        candidates = candidates.filter(ComprehensiveSymbolData.symbol_id.in_(list(symbol_ids)))
+
+    by_state_date, new_symbols = {}, []
+    for symbol_id, in candidates.all():
+        state = state_rows.get(symbol_id)
+        if state is None:
+            new_symbols.append(symbol_id)
+        else:
+            by_state_date.setdefault(state.last_date, []).append(symbol_id)
+
+    conditions = [and_(HistoricalData.symbol_id.in_(ids), HistoricalData.date > last_date)
+                  for last_date, ids in by_state_date.items()]
+    conditions += [HistoricalData.symbol_id.in_(new_symbols[start:start + 500]) for start in range(0, len(new_symbols), 500)]
+    rows = []
+    for start in range(0, len(conditions), 100):
+        rows += session.query(*columns).filter(or_(*conditions[start:start + 100]), HistoricalData.close.isnot(None)).all()
+
+    bars = pd.DataFrame(rows, columns=['symbol_id', 'date', 'jdate', 'close', 'high', 'low', 'volume'])
+    for column in ('close', 'high', 'low', 'volume'):
+        bars[column] = pd.to_numeric(bars[column], errors='coerce')
+    bars = bars[bars['close'].notna()].sort_values(['symbol_id', 'date'], kind='stable')
+    return bars.reset_index(drop=True)
+
+
+def reset_indicator_states(session, rewritten_from):
+    """
+    Drops the states that already folded in rewritten bars (a price adjustment, an overwriting
+    import, a corrected row), so the next advance_indicator_states bootstraps those symbols
+    from their whole history again. Does not commit.
+
+    Args:
+        rewritten_from (dict): {symbol_id: earliest rewritten bar date}; states whose last_date
+            is before that date are still valid and kept.
+
+    Returns:
+        int: Number of states dropped.
+    """
+    by_date = {}
+    for symbol_id, since_date in rewritten_from.items():
+        by_date.setdefault(since_date, []).append(symbol_id)
+    dropped = 0
+    for since_date, ids in by_date.items():
+        for start in range(0, len(ids), 500):
+            dropped += session.query(IndicatorState).filter(
+                IndicatorState.symbol_id.in_(ids[start:start + 500]), IndicatorState.last_date >= since_date
+            ).delete(synchronize_session=False)
+    if dropped:
+        logger.info(f"Dropped {dropped} indicator states after their history was rewritten.")
+    return dropped
+
+
+def advance_indicator_states(session=db.session, symbol_ids=None):
+    """
+    Brings the indicator states up to the latest stored bars and writes the indicators of the
+    new bars to TechnicalIndicatorData. Symbols without a state (new ones, or ones dropped by
+    reset_indicator_states) are bootstrapped from their whole history and all their indicator
+    rows are rewritten. Idempotent; does not commit.
+
+    Returns:
+        Tuple[int, int]: Number of indicator rows written and number of symbols advanced.
+    """
+    state_rows = {row.symbol_id: row for row in session.query(IndicatorState).all()}
+    bars = _load_new_bars(session, state_rows, symbol_ids)
+    if bars.empty:
+        return 0, 0
+
+    symbols = bars['symbol_id'].drop_duplicates().tolist()
+    states = new_states(len(symbols))
+    known = [i for i, symbol_id in enumerate(symbols) if symbol_id in state_rows]
+    if known:
+        loaded = _states_from_rows([state_rows[symbols[i]] for i in known])
+        for field, values in loaded.items():
+            states[field][known] = values
+    symbol_index = {symbol_id: i for i, symbol_id in enumerate(symbols)}
+
+    results = advance_bars(states, bars, symbol_index)
+
+    frame = pd.DataFrame(results)[INDICATOR_COLUMNS].fillna(0.0)
+    frame.insert(0, 'jdate', bars['jdate'].values)
+    frame.insert(0, 'symbol_id', bars['symbol_id'].values)
+    frame = frame.drop_duplicates(subset=['symbol_id', 'jdate'], keep='last')
+    written = bulk_upsert(session, TechnicalIndicatorData, frame.to_dict('records'), index_elements=['symbol_id', 'jdate'])
+
+    last_bars = bars.drop_duplicates(subset=['symbol_id'], keep='last')
+    records = _state_records(states, last_bars['symbol_id'].map(symbol_index).to_numpy(), last_bars['symbol_id'],
+                             last_bars['date'], last_bars['jdate'])
+    bulk_upsert(session, IndicatorState, records, index_elements=['symbol_id'])
+    return written, len(symbols)
+
+
+def run_incremental_indicator_update(symbol_ids=None):
+    """
+    Advances the technical indicators of all symbols (or symbol_ids) by the bars stored since
+    their last update and commits.
+
+    Returns:
+        Tuple[int, str]: Number of indicator rows written and a summary message.
+    """
+    try:
+        written, symbol_count = advance_indicator_states(db.session, symbol_ids=symbol_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during incremental indicator update: {e}", exc_info=True)
+        return 0, f"An error occurred during the incremental indicator update: {e}"
+
+    message = f"Incremental indicator update: {written} indicator rows written for {symbol_count} symbols."
+    logger.info(message)
+    return written, message
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# services/ingestion_checkpoints.py
+# ثبت پیشرفت به‌روزرسانی شبانه برای هر نماد و هر مرحله، تا اجرای قطع‌شده از همان‌جا ادامه پیدا کند
+
+import logging
+
+from extensions import db
+from models import IngestionCheckpoint
+from services.db_utils import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+INGESTION_STAGES = ('historical', 'technical', 'fundamental')
+
+# 'done': stage written; 'no_data': source returned nothing; 'failed': error while processing
+CHECKPOINT_STATUSES = ('done', 'no_data', 'failed')
+
+
+def load_finished_stages(run_date, retry_failed=False):
+    """
+    Returns {symbol_id: set(stages)} of the stages already handled on run_date.
+    Stages that ended as 'failed' or 'no_data' count as handled unless retry_failed is set.
+    """
+    query = db.session.query(IngestionCheckpoint.symbol_id, IngestionCheckpoint.stage) \
+                      .filter(IngestionCheckpoint.run_date == run_date)
+    if retry_failed:
+        query = query.filter(IngestionCheckpoint.status == 'done')
+
+    finished = {}
+    for symbol_id, stage in query.all():
+        finished.setdefault(symbol_id, set()).add(stage)
+    return finished
+
+
+def record_checkpoint(session, symbol_id, stage, run_date, status='done', last_data_date=None, message=None):
+    """
+    Upserts the watermark of one symbol/stage. It becomes durable with the caller's next
+    commit, i.e. together with the data it describes. Never raises: a lost checkpoint
+    only means the stage is redone on resume.
+    """
+    record = {
+        'symbol_id': symbol_id,
+        'stage': stage,
+        'run_date': run_date,
+        'status': status,
+        'last_data_date': last_data_date,
+        'message': (message or '')[:1000] or None,
+    }
+    try:
+        with session.begin_nested():
+            bulk_upsert(session, IngestionCheckpoint, [record], index_elements=['symbol_id', 'stage'])
+    except Exception as e:
+        logger.warning(f"Could not record {stage} checkpoint for {symbol_id}: {e}")
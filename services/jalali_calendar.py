@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# services/jalali_calendar.py - تبدیل برداری تاریخ جلالی ⇄ میلادی با جدول از پیش محاسبه‌شده
+
+import datetime
+import logging
+
+import jdatetime
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# بازه سال‌های جلالی پوشش داده‌شده در جدول (قدیمی‌ترین داده tickers_data مربوط به ۱۳۸۰ است)
+JALALI_START_YEAR = 1380
+JALALI_END_YEAR = 1450
+
+
+def _build_lookup_table(start_year, end_year):
+    """
+    Builds per-day arrays (Jalali year, month, day and 'YYYY-MM-DD' string) for every
+    day from 1 Farvardin of start_year to the last day of end_year. Only the first day
+    of each year goes through jdatetime; month lengths follow the fixed Jalali rule.
+    """
+    years, months, days = [], [], []
+    for jy in range(start_year, end_year + 1):
+        month_lengths = [31] * 6 + [30] * 5 + [30 if jdatetime.date(jy, 1, 1).isleap() else 29]
+        for jm, length in enumerate(month_lengths, start=1):
+            years.append(np.full(length, jy, dtype=np.int16))
+            months.append(np.full(length, jm, dtype=np.int8))
+            days.append(np.arange(1, length + 1, dtype=np.int8))
+    jy_arr, jm_arr, jd_arr = np.concatenate(years), np.concatenate(months), np.concatenate(days)
+    jdate_strings = np.array([f"{y:04d}-{m:02d}-{d:02d}" for y, m, d in zip(jy_arr, jm_arr, jd_arr)], dtype=object)
+    epoch = np.datetime64(jdatetime.date(start_year, 1, 1).togregorian(), 'D')
+    return epoch, jy_arr, jm_arr, jd_arr, jdate_strings
+
+
+_EPOCH, _JY, _JM, _JD, _JDATE_STRINGS = _build_lookup_table(JALALI_START_YEAR, JALALI_END_YEAR)
+_TABLE_SIZE = len(_JDATE_STRINGS)
+_JDATE_INDEX = pd.Index(_JDATE_STRINGS)
+
+
+def _to_day_offsets(values):
+    """Converts date-like input to day offsets from the table epoch, a validity mask and datetime64[D] days."""
+    greg = pd.to_datetime(values if isinstance(values, (pd.Series, pd.Index)) else list(values), errors='coerce')
+    days = np.asarray(greg).astype('datetime64[D]')
+    valid = ~np.isnat(days)
+    offsets = np.full(len(days), -1, dtype=np.int64)
+    offsets[valid] = (days[valid] - _EPOCH).astype(np.int64)
+    return offsets, valid, days
+
+
+def gregorian_to_jalali(values):
+    """
+    Converts Gregorian dates to 'YYYY-MM-DD' Jalali strings.
+
+    Accepts a scalar (date, datetime, Timestamp, datetime64) or an array-like / Series /
+    DatetimeIndex. Arrays are converted with one lookup into the precomputed table; dates
+    outside 1380–1450 fall back to jdatetime. Invalid or missing dates become None.
+
+    Returns:
+        str | None for scalars, a Series (same index) for Series input, otherwise an object ndarray.
+    """
+    if np.ndim(values) == 0:
+        return gregorian_to_jalali([values])[0]
+
+    offsets, valid, days = _to_day_offsets(values)
+    result = np.full(len(offsets), None, dtype=object)
+    in_table = valid & (offsets >= 0) & (offsets < _TABLE_SIZE)
+    result[in_table] = _JDATE_STRINGS[offsets[in_table]]
+
+    for i in np.flatnonzero(valid & ~in_table):
+        result[i] = jdatetime.date.fromgregorian(date=days[i].astype(datetime.date)).strftime('%Y-%m-%d')
+
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return result
+
+
+def jalali_to_gregorian(values):
+    """
+    Converts 'YYYY-MM-DD' Jalali strings to Gregorian timestamps.
+
+    Accepts a scalar string or an array-like / Series of strings. Canonical strings inside
+    1380–1450 are resolved with one hash lookup into the precomputed table; anything else
+    is parsed with jdatetime. Invalid or missing values become NaT.
+
+    Returns:
+        pd.Timestamp | NaT for scalars, a datetime64 Series (same index) for Series input,
+        otherwise a DatetimeIndex.
+    """
+    if np.ndim(values) == 0:
+        return jalali_to_gregorian([values])[0]
+
+    strings = values if isinstance(values, pd.Series) else pd.Series(np.asarray(values, dtype=object))
+    positions = _JDATE_INDEX.get_indexer(strings.values)
+    result = np.full(len(positions), np.datetime64('NaT'), dtype='datetime64[D]')
+    found = positions >= 0
+    result[found] = _EPOCH + positions[found]
+
+    for i in np.flatnonzero(~found):
+        value = strings.iat[i]
+        if isinstance(value, str):
+            try:
+                jy, jm, jd = map(int, value.split('-'))
+                result[i] = np.datetime64(jdatetime.date(jy, jm, jd).togregorian(), 'D')
+            except ValueError:
+                logger.debug(f"Invalid Jalali date string '{value}'. Returning NaT.")
+
+    result = result.astype('datetime64[ns]')
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return pd.DatetimeIndex(result)
+
+
+def jalali_components(values):
+    """
+    Returns the Jalali (year, month, day) of Gregorian dates as three int arrays.
+    Dates outside 1380–1450 or missing dates are reported as 0.
+    """
+    offsets, valid, _ = _to_day_offsets(values)
+    in_table = valid & (offsets >= 0) & (offsets < _TABLE_SIZE)
+    jy = np.zeros(len(offsets), dtype=np.int16)
+    jm = np.zeros(len(offsets), dtype=np.int8)
+    jd = np.zeros(len(offsets), dtype=np.int8)
+    jy[in_table], jm[in_table], jd[in_table] = _JY[offsets[in_table]], _JM[offsets[in_table]], _JD[offsets[in_table]]
+    return jy, jm, jd
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# services/market_panel.py
+# نمایش فشرده داده روزانه کل بازار در حافظه (MarketPanel): به جای DataFrameای که SELECT * با ستون‌های float64 و
+# object برمی‌گرداند، هر ستون یک آرایه numpy با کوچک‌ترین نوع مناسب است:
+#   قیمت‌ها و درصدها (Float در stock_data): float32 — قیمت‌های ریالی تا ۱۶٬۷۷۷٬۲۱۶ دقیقاً نگه داشته می‌شوند
+#   حجم، ارزش و سایر BigIntegerها: int64 — تعداد معاملات و سایر Integerها: int32 (مقدار NULL برابر 0 می‌شود؛
+#   با keep_nulls این ستون‌ها float64 با NaN بارگذاری می‌شوند، برای مصرف‌کنندگانی که NULL را خودشان پر می‌کنند)
+#   نماد: کد int32 روی فهرست مرتب نمادها (pandas.Categorical) — تاریخ: int32 روز از 1970-01-01 (مثل PriceStore)
+# ردیف‌ها بر اساس نماد و سپس تاریخ مرتب‌اند. load_market_panel داده را دسته‌به‌دسته می‌خواند و هر دسته را همان
+# لحظه فشرده می‌کند، پس اوج مصرف حافظه فقط اندازه پنل فشرده به علاوه یک دسته است.
+# مصرف کنندگان: train_model (یک DataFrame برای هر نماد با symbol_frames)، اسکنر الگوهای شمعی (آرایه‌ها)،
+# indicator_kernels (ماتریس symbols x days با to_dense) و غربال کلید طلایی (آخرین N بار هر نماد با to_aligned).
+# مقایسه حافظه: benchmarks/bench_market_panel.py
+
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import BigInteger, Integer, and_, or_, select
+from sqlalchemy.engine import Engine
+
+from models import HistoricalData, ComprehensiveSymbolData
+
+logger = logging.getLogger(__name__)
+
+_EPOCH_DAY = np.datetime64('1970-01-01', 'D')
+
+DEFAULT_PANEL_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def column_dtype(column, keep_nulls=False):
+    """
+    Compact numpy dtype of a stock_data column: int64 for BigInteger, int32 for Integer, float32 otherwise.
+    With keep_nulls, integer columns are float64 (every digit kept) so NULL can stay NaN.
+    """
+    column_type = HistoricalData.__table__.columns[column].type
+    if keep_nulls and isinstance(column_type, Integer):
+        return np.dtype(np.float64)
+    if isinstance(column_type, BigInteger):
+        return np.dtype(np.int64)
+    if isinstance(column_type, Integer):
+        return np.dtype(np.int32)
+    return np.dtype(np.float32)
+
+
+def _compact_values(values, dtype):
+    """Casts a column to dtype; NULLs become NaN in float columns and 0 in integer ones."""
+    numeric = pd.to_numeric(pd.Series(values), errors='coerce')
+    if dtype.kind == 'f':
+        return numeric.to_numpy(dtype=dtype, na_value=np.nan)
+    return numeric.fillna(0).to_numpy(dtype=dtype)
+
+
+def to_days(dates):
+    """Dates as int32 days since 1970-01-01, the date index of MarketPanel."""
+    days = np.asarray(pd.to_datetime(pd.Series(dates)).to_numpy(), dtype='datetime64[D]')
+    return (days - _EPOCH_DAY).astype(np.int32)
+
+
+class MarketPanel:
+    """
+    Daily bars of many symbols in long format with compact column types (see the module header).
+
+    Args:
+        symbols (array): Symbol ids, sorted; `codes` index into it.
+        codes (array): Symbol code of each bar.
+        days (array): Date of each bar as days since 1970-01-01.
+        columns (dict): {column name: array of one value per bar}.
+    """
+
+    def __init__(self, symbols, codes, days, columns):
+        self.symbols = np.asarray(symbols, dtype=object)
+        codes, days = np.asarray(codes, dtype=np.int32), np.asarray(days, dtype=np.int32)
+        order = np.lexsort((days, codes))
+        if len(order) and np.any(order != np.arange(len(order))):
+            codes, days = codes[order], days[order]
+            columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        self.codes = codes
+        self.days = days
+        self.columns = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+
+    @classmethod
+    def from_frame(cls, frame, columns=None):
+        """Builds a panel from a frame with symbol_id, date and the given (default: all stock_data) columns."""
+        if columns is None:
+            columns = [name for name in frame.columns if name in HistoricalData.__table__.columns
+                       and name not in ('symbol_id', 'symbol_name', 'date', 'jdate')]
+        symbols, codes = np.unique(frame['symbol_id'].astype(str).to_numpy(), return_inverse=True)
+        return cls(symbols, codes, to_days(frame['date']),
+                   {name: _compact_values(frame[name], column_dtype(name)) for name in columns})
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def empty(self):
+        return len(self.codes) == 0
+
+    def __getitem__(self, name):
+        """A value column, or 'symbol_id' (object array) / 'date' (datetime64[D] array) of every bar."""
+        if name == 'symbol_id':
+            return self.symbols[self.codes]
+        if name == 'date':
+            return self.dates
+        return self.columns[name]
+
+    @property
+    def dates(self):
+        return self.days.astype('timedelta64[D]') + _EPOCH_DAY
+
+    @property
+    def symbol_ids(self):
+        """Symbol of every bar as a pandas Categorical (shares the codes, no string per bar)."""
+        return pd.Categorical.from_codes(self.codes, categories=self.symbols)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the panel's arrays."""
+        return self.codes.nbytes + self.days.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    def symbol_bounds(self):
+        """(codes present, start row, end row) of each symbol's contiguous block of bars."""
+        if self.empty:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        starts = np.flatnonzero(np.r_[True, self.codes[1:] != self.codes[:-1]])
+        ends = np.r_[starts[1:], len(self.codes)]
+        return self.codes[starts], starts, ends
+
+    def symbol_frame(self, symbol_id):
+        """Bars of one symbol as a DataFrame (date + value columns) sorted by date; empty if unknown."""
+        position = np.searchsorted(self.symbols, str(symbol_id))
+        if position == len(self.symbols) or self.symbols[position] != str(symbol_id):
+            return self._frame(slice(0, 0))
+        start, end = np.searchsorted(self.codes, [position, position + 1])
+        return self._frame(slice(start, end))
+
+    def symbol_frames(self, min_bars=1):
+        """Yields (symbol_id, DataFrame of its bars) for every symbol with at least min_bars bars."""
+        for code, start, end in zip(*self.symbol_bounds()):
+            if end - start >= min_bars:
+                yield self.symbols[code], self._frame(slice(start, end))
+
+    def _frame(self, rows):
+        frame = pd.DataFrame({name: values[rows] for name, values in self.columns.items()})
+        frame.insert(0, 'date', self.dates[rows])
+        return frame
+
+    def to_frame(self):
+        """The whole panel as a long DataFrame with a categorical symbol_id column, keeping the compact dtypes."""
+        frame = self._frame(slice(None))
+        frame.insert(0, 'symbol_id', self.symbol_ids)
+        return frame
+
+    def to_aligned(self, columns, bars):
+        """
+        The last `bars` bars of every symbol as 2-D (symbols x bars) float arrays, right-aligned so
+        the last column is each symbol's latest bar; symbols with fewer bars are NaN-padded on the left.
+        Every row is a dense series, ready for indicator_kernels without gaps to skip.
+
+        Returns:
+            Tuple[ndarray, ndarray, ndarray, dict]: symbol_ids, bar count of each row (at most `bars`),
+            date of each row's last bar (datetime64[D]) and {column: 2-D array}.
+        """
+        codes, starts, ends = self.symbol_bounds()
+        block = np.repeat(np.arange(len(codes)), ends - starts)
+        bars_to_end = ends[block] - np.arange(len(self.codes)) # 1 for each symbol's last bar
+        keep = bars_to_end <= bars
+        rows, cols = block[keep], bars - bars_to_end[keep]
+        aligned = {}
+        for column in columns:
+            values = self.columns[column]
+            matrix = np.full((len(codes), bars), np.nan, dtype=np.result_type(values.dtype, np.float32))
+            matrix[rows, cols] = values[keep]
+            aligned[column] = matrix
+        last_dates = self.days[ends - 1].astype('timedelta64[D]') + _EPOCH_DAY
+        return self.symbols[codes], np.minimum(ends - starts, bars), last_dates, aligned
+
+    def to_dense(self, columns=None):
+        """
+        Value columns as 2-D (symbols x dates) float arrays for indicator_kernels, aligned on the
+        union of trading dates; days without a bar for a symbol are NaN (like PriceStore.load_panel).
+        Float columns stay float32; integer ones become float64 so large volumes keep every digit.
+
+        Returns:
+            Tuple[ndarray, ndarray, dict]: symbol_ids, dates (datetime64[D]) and {column: 2-D array}.
+        """
+        columns = list(self.columns) if columns is None else columns
+        unique_days, day_index = np.unique(self.days, return_inverse=True)
+        panel = {}
+        for column in columns:
+            dtype = np.result_type(self.columns[column].dtype, np.float32)
+            matrix = np.full((len(self.symbols), len(unique_days)), np.nan, dtype=dtype)
+            matrix[self.codes, day_index] = self.columns[column]
+            panel[column] = matrix
+        return self.symbols, unique_days.astype('timedelta64[D]') + _EPOCH_DAY, panel
+
+
+def _execute_in_chunks(bind, statement, chunksize):
+    """Runs statement with a server-side cursor where supported and yields lists of at most chunksize rows."""
+    statement = statement.execution_options(stream_results=True)
+    if isinstance(bind, Engine):
+        with bind.connect() as connection:
+            yield from connection.execute(statement).partitions(chunksize)
+    else:
+        yield from bind.execute(statement).partitions(chunksize)
+
+
+def latest_bars_conditions(session, bars, symbol_ids=None, required=None):
+    """
+    Filters for the last `bars` stock_data rows of every symbol (or symbol_ids), for load_market_panel.
+    The date of each symbol's first such row is a correlated index lookup; symbols are grouped by
+    it, so there are few (symbol_id IN ..., date >= ...) conditions. With `required`, only rows with
+    all of those columns set are counted (pass the same list to load_market_panel to drop the others).
+    """
+    first_date = select(HistoricalData.date) \
+        .where(HistoricalData.symbol_id == ComprehensiveSymbolData.symbol_id,
+               *(getattr(HistoricalData, column).isnot(None) for column in required or [])) \
+        .order_by(HistoricalData.date.desc()).limit(1).offset(bars - 1) \
+        .correlate(ComprehensiveSymbolData).scalar_subquery()
+    query = session.query(ComprehensiveSymbolData.symbol_id, first_date)
+    if symbol_ids is not None:
+        query = query.filter(ComprehensiveSymbolData.symbol_id.in_(list(symbol_ids)))
+    by_first_date = {}
+    for symbol_id, first in query.all():
+        by_first_date.setdefault(first, []).append(symbol_id)
+
+    conditions = []
+    for first, ids in by_first_date.items():
+        for start in range(0, len(ids), 500):
+            # No first date: the symbol has fewer bars, load them all
+            conditions.append(HistoricalData.symbol_id.in_(ids[start:start + 500]) if first is None else
+                              and_(HistoricalData.symbol_id.in_(ids[start:start + 500]), HistoricalData.date >= first))
+    return conditions
+
+
+def load_market_panel(bind, columns=DEFAULT_PANEL_COLUMNS, symbol_ids=None, start_date=None, end_date=None,
+                      conditions=None, required=None, keep_nulls=False, dtypes=None, chunksize=50000):
+    """
+    Loads stock_data into a MarketPanel, reading only the requested columns and compacting each chunk
+    as it arrives.
+
+    Args:
+        bind: A SQLAlchemy Session, Connection or Engine.
+        columns (list): stock_data value columns to load.
+        symbol_ids, start_date, end_date: Optional filters.
+        conditions (list): Extra filter clauses combined with OR (e.g. per-symbol date ranges); they
+            are sent 100 at a time, one query each. An empty list loads nothing.
+        required (list): Columns whose NULL drops the bar (checked before the integer cast turns NULL into 0).
+        keep_nulls (bool): Load integer columns as float64 with NaN for NULL instead of 0 (see column_dtype).
+        dtypes (dict): {column: numpy dtype} overriding column_dtype, e.g. float64 prices that are written back.
+        chunksize (int): Rows fetched and compacted at a time.
+
+    Returns:
+        MarketPanel
+    """
+    columns, required = list(columns), list(required or [])
+    statement = select(HistoricalData.symbol_id, HistoricalData.date, *(getattr(HistoricalData, c) for c in columns))
+    if symbol_ids is not None:
+        statement = statement.where(HistoricalData.symbol_id.in_([str(s) for s in symbol_ids]))
+    if start_date is not None:
+        statement = statement.where(HistoricalData.date >= start_date)
+    if end_date is not None:
+        statement = statement.where(HistoricalData.date <= end_date)
+    statements = [statement] if conditions is None else \
+        [statement.where(or_(*conditions[start:start + 100])) for start in range(0, len(conditions), 100)]
+
+    dtypes = [np.dtype((dtypes or {}).get(column) or column_dtype(column, keep_nulls)) for column in columns]
+    code_of = {}
+    codes, days, values = [], [], {column: [] for column in columns}
+    for rows in (rows for statement in statements for rows in _execute_in_chunks(bind, statement, chunksize)):
+        chunk = pd.DataFrame.from_records(rows, columns=['symbol_id', 'date'] + columns)
+        if required:
+            chunk = chunk.dropna(subset=required)
+        # Codes in order of first appearance here; they are renumbered to sorted symbols below
+        codes.append(np.array([code_of.setdefault(symbol_id, len(code_of)) for symbol_id in chunk['symbol_id']],
+                              dtype=np.int32))
+        days.append(to_days(chunk['date']))
+        for column, dtype in zip(columns, dtypes):
+            values[column].append(_compact_values(chunk[column], dtype))
+
+    symbols = np.array(list(code_of), dtype=object)
+    order = np.argsort(symbols, kind='stable')
+    renumber = np.empty(len(order), dtype=np.int32)
+    renumber[order] = np.arange(len(order), dtype=np.int32)
+    panel = MarketPanel(
+        symbols[order],
+        renumber[np.concatenate(codes)] if codes else np.empty(0, dtype=np.int32),
+        np.concatenate(days) if days else np.empty(0, dtype=np.int32),
+        {column: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+         for (column, parts), dtype in zip(values.items(), dtypes)},
+    )
+    logger.info(f"Market panel loaded: {len(panel)} bars of {len(panel.symbols)} symbols, "
+                f"{panel.nbytes / 2 ** 20:.1f} MiB.")
+    return panel
@@ -24,7 +24,8 @@ if project_root_dir not in sys.path:
 try:
     from extensions import db
     from models import MLPrediction, ComprehensiveSymbolData, HistoricalData
-    from ml_predictor import predict_trend_for_symbol, LATEST_MODEL_PATH
+    from services.indicator_registry import latest_history_records
+    from ml_predictor import predict_trend_for_symbol, LATEST_MODEL_PATH, ML_HISTORY_BARS
     from services.utils import convert_gregorian_to_jalali
 except ImportError as e:
     logger.error(f"خطا در ایمپورت ماژول‌ها در ml_prediction_service.py: {e}")
@@ -101,14 +102,9 @@ def generate_and_save_predictions_for_watchlist(prediction_date_greg=None, predi
             logger.info(f"پیش‌بینی برای نماد {symbol_name} ({symbol_id}) در تاریخ {jprediction_date} از قبل وجود دارد. پرش.")
             continue
 
-        start_date_for_hist = prediction_date_greg - timedelta(days=200)
-
         try:
-            historical_data_records = db.session.query(HistoricalData).filter(
-                HistoricalData.symbol_id == symbol_id,
-                HistoricalData.date >= start_date_for_hist,
-                HistoricalData.date <= prediction_date_greg
-            ).order_by(HistoricalData.date.asc()).all()
+            # آخرین ML_HISTORY_BARS بار تا تاریخ پیش‌بینی (گرم‌شدن اندیکاتورهای ویژگی‌ها، از رجیستری اندیکاتورها)
+            historical_data_records = latest_history_records(symbol_id, ML_HISTORY_BARS, until_date=prediction_date_greg)
 
             if not historical_data_records:
                 logger.warning(f"داده تاریخی کافی برای نماد {symbol_name} ({symbol_id}) برای پیش‌بینی یافت نشد.")
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# services/pattern_kernels.py
+# کرنل‌های الگوهای قیمتی کلید طلایی (کف دوقلو + شکست گردن، شکست خط روند نزولی) روی آرایه‌های numpy.
+# اگر numba نصب باشد، حلقه‌ها JIT کامپایل می‌شوند؛ در غیر این صورت نسخه برداری numpy (sliding_window_view) استفاده می‌شود.
+# توابع *_signals الگو را برای تک‌تک روزهای تاریخچه ارزیابی می‌کنند (برای بک‌تست)، نه فقط آخرین بار؛ توابع *_panel
+# آخرین بار همه نمادها را یک‌جا روی ماتریس‌های symbols x bars (MarketPanel.to_aligned) ارزیابی می‌کنند.
+#
+# ورودی‌ها آرایه‌های هم‌طول و بدون NaN هستند (ردیف‌های ناقص را فراخواننده حذف می‌کند).
+
+import numpy as np
+
+from services.indicator_kernels import forward_fill
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy implementations below are used without it
+    njit = None
+
+PATTERN_BACKEND = 'numba' if njit is not None else 'numpy'
+
+DOUBLE_BOTTOM_LOOKBACK = 40 # two halves of 20 bars
+TRENDLINE_LOOKBACK = 30
+VOLUME_LOOKBACK = 10
+VOLUME_SURGE = 1.5
+BOTTOM_TOLERANCE = 0.05
+
+
+# --- Single-day checks (plain loops, compiled by numba when available) ---
+
+def _double_bottom_at(close, volume, end):
+    """
+    Double bottom + neckline breakout on the bars up to `end` (inclusive): the lows of the two
+    halves of the last 40 closes are within 5% of each other, and the close breaks the highest
+    close between them on 1.5x the 10-day average volume.
+    """
+    count = end + 1
+    if count < DOUBLE_BOTTOM_LOOKBACK:
+        return False
+    start = count - DOUBLE_BOTTOM_LOOKBACK
+    half = DOUBLE_BOTTOM_LOOKBACK // 2
+    bottom1 = start + np.argmin(close[start:start + half])
+    bottom2 = start + half + np.argmin(close[start + half:count])
+    bottom1_price, bottom2_price = close[bottom1], close[bottom2]
+    if not ((1.0 - BOTTOM_TOLERANCE) * bottom1_price <= bottom2_price <= (1.0 + BOTTOM_TOLERANCE) * bottom1_price):
+        return False
+
+    neckline = np.max(close[bottom1:bottom2 + 1])
+    avg_volume = np.mean(volume[count - VOLUME_LOOKBACK:count])
+    return close[end] > neckline and volume[end] > avg_volume * VOLUME_SURGE
+
+
+def _descending_trendline_at(close, open_, high, low, volume, end):
+    """
+    Descending trendline breakout on the bars up to `end` (inclusive). Peaks are highs of the
+    last 30 bars that equal the centred 3-bar maximum; peaks that belong to a falling pair of
+    consecutive peaks define the trendline through the last two of them. The close must break
+    the projected line with a strong bullish candle on 1.5x the 10-day average volume.
+    """
+    count = end + 1
+    if count < TRENDLINE_LOOKBACK:
+        return False
+    start = count - TRENDLINE_LOOKBACK
+
+    # Last two peaks that are part of a falling pair of consecutive peaks
+    last_flagged = -1
+    second_flagged = -1
+    previous_peak = -1
+    previous_flagged = False
+    for j in range(start + 1, count - 1):
+        if high[j] >= high[j - 1] and high[j] >= high[j + 1]:
+            flagged = False
+            if previous_peak >= 0 and high[previous_peak] > high[j]:
+                flagged = True
+                if not previous_flagged:
+                    second_flagged = last_flagged
+                    last_flagged = previous_peak
+            if flagged:
+                second_flagged = last_flagged
+                last_flagged = j
+            previous_peak = j
+            previous_flagged = flagged
+    if second_flagged < 0:
+        return False
+
+    slope = (high[last_flagged] - high[second_flagged]) / (last_flagged - second_flagged)
+    if slope >= 0:
+        return False
+    projected = high[last_flagged] + slope * (end - last_flagged)
+
+    avg_volume = np.mean(volume[count - VOLUME_LOOKBACK:count])
+    current_close, current_open = close[end], open_[end]
+    return (current_close > projected and current_close > current_open
+            and abs(current_close - current_open) > (high[end] - low[end]) * 0.5
+            and volume[end] > avg_volume * VOLUME_SURGE)
+
+
+def _double_bottom_signals_loop(close, volume):
+    signals = np.zeros(len(close), dtype=np.bool_)
+    for end in range(len(close)):
+        signals[end] = _double_bottom_at(close, volume, end)
+    return signals
+
+
+def _descending_trendline_signals_loop(close, open_, high, low, volume):
+    signals = np.zeros(len(close), dtype=np.bool_)
+    for end in range(len(close)):
+        signals[end] = _descending_trendline_at(close, open_, high, low, volume, end)
+    return signals
+
+
+if njit is not None:
+    _double_bottom_at = njit(cache=True)(_double_bottom_at)
+    _descending_trendline_at = njit(cache=True)(_descending_trendline_at)
+    _double_bottom_signals_loop = njit(cache=True)(_double_bottom_signals_loop)
+    _descending_trendline_signals_loop = njit(cache=True)(_descending_trendline_signals_loop)
+
+
+# --- Vectorized NumPy versions of the per-day signals (used without numba) ---
+
+def _trailing_mean(values, window):
+    """Mean of the `window` values ending at each day (NaN before the first full window)."""
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        cumsum = np.cumsum(np.concatenate(([0.0], values)))
+        result[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+    return result
+
+
+def local_peaks(high):
+    """Days whose high equals the centred 3-day maximum (the first and last day are never peaks)."""
+    high = np.asarray(high, dtype=np.float64)
+    peaks = np.zeros(len(high), dtype=bool)
+    if len(high) >= 3:
+        peaks[1:-1] = (high[1:-1] >= high[:-2]) & (high[1:-1] >= high[2:])
+    return peaks
+
+
+def _double_bottom_on_windows(windows, last_close, last_volume, avg_volume):
+    """Double bottom check of every row of `windows` (the last 40 closes up to a day, one row per day or symbol)."""
+    half = DOUBLE_BOTTOM_LOOKBACK // 2
+    rows = np.arange(len(windows))
+    bottom1 = np.argmin(windows[:, :half], axis=1)
+    bottom2 = half + np.argmin(windows[:, half:], axis=1)
+    bottom1_price, bottom2_price = windows[rows, bottom1], windows[rows, bottom2]
+    similar = ((1.0 - BOTTOM_TOLERANCE) * bottom1_price <= bottom2_price) & \
+              (bottom2_price <= (1.0 + BOTTOM_TOLERANCE) * bottom1_price)
+
+    # Neckline: highest close between the two bottoms
+    columns = np.arange(DOUBLE_BOTTOM_LOOKBACK)
+    between = (columns >= bottom1[:, np.newaxis]) & (columns <= bottom2[:, np.newaxis])
+    neckline = np.where(between, windows, -np.inf).max(axis=1)
+    return similar & (last_close > neckline) & (last_volume > avg_volume * VOLUME_SURGE)
+
+
+def _descending_trendline_on_windows(windows, last_close, last_open, last_high, last_low, last_volume, avg_volume):
+    """Descending trendline breakout check of every row of `windows` (the last 30 highs up to a day)."""
+    inner = windows[:, 1:-1] # peaks need both neighbours inside the window
+    is_peak = (inner >= windows[:, :-2]) & (inner >= windows[:, 2:])
+    peak_values = np.where(is_peak, inner, np.nan)
+
+    # Value of the previous / next peak in the same window (NaN if none)
+    previous_peak = np.pad(forward_fill(peak_values)[:, :-1], ((0, 0), (1, 0)), constant_values=np.nan)
+    next_peak = np.pad(forward_fill(peak_values[:, ::-1])[:, ::-1][:, 1:], ((0, 0), (0, 1)), constant_values=np.nan)
+    with np.errstate(invalid='ignore'):
+        flagged = is_peak & ((previous_peak > inner) | (next_peak < inner))
+
+    # Last two flagged peaks of each window
+    columns = np.arange(inner.shape[1])
+    last = np.where(flagged, columns, -1).max(axis=1)
+    second = np.where(flagged & (columns < last[:, np.newaxis]), columns, -1).max(axis=1)
+    valid = second >= 0
+
+    # Positions relative to the window's last bar; inner column j is window column j + 1
+    rows = np.arange(len(windows))
+    last_value = inner[rows, np.maximum(last, 0)]
+    second_value = inner[rows, np.maximum(second, 0)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (last_value - second_value) / (last - second)
+        projected = last_value + slope * (TRENDLINE_LOOKBACK - 2 - last)
+
+    breakout = (last_close > projected) & (last_close > last_open) & \
+               (np.abs(last_close - last_open) > (last_high - last_low) * 0.5) & \
+               (last_volume > avg_volume * VOLUME_SURGE)
+    return valid & (slope < 0) & breakout
+
+
+def _double_bottom_signals_numpy(close, volume):
+    count = len(close)
+    signals = np.zeros(count, dtype=bool)
+    if count < DOUBLE_BOTTOM_LOOKBACK:
+        return signals
+    windows = np.lib.stride_tricks.sliding_window_view(close, DOUBLE_BOTTOM_LOOKBACK)
+    ends = np.arange(len(windows)) + DOUBLE_BOTTOM_LOOKBACK - 1
+    avg_volume = _trailing_mean(volume, VOLUME_LOOKBACK)[ends]
+    signals[ends] = _double_bottom_on_windows(windows, close[ends], volume[ends], avg_volume)
+    return signals
+
+
+def _descending_trendline_signals_numpy(close, open_, high, low, volume):
+    count = len(close)
+    signals = np.zeros(count, dtype=bool)
+    if count < TRENDLINE_LOOKBACK:
+        return signals
+    windows = np.lib.stride_tricks.sliding_window_view(high, TRENDLINE_LOOKBACK)
+    ends = np.arange(len(windows)) + TRENDLINE_LOOKBACK - 1
+    avg_volume = _trailing_mean(volume, VOLUME_LOOKBACK)[ends]
+    signals[ends] = _descending_trendline_on_windows(windows, close[ends], open_[ends], high[ends], low[ends],
+                                                     volume[ends], avg_volume)
+    return signals
+
+
+# --- Public API ---
+
+def _as_arrays(*arrays):
+    return tuple(np.ascontiguousarray(array, dtype=np.float64) for array in arrays)
+
+
+def double_bottom_breakout(close, volume):
+    """True if the last bar completes a double bottom with a neckline breakout."""
+    close, volume = _as_arrays(close, volume)
+    return len(close) > 0 and bool(_double_bottom_at(close, volume, len(close) - 1))
+
+
+def double_bottom_signals(close, volume):
+    """Boolean array: day t is True if the double bottom check passes on the bars up to t."""
+    close, volume = _as_arrays(close, volume)
+    if njit is not None:
+        return _double_bottom_signals_loop(close, volume)
+    return _double_bottom_signals_numpy(close, volume)
+
+
+def descending_trendline_breakout(close, open_, high, low, volume):
+    """True if the last bar breaks a descending trendline with a confirmation candle."""
+    close, open_, high, low, volume = _as_arrays(close, open_, high, low, volume)
+    return len(close) > 0 and bool(_descending_trendline_at(close, open_, high, low, volume, len(close) - 1))
+
+
+def descending_trendline_signals(close, open_, high, low, volume):
+    """Boolean array: day t is True if the descending trendline breakout check passes on the bars up to t."""
+    close, open_, high, low, volume = _as_arrays(close, open_, high, low, volume)
+    if njit is not None:
+        return _descending_trendline_signals_loop(close, open_, high, low, volume)
+    return _descending_trendline_signals_numpy(close, open_, high, low, volume)
+
+
+def _last_bar_windows(panel, lookback):
+    """The last `lookback` columns of a right-aligned (symbols x bars) panel, and the rows that fill them."""
+    windows = panel[:, -lookback:] if panel.shape[1] >= lookback else np.full((len(panel), lookback), np.nan)
+    return windows, ~np.isnan(windows).any(axis=1)
+
+
+def double_bottom_breakout_panel(close, volume):
+    """
+    double_bottom_breakout for the last bar of every row of 2-D (symbols x bars) right-aligned
+    arrays (see MarketPanel.to_aligned), in one vectorized pass. Rows need no NaN in their last
+    40 bars; shorter rows are False.
+    """
+    close, volume = (np.asarray(panel, dtype=np.float64) for panel in (close, volume))
+    windows, complete = _last_bar_windows(close, DOUBLE_BOTTOM_LOOKBACK)
+    if not complete.any():
+        return complete
+    avg_volume = volume[:, -VOLUME_LOOKBACK:].mean(axis=1)
+    with np.errstate(invalid='ignore'):
+        signals = _double_bottom_on_windows(np.where(complete[:, np.newaxis], windows, 0.0),
+                                            close[:, -1], volume[:, -1], avg_volume)
+    return complete & signals
+
+
+def descending_trendline_breakout_panel(close, open_, high, low, volume):
+    """descending_trendline_breakout for the last bar of every row of 2-D right-aligned arrays (see double_bottom_breakout_panel)."""
+    close, open_, high, low, volume = (np.asarray(panel, dtype=np.float64) for panel in (close, open_, high, low, volume))
+    windows, complete = _last_bar_windows(high, TRENDLINE_LOOKBACK)
+    if not complete.any():
+        return complete
+    avg_volume = volume[:, -VOLUME_LOOKBACK:].mean(axis=1)
+    with np.errstate(invalid='ignore'):
+        signals = _descending_trendline_on_windows(windows, close[:, -1], open_[:, -1], high[:, -1], low[:, -1],
+                                                   volume[:, -1], avg_volume)
+    return complete & signals
@@ -7,11 +7,20 @@ from datetime import datetime, timedelta
 import jdatetime # Import jdatetime for Jalali date handling
 # مطمئن شوید get_today_jdate_str و normalize_value به درستی کار می‌کنند
 from services.utils import get_today_jdate_str, normalize_value, calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands, calculate_volume_ma, calculate_atr, calculate_smart_money_flow, check_candlestick_patterns 
+from services.jalali_calendar import jalali_to_gregorian
+from services.data_quality import get_quarantined_symbol_ids
+from services.smart_money_flow import get_latest_smart_money_flow, latest_smart_money_flow
+from services.indicator_registry import min_history
 import json # For handling JSON strings in DB
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Stored TechnicalIndicatorData values read below (services/indicator_registry); the crossover checks read the last two.
+# Symbols with fewer bars have undefined values for some of them (stored as 0), so they are skipped.
+BUY_QUEUE_INDICATORS = ['RSI', 'MACD', 'SMA_20', 'SMA_50', 'Volume_MA_20']
+BUY_QUEUE_HISTORY_BARS = min_history(BUY_QUEUE_INDICATORS, last_values=2)
+
 # Helper function to get the most reliable price
 def get_reliable_price(data_row):
     """
@@ -28,16 +37,9 @@ def get_reliable_price(data_row):
     return 0.0
 
 # Helper function to convert Jalali date string to Gregorian date object for Pandas
+# Accepts a single jdate string or a whole Series/array of them (vectorized lookup, invalid -> NaT)
 def convert_jalali_to_gregorian_for_pandas(jdate_str):
-    if pd.isna(jdate_str) or not isinstance(jdate_str, str):
-        return pd.NaT # Return Not a Time for invalid/missing dates
-    try:
-        # Attempt to parse using jdatetime.date.fromisoformat for robustness
-        jy, jm, jd = map(int, jdate_str.split('-'))
-        return jdatetime.date(jy, jm, jd).togregorian()
-    except (ValueError, AttributeError) as e:
-        logger.warning(f"Failed to convert Jalali date '{jdate_str}' to Gregorian: {e}. Returning NaT.")
-        return pd.NaT # Handle parsing errors by returning NaT
+    return jalali_to_gregorian(jdate_str)
 
 def run_potential_buy_queue_analysis_and_save():
     """
@@ -49,6 +51,8 @@ def run_potential_buy_queue_analysis_and_save():
     current_app.logger.info("Starting Potential Buy Queues analysis and saving results with enhanced logic.")
 
     symbols = ComprehensiveSymbolData.query.all()
+    quarantined_ids = get_quarantined_symbol_ids()
+    latest_flows = get_latest_smart_money_flow()
     
     # Separate lists for general symbols and funds
     general_potential_queues_candidates = []
@@ -77,6 +81,10 @@ def run_potential_buy_queue_analysis_and_save():
         symbol_id = symbol_data.symbol_id
         symbol_name = symbol_data.symbol_name
 
+        if symbol_id in quarantined_ids:
+            current_app.logger.debug(f"Skipping {symbol_name}: Quarantined by the data-quality checks.")
+            continue
+
         # Filter out pre-emptive rights symbols
         if any(symbol_name.startswith(p) for p in preemptive_rights_patterns):
             current_app.logger.debug(f"Skipping {symbol_name}: Identified as a pre-emptive rights symbol.")
@@ -87,16 +95,16 @@ def run_potential_buy_queue_analysis_and_save():
         # Fetch historical and technical data
         historical_records = HistoricalData.query.filter_by(symbol_id=symbol_id)\
                                                 .order_by(HistoricalData.jdate.desc())\
-                                                .limit(60).all() # Fetch enough data for indicators
+                                                .limit(BUY_QUEUE_HISTORY_BARS).all()
         
         technical_records = TechnicalIndicatorData.query.filter_by(symbol_id=symbol_id)\
                                                 .order_by(TechnicalIndicatorData.jdate.desc())\
-                                                .limit(60).all() # Fetch enough data for indicators
+                                                .limit(BUY_QUEUE_HISTORY_BARS).all()
 
         current_app.logger.debug(f"[{symbol_name}] Fetched {len(historical_records)} historical records.")
         current_app.logger.debug(f"[{symbol_name}] Fetched {len(technical_records)} technical records.")
 
-        if not historical_records or not technical_records or len(historical_records) < 30 or len(technical_records) < 30:
+        if not historical_records or not technical_records or len(historical_records) < BUY_QUEUE_HISTORY_BARS or len(technical_records) < BUY_QUEUE_HISTORY_BARS:
             current_app.logger.debug(f"[{symbol_name}] Skipping: Not enough historical or technical data found (hist: {len(historical_records)}, tech: {len(technical_records)}).")
             continue
 
@@ -107,8 +115,8 @@ def run_potential_buy_queue_analysis_and_save():
         current_app.logger.debug(f"[{symbol_name}] tech_df shape before date conversion: {tech_df.shape}, columns: {tech_df.columns.tolist()}")
 
         # Use custom function to convert jdate to Gregorian for Pandas
-        hist_df['greg_date'] = hist_df['jdate'].apply(convert_jalali_to_gregorian_for_pandas)
-        tech_df['greg_date'] = tech_df['jdate'].apply(convert_jalali_to_gregorian_for_pandas)
+        hist_df['greg_date'] = convert_jalali_to_gregorian_for_pandas(hist_df['jdate'])
+        tech_df['greg_date'] = convert_jalali_to_gregorian_for_pandas(tech_df['jdate'])
 
         # Drop rows where date conversion failed
         hist_df = hist_df.dropna(subset=['greg_date'])
@@ -247,9 +255,9 @@ def run_potential_buy_queue_analysis_and_save():
 
 
         # 9. Smart Money Flow (Individual Net Flow)
-        smart_money_df = calculate_smart_money_flow(hist_df)
-        if not smart_money_df.empty and 'individual_net_flow' in smart_money_df.columns:
-            latest_net_flow = smart_money_df.iloc[-1]['individual_net_flow']
+        latest_smart_money = latest_smart_money_flow(latest_flows, symbol_id, hist_df)
+        if latest_smart_money is not None and 'individual_net_flow' in latest_smart_money:
+            latest_net_flow = latest_smart_money['individual_net_flow']
             if pd.notna(latest_net_flow) and latest_net_flow > 0 and latest_net_flow > (latest_data.get('value', 0) * 0.03): 
                 reasons.append("ورود پول هوشمند (حقیقی)")
                 probability_percent += 18
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+# services/price_store.py - ذخیره ستونی و memory-map شونده قیمت‌ها در کنار جدول stock_data
+#
+# ساختار روی دیسک (پوشه PRICE_STORE_DIR):
+#   meta.json          تعداد ردیف‌های معتبر، فهرست symbol_idها (کد عددی = اندیس در این فهرست) و نسخه
+#   <column>.bin       یک فایل باینری خام برای هر ستون (symbol_code, day, open, high, ...)
+# ردیف‌ها فقط به انتهای فایل‌ها اضافه می‌شوند؛ اگر برای یک (نماد، روز) چند نسخه وجود داشته باشد
+# آخرین نسخه معتبر است. compact() فایل‌ها را مرتب و بدون تکرار بازنویسی می‌کند.
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # ویندوز: قفل بین پردازه‌ای در دسترس نیست
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'price_store')
+
+# ستون‌های کلیدی داخلی و ستون‌های داده (نام ستون‌ها مطابق مدل HistoricalData)
+KEY_COLUMNS = {'symbol_code': np.int32, 'day': np.int32}
+PRICE_COLUMNS = {
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'final': np.float64,
+    'volume': np.int64,
+    'value': np.int64,
+    'num_trades': np.int64,
+}
+STORE_COLUMNS = {**KEY_COLUMNS, **PRICE_COLUMNS}
+DEFAULT_LOAD_COLUMNS = ('close', 'high', 'low', 'volume')
+
+_EPOCH_DAY = np.datetime64('1970-01-01', 'D')
+
+
+def _make_keys(codes, days):
+    """Packs (symbol_code, day) pairs into sortable int64 keys."""
+    return (codes.astype(np.int64) << 32) | days.astype(np.int64)
+
+
+class PriceStore:
+    """
+    Append-only columnar store of daily bars, one memory-mapped file per column.
+    A single process should write at a time (guarded by a lock file where fcntl exists);
+    any number of readers can memory-map the files concurrently.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._index_cache = None  # (rows, generation, sorted_keys, positions)
+
+    # ---------------------------
+    # Metadata and raw columns
+    # ---------------------------
+    def _meta_path(self):
+        return os.path.join(self.root, 'meta.json')
+
+    def _column_path(self, column):
+        return os.path.join(self.root, f'{column}.bin')
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'version': 1, 'rows': 0, 'generation': 0, 'symbols': []}
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path())
+
+    def _column(self, column, rows):
+        """Read-only memory map of the first `rows` values of a column."""
+        if rows == 0:
+            return np.empty(0, dtype=STORE_COLUMNS[column])
+        return np.memmap(self._column_path(column), dtype=STORE_COLUMNS[column], mode='r', shape=(rows,))
+
+    @contextmanager
+    def _exclusive(self):
+        """Single-writer guard: a thread lock plus an flock on <root>/.lock where available."""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, '.lock'), 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _latest_index(self, meta):
+        """
+        Returns (sorted_keys, positions): one entry per (symbol_code, day) pointing at the
+        latest appended row, sorted by symbol then day. Cached until the store changes.
+        """
+        rows, generation = meta['rows'], meta.get('generation', 0)
+        cache = self._index_cache
+        if cache is not None and cache[0] == rows and cache[1] == generation:
+            return cache[2], cache[3]
+
+        keys = _make_keys(self._column('symbol_code', rows), self._column('day', rows))
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # برای هر کلید تکراری، آخرین ردیف اضافه‌شده را نگه می‌داریم
+        is_last = np.ones(len(sorted_keys), dtype=bool)
+        is_last[:-1] = sorted_keys[1:] != sorted_keys[:-1]
+        sorted_keys, positions = sorted_keys[is_last], order[is_last]
+
+        self._index_cache = (rows, generation, sorted_keys, positions)
+        return sorted_keys, positions
+
+    # ---------------------------
+    # Writing
+    # ---------------------------
+    def append(self, records):
+        """
+        Appends stock_data row dicts (as produced for HistoricalData, with symbol_id, date
+        and price columns). Rows identical to the latest stored version of the same
+        (symbol, day) are skipped, so re-ingesting an overlapping window only appends new
+        or corrected bars. Returns the number of rows appended.
+        """
+        if not records:
+            return 0
+
+        frame = pd.DataFrame.from_records(records)
+        if 'symbol_id' not in frame.columns or 'date' not in frame.columns:
+            raise ValueError("Price store records need 'symbol_id' and 'date'.")
+        frame = frame.dropna(subset=['symbol_id', 'date'])
+        frame['day'] = (pd.to_datetime(frame['date']).values.astype('datetime64[D]') - _EPOCH_DAY).astype(np.int32)
+
+        with self._exclusive():
+            meta = self._read_meta()
+            symbols = meta['symbols']
+            codes_by_symbol = {symbol_id: code for code, symbol_id in enumerate(symbols)}
+            for symbol_id in frame['symbol_id'].astype(str).unique():
+                if symbol_id not in codes_by_symbol:
+                    codes_by_symbol[symbol_id] = len(symbols)
+                    symbols.append(symbol_id)
+            frame['symbol_code'] = frame['symbol_id'].astype(str).map(codes_by_symbol).astype(np.int32)
+            frame = frame.drop_duplicates(subset=['symbol_code', 'day'], keep='last')
+
+            new_columns = {}
+            for column, dtype in PRICE_COLUMNS.items():
+                values = pd.to_numeric(frame[column], errors='coerce') if column in frame.columns else pd.Series(np.nan, index=frame.index)
+                if np.issubdtype(dtype, np.integer):
+                    values = values.fillna(0).round()
+                new_columns[column] = values.to_numpy(dtype=dtype)
+            new_columns['symbol_code'] = frame['symbol_code'].to_numpy(dtype=np.int32)
+            new_columns['day'] = frame['day'].to_numpy(dtype=np.int32)
+
+            keep = self._changed_rows_mask(meta, new_columns)
+            if not keep.any():
+                return 0
+
+            rows = meta['rows']
+            for column, dtype in STORE_COLUMNS.items():
+                path = self._column_path(column)
+                with open(path, 'ab') as f:
+                    # داده ناقص یک append قطع‌شده (بعد از آخرین meta معتبر) را کنار می‌گذاریم
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+                    f.write(np.ascontiguousarray(new_columns[column][keep]).tobytes())
+
+            meta['rows'] = rows + int(keep.sum())
+            self._write_meta(meta)
+            self._extend_index(rows, meta, _make_keys(new_columns['symbol_code'][keep], new_columns['day'][keep]))
+            return int(keep.sum())
+
+    def _extend_index(self, old_rows, meta, appended_keys):
+        """Updates the cached latest-row index in place after an append instead of re-sorting everything."""
+        cache = self._index_cache
+        if cache is None or cache[0] != old_rows or cache[1] != meta.get('generation', 0):
+            self._index_cache = None
+            return
+        sorted_keys, positions = cache[2], cache[3].copy()
+        appended_positions = old_rows + np.arange(len(appended_keys))
+
+        idx = np.searchsorted(sorted_keys, appended_keys)
+        found = np.zeros(len(appended_keys), dtype=bool)
+        if len(sorted_keys):
+            found = sorted_keys[np.minimum(idx, len(sorted_keys) - 1)] == appended_keys
+        positions[idx[found]] = appended_positions[found]
+
+        order = np.argsort(appended_keys[~found], kind='stable')
+        insert_keys = appended_keys[~found][order]
+        insert_at = np.searchsorted(sorted_keys, insert_keys)
+        sorted_keys = np.insert(sorted_keys, insert_at, insert_keys)
+        positions = np.insert(positions, insert_at, appended_positions[~found][order])
+        self._index_cache = (meta['rows'], meta.get('generation', 0), sorted_keys, positions)
+
+    def _changed_rows_mask(self, meta, new_columns):
+        """True for rows whose (symbol, day) is not stored yet or whose values differ."""
+        new_keys = _make_keys(new_columns['symbol_code'], new_columns['day'])
+        if meta['rows'] == 0:
+            return np.ones(len(new_keys), dtype=bool)
+
+        sorted_keys, positions = self._latest_index(meta)
+        idx = np.searchsorted(sorted_keys, new_keys)
+        idx_clipped = np.minimum(idx, len(sorted_keys) - 1)
+        found = sorted_keys[idx_clipped] == new_keys
+
+        changed = ~found
+        stored_rows = positions[idx_clipped[found]]
+        differs = np.zeros(int(found.sum()), dtype=bool)
+        for column in PRICE_COLUMNS:
+            stored = np.asarray(self._column(column, meta['rows'])[stored_rows])
+            incoming = new_columns[column][found]
+            differs |= ~((stored == incoming) | (np.isnan(stored.astype(float)) & np.isnan(incoming.astype(float))))
+        changed[found] = differs
+        return changed
+
+    def compact(self):
+        """Rewrites the column files sorted by (symbol, day) without superseded rows."""
+        with self._exclusive():
+            meta = self._read_meta()
+            if meta['rows'] == 0:
+                return 0
+            _, positions = self._latest_index(meta)
+            for column, dtype in STORE_COLUMNS.items():
+                data = np.asarray(self._column(column, meta['rows'])[positions])
+                tmp_path = self._column_path(column) + '.tmp'
+                data.astype(dtype).tofile(tmp_path)
+                os.replace(tmp_path, self._column_path(column))
+            meta['rows'] = int(len(positions))
+            meta['generation'] = meta.get('generation', 0) + 1
+            self._write_meta(meta)
+            self._index_cache = None
+            return meta['rows']
+
+    # ---------------------------
+    # Reading
+    # ---------------------------
+    def last_dates(self):
+        """Returns {symbol_id: last stored date (datetime.date)}."""
+        meta = self._read_meta()
+        if meta['rows'] == 0:
+            return {}
+        sorted_keys, _ = self._latest_index(meta)
+        codes = sorted_keys >> 32
+        is_last = np.ones(len(codes), dtype=bool)
+        is_last[:-1] = codes[1:] != codes[:-1]
+        days = (sorted_keys[is_last] & 0xFFFFFFFF).astype('timedelta64[D]') + _EPOCH_DAY
+        return {meta['symbols'][code]: day.astype(object) for code, day in zip(codes[is_last], days)}
+
+    def load_columns(self, columns=DEFAULT_LOAD_COLUMNS, symbol_ids=None, start_date=None, end_date=None):
+        """
+        Loads bars in long format, sorted by symbol then date, without touching the ORM.
+
+        Returns:
+            dict: 'symbol_id' (object array), 'date' (datetime64[D]) and one contiguous
+            ndarray per requested column, all of equal length.
+        """
+        meta = self._read_meta()
+        result = {'symbol_id': np.empty(0, dtype=object), 'date': np.empty(0, dtype='datetime64[D]')}
+        result.update({column: np.empty(0, dtype=PRICE_COLUMNS[column]) for column in columns})
+        if meta['rows'] == 0:
+            return result
+
+        sorted_keys, positions = self._latest_index(meta)
+        codes = (sorted_keys >> 32).astype(np.int32)
+        days = (sorted_keys & 0xFFFFFFFF).astype(np.int32)
+
+        mask = np.ones(len(sorted_keys), dtype=bool)
+        if symbol_ids is not None:
+            wanted_ids = set(map(str, symbol_ids))
+            wanted = [code for code, symbol_id in enumerate(meta['symbols']) if symbol_id in wanted_ids]
+            mask &= np.isin(codes, wanted)
+        if start_date is not None:
+            mask &= days >= (np.datetime64(pd.Timestamp(start_date).date(), 'D') - _EPOCH_DAY).astype(np.int32)
+        if end_date is not None:
+            mask &= days <= (np.datetime64(pd.Timestamp(end_date).date(), 'D') - _EPOCH_DAY).astype(np.int32)
+
+        rows = positions[mask]
+        symbols = np.array(meta['symbols'], dtype=object)
+        result['symbol_id'] = symbols[codes[mask]]
+        result['date'] = days[mask].astype('timedelta64[D]') + _EPOCH_DAY
+        for column in columns:
+            result[column] = np.asarray(self._column(column, meta['rows'])[rows])
+        return result
+
+    def load_panel(self, columns=DEFAULT_LOAD_COLUMNS, symbol_ids=None, start_date=None, end_date=None):
+        """
+        Loads bars as 2-D (symbols x dates) float arrays aligned on the union of trading
+        dates; days without a bar for a symbol are NaN.
+
+        Returns:
+            Tuple[ndarray, ndarray, dict]: symbol_ids, dates (datetime64[D]) and {column: 2-D array}.
+        """
+        long_data = self.load_columns(columns, symbol_ids=symbol_ids, start_date=start_date, end_date=end_date)
+        symbol_values, row_idx = np.unique(long_data['symbol_id'].astype(str), return_inverse=True)
+        dates, col_idx = np.unique(long_data['date'], return_inverse=True)
+        panel = {}
+        for column in columns:
+            matrix = np.full((len(symbol_values), len(dates)), np.nan, dtype=np.float64)
+            matrix[row_idx, col_idx] = long_data[column]
+            panel[column] = matrix
+        return symbol_values.astype(object), dates, panel
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_price_store(root=None):
+    """
+    Returns the shared PriceStore for `root`, defaulting to Config.PRICE_STORE_DIR of the
+    current Flask app (or the repository's price_store directory outside an app context).
+    """
+    if root is None:
+        try:
+            from flask import current_app
+            root = current_app.config.get('PRICE_STORE_DIR')
+        except RuntimeError:
+            root = None
+        root = root or DEFAULT_PRICE_STORE_DIR
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = PriceStore(root)
+        return _stores[root]
+
+
+def append_to_price_store(records):
+    """
+    Ingest hook: appends freshly written stock_data rows to the price store.
+    The store is a cache next to the database, so failures are logged and never raised.
+    """
+    try:
+        return get_price_store().append(records)
+    except Exception as e:
+        logger.warning(f"Could not append {len(records)} rows to the price store: {e}")
+        return 0
+
+
+def rebuild_price_store_from_db(batch_size=50000):
+    """
+    (Re)fills the price store from stock_data, reading only the stored columns in batches.
+    Intended for deployments that already have history in the database.
+    Returns the number of rows appended.
+    """
+    from extensions import db
+    from models import HistoricalData
+
+    columns = [HistoricalData.symbol_id, HistoricalData.date] + [getattr(HistoricalData, c) for c in PRICE_COLUMNS]
+    names = ['symbol_id', 'date'] + list(PRICE_COLUMNS)
+    query = db.session.query(*columns).order_by(HistoricalData.symbol_id, HistoricalData.date).yield_per(batch_size)
+
+    store = get_price_store()
+    appended = 0
+    batch = []
+    for row in query:
+        batch.append(dict(zip(names, row)))
+        if len(batch) >= batch_size:
+            appended += store.append(batch)
+            batch = []
+    appended += store.append(batch)
+    logger.info(f"Price store rebuilt from stock_data: {appended} rows appended.")
+    return appended
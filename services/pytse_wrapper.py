@@ -1,12 +1,18 @@
 # services/pytse_wrapper.py
 # Wrapper for pytse_client with error handling, retries, and safe fallbacks.
 
-import requests
-import time
 import logging
 import pandas as pd
 import pytse_client as tse
-from requests.exceptions import RequestException, Timeout, ConnectionError, HTTPError
+from requests.exceptions import RequestException, HTTPError
+
+from services.http_client import get_http_client, CircuitOpenError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only Parquet output needs it
+    pa = pq = None
 
 # Setting up logging for this module
 logger = logging.getLogger(__name__)
@@ -15,39 +21,23 @@ logger = logging.getLogger(__name__)
 # ---------------------------
 # HTTP GET with retries
 # ---------------------------
-def http_get(url, headers=None, max_retries=5, initial_delay=1):
-    """
-    Performs a safe HTTP GET request with retry logic and exponential backoff.
-    Manages specific network and HTTP errors for better resilience.
-    """
-    retries = 0
-    delay = initial_delay
-    while retries < max_retries:
-        try:
-            # Set a timeout to prevent the worker from blocking indefinitely.
-            response = requests.get(url, headers=headers, timeout=10)
-            # Raise an HTTPError for bad status codes (4xx or 5xx)
-            response.raise_for_status()
-            return response
-
-        except Timeout:
-            logger.error(f"Timeout occurred while fetching {url}. Retrying...")
-        except ConnectionError:
-            logger.error(f"Connection error while fetching {url}. Retrying...")
-        except HTTPError as e:
-            logger.error(f"HTTP error {e.response.status_code} for {url}. Retrying...")
-        except RequestException as e:
-            # Catches any other requests-related exceptions
-            logger.error(f"Request failed: {e}. Retrying...")
-
-        if retries < max_retries - 1:
-            logger.info(f"Waiting {delay}s before next retry...")
-            time.sleep(delay)
-            delay *= 2  # exponential backoff
-
-        retries += 1
-
-    logger.error(f"Failed to fetch data from {url} after {max_retries} retries.")
+def http_get(url, headers=None, max_retries=5, initial_delay=1, timeout=10):
+    """
+    Performs a safe HTTP GET request through the shared pooled client (services/http_client):
+    keep-alive connections, per-host rate limiting, jittered retries within a retry budget
+    and a per-host circuit breaker.
+    Returns the Response, or None if the request ultimately failed.
+    initial_delay is kept for backward compatibility; backoff is now set by the shared client.
+    """
+    client = get_http_client()
+    try:
+        return client.get(url, headers=headers, timeout=timeout, max_retries=max_retries - 1)
+    except CircuitOpenError as e:
+        logger.warning(str(e))
+    except HTTPError as e:
+        logger.error(f"HTTP error {e.response.status_code} for {url}.")
+    except RequestException as e:
+        logger.error(f"Failed to fetch data from {url}: {e}")
     return None
 
 
@@ -65,9 +55,11 @@ def Ticker(symbol_name):
         return None
 
 
-def download(symbols, write_to_csv=False, adjust=True, days_limit=None):
+def download(symbols, write_to_csv=False, adjust=True, days_limit=None, full_history=False):
     """
     Wrapper for tse.download with optional days_limit filtering to limit data size.
+    With full_history, every downloaded row is returned (no days_limit or MAX_ROWS cap), e.g. to
+    rewrite a symbol's whole stored history after a price adjustment.
     Handles both DataFrame and dict return types from the library with robust fallbacks.
     Note: The original library function does not support a timeout parameter,
     so we rely on our gevent worker for non-blocking behavior.
@@ -87,17 +79,17 @@ def download(symbols, write_to_csv=False, adjust=True, days_limit=None):
             return pd.DataFrame()
 
         # If days_limit is specified, use that; otherwise, use the MAX_ROWS hard cap
-        limit = days_limit if days_limit is not None else MAX_ROWS
+        limit = None if full_history else days_limit if days_limit is not None else MAX_ROWS
 
         if isinstance(df, dict):
             # Handle dict of DataFrames, returning an empty DataFrame for invalid data
             return {
-                sym: data.tail(limit) if isinstance(data, pd.DataFrame) and not data.empty else pd.DataFrame()
+                sym: (data if limit is None else data.tail(limit)) if isinstance(data, pd.DataFrame) and not data.empty else pd.DataFrame()
                 for sym, data in df.items()
             }
         elif isinstance(df, pd.DataFrame):
             # Handle single DataFrame
-            return df.tail(limit)
+            return df if limit is None else df.tail(limit)
         else:
             logger.warning(f"Unexpected return type from tse.download: {type(df)}. Returning empty DataFrame.")
             return pd.DataFrame()
@@ -107,43 +99,201 @@ def download(symbols, write_to_csv=False, adjust=True, days_limit=None):
         return pd.DataFrame()  # Safe fallback
 
 
+# ---------------------------
+# Incremental (delta) download
+# ---------------------------
+# فهرست قیمت‌های پایانی روزانه یک نماد از CDN جدید TSETMC؛ پارامتر دوم تعداد روزهای معاملاتی اخیر است
+CLOSING_PRICE_DAILY_URL = "http://cdn.tsetmc.com/api/ClosingPrice/GetClosingPriceDailyList/{}/{}"
+
+# CDN JSON fields -> pytse_client history columns (same layout as tse.download output)
+CLOSING_PRICE_FIELD_MAP = {
+    'priceFirst': 'open',
+    'priceMax': 'high',
+    'priceMin': 'low',
+    'pClosing': 'adjClose',
+    'pDrCotVal': 'close',
+    'priceYesterday': 'yesterday',
+    'qTotTran5J': 'volume',
+    'qTotCap': 'value',
+    'zTotTran': 'count',
+}
+
+# Beyond this gap a full download is cheaper than (and as reliable as) a delta request
+DELTA_MAX_DAYS = 365
+
+
+def download_since(symbol_id, since_date, adjust=True):
+    """
+    Incremental download: fetches only the trading days after since_date (the last stored
+    date) for one symbol from the TSETMC CDN, instead of its full history.
+
+    Returns a DataFrame in pytse_client's history layout with the rows after since_date
+    (empty if nothing is new), or None when the delta cannot be used and the caller should
+    fall back to download(): the gap is longer than DELTA_MAX_DAYS, the request failed, or,
+    with adjust=True, a price adjustment (capital increase / dividend) happened after
+    since_date, so the stored adjusted history has to be rewritten.
+    """
+    gap_days = (pd.Timestamp.today().normalize() - pd.Timestamp(since_date)).days
+    if gap_days <= 0:
+        return pd.DataFrame()
+    if gap_days > DELTA_MAX_DAYS:
+        return None
+
+    # تعداد روزهای تقویمی همیشه >= تعداد روزهای معاملاتی است؛ +۱ تا روز since_date هم برای مقایسه برگردد
+    response = http_get(CLOSING_PRICE_DAILY_URL.format(symbol_id, gap_days + 1),
+                        headers={'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'})
+    if response is None:
+        return None
+    try:
+        rows = response.json().get('closingPriceDaily') or []
+    except ValueError as e:
+        logger.error(f"Invalid delta response for symbol ID {symbol_id}: {e}")
+        return None
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(rows)
+    df['date'] = pd.to_datetime(df['dEven'].astype(str), format='%Y%m%d', errors='coerce')
+    df = df.rename(columns=CLOSING_PRICE_FIELD_MAP)
+    df = df[['date'] + list(CLOSING_PRICE_FIELD_MAP.values())].dropna(subset=['date'])
+    df = df.sort_values('date').drop_duplicates(subset=['date'], keep='last').reset_index(drop=True)
+
+    since_ts = pd.Timestamp(since_date)
+    new_mask = df['date'] > since_ts
+    if adjust and new_mask.any():
+        # Same rule as pytse_client.adjust_price: a day whose 'yesterday' differs from the
+        # previous day's closing price marks an adjustment of all earlier prices.
+        window = df[df['date'] >= since_ts]
+        if window.empty or window['date'].iat[0] != since_ts:
+            return None
+        if (window['yesterday'].iloc[1:].values != window['adjClose'].iloc[:-1].values).any():
+            logger.info(f"Price adjustment detected for symbol ID {symbol_id} after {since_ts.date()}; full download required.")
+            return None
+
+    return df[new_mask].reset_index(drop=True)
+
+
+class _CsvSink:
+    """Appends batches to one CSV file; the header is written with the first batch only."""
+
+    def __init__(self, path):
+        self.path = path
+        self._started = False
+
+    def write(self, df):
+        df.to_csv(self.path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        pass
+
+
+class _ParquetSink:
+    """
+    Appends batches as row groups of one Parquet file (requires pyarrow).
+    Numeric columns are written as float64 so a batch with missing values cannot change the schema.
+    """
+
+    def __init__(self, path):
+        if pq is None:
+            raise ImportError("pyarrow is required for Parquet output (pip install pyarrow).")
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        df = df.copy()
+        for col in df.columns:
+            if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+                df[col] = df[col].astype('float64')
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pandas(df, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _open_sink(output_filename, file_format=None):
+    file_format = (file_format or ('parquet' if output_filename.endswith('.parquet') else 'csv')).lower()
+    if file_format == 'parquet':
+        return _ParquetSink(output_filename)
+    if file_format == 'csv':
+        return _CsvSink(output_filename)
+    raise ValueError(f"Unsupported output format: {file_format}")
+
+
+def iter_download_batches(symbols, batch_size=20, days_limit=None, output_filename=None, file_format=None):
+    """
+    Streaming variant of safe_download_batch: downloads the symbols in batches and yields
+    one DataFrame (with a 'symbol' column) per batch as soon as it completes. If
+    output_filename is given, each batch is also appended to a CSV or Parquet file
+    (format taken from file_format or the file extension). Only the current batch is held
+    in memory; failed or empty batches are logged and skipped.
+    """
+    symbol_chunks = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+    logger.info(f"Starting streamed download for {len(symbols)} symbols in {len(symbol_chunks)} chunks.")
+
+    sink = _open_sink(output_filename, file_format) if output_filename else None
+    try:
+        for i, chunk in enumerate(symbol_chunks):
+            logger.info(f"Processing batch {i + 1}/{len(symbol_chunks)} with {len(chunk)} symbols.")
+            try:
+                chunk_data = download(symbols=chunk, days_limit=days_limit)
+                if not isinstance(chunk_data, dict) or not chunk_data:
+                    logger.warning(f"Batch {i + 1} returned empty or invalid data. Skipping...")
+                    continue
+                frames = [data.assign(symbol=sym) for sym, data in chunk_data.items() if not data.empty]
+                if not frames:
+                    logger.warning(f"Batch {i + 1} returned empty or invalid data. Skipping...")
+                    continue
+                batch_df = pd.concat(frames, ignore_index=True)
+                del chunk_data, frames
+            except Exception as e:
+                logger.error(f"Error in batch {i + 1}: {e}. Skipping this batch.")
+                continue
+
+            if sink is not None:
+                sink.write(batch_df)
+            yield batch_df
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+def download_batches_to_file(symbols, output_filename, batch_size=20, days_limit=None, file_format=None):
+    """
+    Downloads the symbols batch by batch straight into a CSV/Parquet file without keeping
+    earlier batches in memory. Returns (rows_written, batches_written).
+    """
+    rows = batches = 0
+    for batch_df in iter_download_batches(symbols, batch_size=batch_size, days_limit=days_limit,
+                                          output_filename=output_filename, file_format=file_format):
+        rows += len(batch_df)
+        batches += 1
+    logger.info(f"Wrote {rows} rows in {batches} batches to {output_filename}.")
+    return rows, batches
+
+
 def safe_download_batch(symbols, batch_size=20, days_limit=None, write_to_csv=False, output_filename="all_symbols_data.csv"):
     """
     Downloads data for a list of symbols in batches to manage memory usage.
     It handles errors gracefully, merges the data, and can write a single CSV file at the end.
+    The CSV is written incrementally while downloading; since the merged frame is returned,
+    memory still grows with the symbol count, so use iter_download_batches or
+    download_batches_to_file for the whole market.
     """
-    all_data = []
-    # Split the symbols list into chunks of the specified batch_size
-    symbol_chunks = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+    all_data = list(iter_download_batches(symbols, batch_size=batch_size, days_limit=days_limit,
+                                          output_filename=output_filename if write_to_csv else None, file_format='csv'))
 
-    logger.info(f"Starting batch download for {len(symbols)} symbols in {len(symbol_chunks)} chunks.")
-    
-    for i, chunk in enumerate(symbol_chunks):
-        logger.info(f"Processing batch {i + 1}/{len(symbol_chunks)} with {len(chunk)} symbols.")
-        try:
-            # Call the main download function for each batch. We do NOT pass write_to_csv here.
-            chunk_data = download(symbols=chunk, days_limit=days_limit)
-            
-            # Check if the returned data is valid before concatenating
-            if isinstance(chunk_data, dict) and chunk_data:
-                # Concatenate all DataFrames from the dictionary into a single DataFrame
-                all_data.append(pd.concat(chunk_data.values(), ignore_index=True))
-            else:
-                logger.warning(f"Batch {i + 1} returned empty or invalid data. Skipping...")
-
-        except Exception as e:
-            logger.error(f"Error in batch {i + 1}: {e}. Skipping this batch.")
-            
     # Concatenate all collected dataframes into a final, single DataFrame
     if all_data:
         final_df = pd.concat(all_data, ignore_index=True)
-        # Check if a single CSV file should be written
-        if write_to_csv and not final_df.empty:
-            try:
-                final_df.to_csv(output_filename, index=False)
-                logger.info(f"Successfully wrote all data to {output_filename}.")
-            except Exception as e:
-                logger.error(f"Failed to write data to CSV file {output_filename}: {e}")
+        if write_to_csv:
+            logger.info(f"Successfully wrote all data to {output_filename}.")
         return final_df
     else:
         logger.error("No valid data was downloaded. Returning an empty DataFrame.")
@@ -162,6 +312,20 @@ def all_tickers():
         return {}
 
 
+def symbols_information():
+    """
+    Safe wrapper for pytse_client.symbols_data.symbols_information.
+    Reads the symbol list bundled with pytse_client (name -> index, ISIN code, company name),
+    so it works without network access.
+    """
+    try:
+        from pytse_client import symbols_data
+        return symbols_data.symbols_information()
+    except Exception as e:
+        logger.error(f"Error reading bundled symbols information: {e}")
+        return {}
+
+
 def download_financial_indexes_safe(symbols, timeout=10, max_retries=3, backoff=2):
     """
     Safe wrapper for tse.download_financial_indexes.
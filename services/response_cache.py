@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# services/response_cache.py
+# کش دیسکی پاسخ‌های HTTP صفحات TSETMC (کلید: URL) با TTL جداگانه برای هر نوع منبع،
+# اعتبارسنجی شرطی (ETag / Last-Modified) و کش نتیجه پارس‌شده، تا صفحات بدون تغییر
+# نه دوباره دانلود شوند و نه دوباره با BeautifulSoup پارس شوند.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, has_app_context
+
+from services.pytse_wrapper import http_get
+
+logger = logging.getLogger(__name__)
+
+# مدت تازه ماندن هر نوع منبع (ثانیه). نوع بازار نماد به‌ندرت تغییر می‌کند؛ صفحه بنیادی روزانه.
+RESOURCE_TTLS = {
+    'loader_page': 7 * 24 * 3600,
+    'fundamental_page': 12 * 3600,
+}
+DEFAULT_TTL = 3600
+
+
+class ResponseCache:
+    """
+    URL-keyed on-disk cache. Each entry is '<sha1(url)>.body' (raw bytes) plus
+    '<sha1(url)>.json' (fetch time, validators, body hash and parsed results per parser).
+    Files are replaced atomically, so concurrent fetch threads can share one cache.
+    """
+
+    def __init__(self, root, ttls=None):
+        self.root = root
+        self.ttls = dict(RESOURCE_TTLS, **(ttls or {}))
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, f"{key}.json"), os.path.join(self.root, f"{key}.body")
+
+    def _write_atomic(self, path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_entry(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+            return meta, body
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache entry for {url}: {e}")
+            return None, None
+
+    def _write_meta(self, url, meta):
+        meta_path, _ = self._paths(url)
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def _store(self, url, response, body):
+        meta = {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_sha1': hashlib.sha1(body).hexdigest(),
+            'parsed': {},
+        }
+        _, body_path = self._paths(url)
+        with self._lock:
+            self._write_atomic(body_path, body)
+            self._write_meta(url, meta)
+        return meta
+
+    def fetch(self, url, resource, headers=None, timeout=10):
+        """
+        Returns (body_bytes, meta) for url, or (None, None) if it cannot be fetched.
+
+        A fresh entry (younger than the resource's TTL) is returned without network access.
+        A stale entry is revalidated with If-None-Match / If-Modified-Since when the server
+        sent validators; a 304 only refreshes the timestamp. If the request fails, the stale
+        body is served rather than nothing.
+        """
+        meta, body = self._read_entry(url)
+        ttl = self.ttls.get(resource, DEFAULT_TTL)
+        if meta is not None and time.time() - meta.get('fetched_at', 0) < ttl:
+            return body, meta
+
+        request_headers = dict(headers or {})
+        if meta is not None:
+            if meta.get('etag'):
+                request_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                request_headers['If-Modified-Since'] = meta['last_modified']
+
+        response = http_get(url, headers=request_headers, timeout=timeout)
+        if response is None:
+            if meta is not None:
+                logger.warning(f"Serving stale cached page for {url}.")
+            return body, meta
+
+        if response.status_code == 304 and meta is not None:
+            meta['fetched_at'] = time.time()
+            with self._lock:
+                self._write_meta(url, meta)
+            return body, meta
+
+        body = response.content
+        return body, self._store(url, response, body)
+
+    def fetch_parsed(self, url, resource, parser, headers=None, timeout=10, parser_key=None):
+        """
+        Returns parser(body) for url, reusing the stored result while the page body is
+        unchanged, so unchanged pages skip both the download and the parse.
+        Results must be JSON-serialisable to be cached; None is returned if the page
+        cannot be fetched.
+        """
+        body, meta = self.fetch(url, resource, headers=headers, timeout=timeout)
+        if body is None:
+            return None
+
+        parser_key = parser_key or f"{parser.__module__}.{parser.__qualname__}"
+        cached = meta.get('parsed', {}).get(parser_key)
+        if cached is not None and cached.get('body_sha1') == meta.get('body_sha1'):
+            return cached['result']
+
+        result = parser(body)
+        try:
+            meta.setdefault('parsed', {})[parser_key] = {'body_sha1': meta.get('body_sha1'), 'result': result}
+            with self._lock:
+                self._write_meta(url, meta)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Parsed result for {url} is not cacheable: {e}")
+        return result
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(root=None):
+    """
+    Returns the process-wide ResponseCache rooted at Config.RESPONSE_CACHE_DIR.
+    Usable from fetch worker threads: the directory is read from the app config only
+    when an app context is available.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None or (root and _cache.root != root):
+            if root is None:
+                if has_app_context():
+                    root = current_app.config.get('RESPONSE_CACHE_DIR')
+                if not root:
+                    from config import Config
+                    root = Config.RESPONSE_CACHE_DIR
+            _cache = ResponseCache(root)
+        return _cache
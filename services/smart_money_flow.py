@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# services/smart_money_flow.py
+# معیارهای جریان پول حقیقی/حقوقی (قدرت خریدار حقیقی، ورود پول، سرانه خرید/فروش) برای همه نمادها و همه روزها
+# در یک گذر برداری با indicator_kernels.smart_money_kernel محاسبه و در جدول smart_money_flow_data ذخیره می‌شوند.
+# اسکرینرها (کلید طلایی، واچ‌لیست هفتگی، صف خرید احتمالی) فقط آخرین ردیف هر نماد را با یک پرس‌وجو می‌خوانند.
+
+import logging
+
+import pandas as pd
+from sqlalchemy import and_, func, or_, select
+
+from extensions import db
+from models import HistoricalData, ComprehensiveSymbolData, SmartMoneyFlowData
+from services.db_utils import bulk_upsert
+from services.indicator_kernels import smart_money_kernel
+from services.utils import calculate_smart_money_flow
+
+logger = logging.getLogger(__name__)
+
+INPUT_COLUMNS = ['buy_i_volume', 'sell_i_volume', 'buy_count_i', 'sell_count_i', 'buy_n_volume', 'sell_n_volume']
+
+SMART_MONEY_COLUMNS = [
+    'individual_buy_power', 'individual_net_flow', 'individual_buy_per_trade',
+    'individual_sell_per_trade', 'legal_net_flow',
+]
+
+
+def compute_smart_money_flow_panel(bars):
+    """
+    Computes the money-flow metrics of every bar of every symbol at once. Pure function.
+
+    Args:
+        bars (DataFrame): symbol_id, date, jdate and the INPUT_COLUMNS of stock_data, one row per bar.
+
+    Returns:
+        DataFrame: symbol_id, date, jdate and the SMART_MONEY_COLUMNS, on the index of bars.
+    """
+    inputs = [pd.to_numeric(bars[column], errors='coerce').to_numpy(dtype=float, na_value=float('nan'))
+              for column in INPUT_COLUMNS]
+    metrics = smart_money_kernel(*inputs)
+    frame = pd.DataFrame({column: metrics[column] for column in SMART_MONEY_COLUMNS}, index=bars.index)
+    for column in ('jdate', 'date', 'symbol_id'):
+        frame.insert(0, column, bars[column])
+    return frame
+
+
+def _latest_dates(session, symbol_ids=None):
+    """
+    Query of (symbol_id, date of its latest smart_money_flow_data row or None) for every symbol.
+    The max is a correlated subquery per symbol, so it is an index lookup instead of a scan of the table.
+    """
+    latest_date = select(func.max(SmartMoneyFlowData.date)) \
+        .where(SmartMoneyFlowData.symbol_id == ComprehensiveSymbolData.symbol_id) \
+        .correlate(ComprehensiveSymbolData).scalar_subquery()
+    query = session.query(ComprehensiveSymbolData.symbol_id.label('symbol_id'), latest_date.label('date'))
+    if symbol_ids is not None:
+        query = query.filter(ComprehensiveSymbolData.symbol_id.in_(list(symbol_ids)))
+    return query
+
+
+def _load_new_bars(session, symbol_ids=None):
+    """
+    Loads the stock_data bars newer than each symbol's latest smart_money_flow_data row (the whole
+    history for symbols without rows). Symbols are grouped by that date, so on a normal day the
+    query is a single (symbol_id IN ..., date > ...) range.
+    """
+    columns = (HistoricalData.symbol_id, HistoricalData.date, HistoricalData.jdate,
+               *(getattr(HistoricalData, column) for column in INPUT_COLUMNS))
+    by_latest_date, new_symbols = {}, []
+    for symbol_id, latest_date in _latest_dates(session, symbol_ids).all():
+        if latest_date is None:
+            new_symbols.append(symbol_id)
+        else:
+            by_latest_date.setdefault(latest_date, []).append(symbol_id)
+
+    conditions = [and_(HistoricalData.symbol_id.in_(ids), HistoricalData.date > last_date)
+                  for last_date, ids in by_latest_date.items()]
+    conditions += [HistoricalData.symbol_id.in_(new_symbols[start:start + 500]) for start in range(0, len(new_symbols), 500)]
+    rows = []
+    for start in range(0, len(conditions), 100):
+        rows += session.query(*columns).filter(or_(*conditions[start:start + 100])).all()
+    return pd.DataFrame(rows, columns=['symbol_id', 'date', 'jdate'] + INPUT_COLUMNS)
+
+
+def update_smart_money_flow(session=db.session, symbol_ids=None):
+    """
+    Computes and stores the money-flow metrics of all bars not yet in smart_money_flow_data.
+    Idempotent; does not commit.
+
+    Returns:
+        Tuple[int, int]: Number of rows written and number of symbols updated.
+    """
+    bars = _load_new_bars(session, symbol_ids)
+    if bars.empty:
+        return 0, 0
+    frame = compute_smart_money_flow_panel(bars).drop_duplicates(subset=['symbol_id', 'jdate'], keep='last')
+    written = bulk_upsert(session, SmartMoneyFlowData, frame.to_dict('records'), index_elements=['symbol_id', 'jdate'])
+    return written, frame['symbol_id'].nunique()
+
+
+def run_smart_money_flow_update(symbol_ids=None):
+    """
+    Brings smart_money_flow_data up to the latest stored bars for all symbols (or symbol_ids) and commits.
+
+    Returns:
+        Tuple[int, str]: Number of rows written and a summary message.
+    """
+    try:
+        written, symbol_count = update_smart_money_flow(db.session, symbol_ids=symbol_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during smart money flow update: {e}", exc_info=True)
+        return 0, f"An error occurred during the smart money flow update: {e}"
+
+    message = f"Smart money flow update: {written} rows written for {symbol_count} symbols."
+    logger.info(message)
+    return written, message
+
+
+def get_latest_smart_money_flow(symbol_ids=None):
+    """
+    Returns the latest stored metrics of every symbol (or symbol_ids):
+    {symbol_id: {'jdate': ..., metric: value, ...}}. Symbols are grouped by their latest date, so on
+    a normal day this is one index lookup per symbol plus one query for the rows.
+    """
+    try:
+        by_latest_date = {}
+        for symbol_id, latest_date in _latest_dates(db.session, symbol_ids).all():
+            if latest_date is not None:
+                by_latest_date.setdefault(latest_date, []).append(symbol_id)
+        conditions = [and_(SmartMoneyFlowData.symbol_id.in_(ids), SmartMoneyFlowData.date == latest_date)
+                      for latest_date, ids in by_latest_date.items()]
+        rows = []
+        for start in range(0, len(conditions), 100):
+            rows += SmartMoneyFlowData.query.filter(or_(*conditions[start:start + 100])).all()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not load stored smart money flow, computing it per symbol: {e}")
+        return {}
+    return {row.symbol_id: {'jdate': row.jdate, **{column: getattr(row, column) for column in SMART_MONEY_COLUMNS}}
+            for row in rows}
+
+
+def latest_smart_money_flow(latest_flows, symbol_id, hist_df):
+    """
+    Money-flow metrics of the last bar of hist_df: the stored row from get_latest_smart_money_flow()
+    when it is for that bar, otherwise computed from hist_df (e.g. before the nightly update ran).
+    Returns None when neither is available.
+    """
+    stored = latest_flows.get(symbol_id)
+    if stored is not None and hist_df is not None and not hist_df.empty and 'jdate' in hist_df.columns \
+            and stored['jdate'] == hist_df['jdate'].iloc[-1]:
+        return stored
+    if hist_df is None or hist_df.empty:
+        return None
+    smart_money_flow_df = calculate_smart_money_flow(hist_df)
+    if smart_money_flow_df.empty:
+        return None
+    return smart_money_flow_df.iloc[-1].to_dict()
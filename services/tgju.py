@@ -7,6 +7,12 @@ import threading
 import time
 import atexit
 
+# این فایل هم به‌صورت ماژول (services.tgju) و هم به‌صورت اسکریپت مستقل (Dockerfile.tgju) اجرا می‌شود
+try:
+    from services.http_client import get_http_client
+except ImportError:
+    from http_client import get_http_client
+
 # --- تنظیمات اولیه و لاگینگ ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -31,7 +37,7 @@ def scrape_tgju_gold():
     """
     gold_url = "https://www.tgju.org/gold-chart"
     try:
-        g_r = requests.get(gold_url, headers=headers, timeout=10)
+        g_r = get_http_client().get(gold_url, headers=headers, timeout=10)
         g_r.raise_for_status()
         g_soup = BeautifulSoup(g_r.content, 'html.parser')
         g_tables = g_soup.find_all('table', class_='market-table')
@@ -86,7 +92,7 @@ def scrape_tgju_coin():
     """
     coin_url = "https://www.tgju.org/coin-chart"
     try:
-        c_r = requests.get(coin_url, headers=headers, timeout=10)
+        c_r = get_http_client().get(coin_url, headers=headers, timeout=10)
         c_r.raise_for_status()
         c_soup = BeautifulSoup(c_r.content, 'html.parser')
 
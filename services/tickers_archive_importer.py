@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# services/tickers_archive_importer.py
+# بارگذاری اولیه جدول stock_data از آرشیو CSV موجود در پوشه tickers_data (بدون نیاز به شبکه)
+
+import csv
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import pandas as pd
+
+from extensions import db
+from models import HistoricalData, ComprehensiveSymbolData
+from services.db_utils import bulk_upsert
+from services.data_fetch_and_process import _prepare_historical_records, reset_derived_history
+from services.pytse_wrapper import symbols_information
+from services.price_store import append_to_price_store
+
+logger = logging.getLogger(__name__)
+
+TICKERS_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tickers_data')
+
+# پسوند نام فایل‌های تعدیل‌شده در خروجی pytse_client (مثلاً «آبین-ت.csv»)
+ADJUSTED_FILE_SUFFIX = '-ت'
+
+
+def _collect_archive_files(data_dir, prefer_adjusted=True):
+    """
+    Returns {symbol_name: csv_path}, picking the adjusted ('-ت') file of a symbol
+    when prefer_adjusted is set and one exists, otherwise the raw file.
+    """
+    raw_files, adjusted_files = {}, {}
+    for file_name in os.listdir(data_dir):
+        if not file_name.endswith('.csv'):
+            continue
+        stem = file_name[:-len('.csv')]
+        if stem.endswith(ADJUSTED_FILE_SUFFIX):
+            adjusted_files[stem[:-len(ADJUSTED_FILE_SUFFIX)]] = os.path.join(data_dir, file_name)
+        else:
+            raw_files[stem] = os.path.join(data_dir, file_name)
+
+    files = dict(raw_files)
+    for symbol_name, path in adjusted_files.items():
+        if prefer_adjusted or symbol_name not in files:
+            files[symbol_name] = path
+    return files
+
+
+def _resolve_archive_symbols(symbol_names, create_missing_symbols=True):
+    """
+    Maps archive symbol names to symbol_ids with one query on ComprehensiveSymbolData.
+    Names unknown to the database are looked up in pytse_client's bundled symbol list and,
+    if create_missing_symbols is set, added to ComprehensiveSymbolData (market type is
+    left empty until the next online symbol population).
+    """
+    symbol_map = {
+        name: symbol_id for name, symbol_id in
+        db.session.query(ComprehensiveSymbolData.symbol_name, ComprehensiveSymbolData.symbol_id)
+                  .filter(ComprehensiveSymbolData.symbol_name.in_(list(symbol_names))).all()
+    }
+
+    missing = [name for name in symbol_names if name not in symbol_map]
+    if missing:
+        bundled = symbols_information()
+        for name in missing:
+            info = bundled.get(name)
+            if not info or not info.get('index'):
+                logger.warning(f"Symbol '{name}' from tickers_data not found in the database or pytse_client symbol list. Skipping.")
+                continue
+            symbol_map[name] = info['index']
+            if create_missing_symbols:
+                db.session.add(ComprehensiveSymbolData(
+                    symbol_id=info['index'],
+                    symbol_name=name,
+                    company_name=info.get('name'),
+                    isin=info.get('code'),
+                ))
+        db.session.commit()
+    return symbol_map
+
+
+def _parse_archive_file(path, symbol_id, symbol_name):
+    """
+    Worker-process step: reads one archive CSV and converts it to stock_data row dicts.
+    """
+    df = pd.read_csv(path)
+    return symbol_id, symbol_name, _prepare_historical_records(symbol_id, symbol_name, df)
+
+
+def _copy_into_postgres(session, records, overwrite):
+    """
+    PostgreSQL fast path: COPY the rows into a temporary staging table and move them
+    into stock_data with a single INSERT ... SELECT ... ON CONFLICT.
+    """
+    now = datetime.now()
+    columns = list(records[0].keys()) + ['created_at', 'updated_at']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow(['' if value is None else value for value in record.values()] + [now, now])
+    buffer.seek(0)
+
+    column_list = ', '.join(columns)
+    if overwrite:
+        update_list = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns if col not in ('symbol_id', 'date', 'created_at'))
+        conflict_clause = f"DO UPDATE SET {update_list}"
+    else:
+        conflict_clause = "DO NOTHING"
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS stock_data_import (LIKE stock_data INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY stock_data_import ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO stock_data ({column_list}) SELECT {column_list} FROM stock_data_import "
+            f"ON CONFLICT (symbol_id, date) {conflict_clause}"
+        )
+        cursor.execute("TRUNCATE stock_data_import")
+    finally:
+        cursor.close()
+    return len(records)
+
+
+def _bulk_load_records(session, records, overwrite):
+    """
+    Writes one symbol's rows: COPY on PostgreSQL, batched executemany upsert elsewhere.
+    Existing (symbol_id, date) rows are kept unless overwrite is set.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        return _copy_into_postgres(session, records, overwrite)
+    update_columns = None if overwrite else []
+    return bulk_upsert(session, HistoricalData, records, index_elements=['symbol_id', 'date'], update_columns=update_columns)
+
+
+def import_tickers_archive(data_dir=None, workers=None, prefer_adjusted=True, overwrite=False,
+                           create_missing_symbols=True, commit_every=50):
+    """
+    Seeds stock_data from the per-symbol CSVs in tickers_data.
+    CSVs are parsed in parallel worker processes; the calling process resolves symbols
+    and is the only database writer.
+
+    Args:
+        data_dir (str): Archive directory (defaults to the repository's tickers_data).
+        workers (int): Number of parser processes (defaults to the CPU count).
+        prefer_adjusted (bool): Use the adjusted ('-ت') file of a symbol when available.
+        overwrite (bool): Overwrite rows that already exist instead of keeping them.
+        create_missing_symbols (bool): Add symbols missing from ComprehensiveSymbolData.
+        commit_every (int): Number of files written per commit.
+
+    Returns:
+        Tuple[int, str]: Number of rows sent to the database and a summary message.
+    """
+    data_dir = data_dir or TICKERS_DATA_DIR
+    if not os.path.isdir(data_dir):
+        return 0, f"tickers_data directory not found: {data_dir}"
+
+    files = _collect_archive_files(data_dir, prefer_adjusted=prefer_adjusted)
+    if not files:
+        return 0, f"No CSV files found in {data_dir}."
+    logger.info(f"Importing {len(files)} symbols from {data_dir}.")
+
+    symbol_map = _resolve_archive_symbols(list(files), create_missing_symbols=create_missing_symbols)
+
+    jobs = [(path, symbol_map[name], name) for name, path in files.items() if name in symbol_map]
+    workers = workers or os.cpu_count() or 1
+    total_rows = 0
+    imported_files = 0
+    failed_files = 0
+    last_dates = {}
+    # Rows of the uncommitted files, appended to the price store only after their commit succeeded
+    price_store_records = []
+    # spawn: forked children would share (and could close) the parent's database connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        jobs_iter = iter(jobs)
+        pending = {}
+        while True:
+            # Only a few parsed files are held in memory while the single writer catches up
+            for path, symbol_id, symbol_name in jobs_iter:
+                pending[pool.submit(_parse_archive_file, path, symbol_id, symbol_name)] = symbol_name
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol_name = pending.pop(future)
+                try:
+                    symbol_id, _, records = future.result()
+                    if records:
+                        with db.session.begin_nested():
+                            total_rows += _bulk_load_records(db.session, records, overwrite)
+                            if overwrite:
+                                reset_derived_history(db.session, {symbol_id: min(record['date'] for record in records)})
+                        price_store_records.extend(records)
+                        last_dates[symbol_id] = max(record['date'] for record in records)
+                    imported_files += 1
+                except Exception as e:
+                    failed_files += 1
+                    logger.error(f"Failed to import tickers_data file for {symbol_name}: {e}")
+                    continue
+
+                if imported_files % commit_every == 0:
+                    db.session.commit()
+                    append_to_price_store(price_store_records)
+                    price_store_records = []
+                    logger.info(f"Progress: {imported_files}/{len(jobs)} files imported ({total_rows} rows).")
+    db.session.commit()
+    append_to_price_store(price_store_records)
+
+    # last_historical_update_date را برای نمادهای واردشده به‌روز می‌کنیم
+    for symbol in ComprehensiveSymbolData.query.filter(ComprehensiveSymbolData.symbol_id.in_(list(last_dates))).all():
+        last_date = last_dates[symbol.symbol_id]
+        if symbol.last_historical_update_date is None or symbol.last_historical_update_date < last_date:
+            symbol.last_historical_update_date = last_date
+    db.session.commit()
+
+    message = (f"tickers_data import finished. {imported_files} files imported, {failed_files} failed, "
+               f"{len(files) - len(jobs)} skipped (unknown symbol). {total_rows} rows sent to the database.")
+    logger.info(message)
+    return total_rows, message
@@ -7,6 +7,9 @@ import pandas as pd
 import numpy as np
 from sqlalchemy import func # برای استفاده از توابع دیتابیس مانند lower در کوئری‌ها
 
+from services.jalali_calendar import gregorian_to_jalali # تبدیل تاریخ با جدول از پیش محاسبه‌شده
+from services.indicator_kernels import rsi_kernel, macd_kernel, sma_kernel, bollinger_kernel, atr_kernel, smart_money_kernel # نسخه‌های ماتریسی اندیکاتورها
+
 import logging # برای لاگ‌نویسی
 logger = logging.getLogger(__name__) # مقداردهی اولیه logger برای این ماژول
 
@@ -18,21 +21,12 @@ def convert_gregorian_to_jalali(gregorian_date_obj):
         if pd.isna(gregorian_date_obj):
             return None
 
-        if isinstance(gregorian_date_obj, datetime.datetime):
-            gregorian_dt = gregorian_date_obj
-        elif isinstance(gregorian_date_obj, datetime.date):
-            gregorian_dt = datetime.datetime(gregorian_date_obj.year, gregorian_date_obj.month, gregorian_date_obj.day)
-        else:
+        if not isinstance(gregorian_date_obj, datetime.date): # datetime.datetime و pd.Timestamp هم زیرکلاس date هستند
             logger.warning(f"نوع ورودی نامعتبر برای تبدیل تاریخ: {type(gregorian_date_obj)}")
             return None # نوع ورودی نامعتبر
 
-        jdate_obj = jdatetime.date.fromgregorian(
-            year=gregorian_dt.year,
-            month=gregorian_dt.month,
-            day=gregorian_dt.day
-        ).strftime('%Y-%m-%d')
-
-        return jdate_obj
+        # برای تبدیل یک ستون کامل، gregorian_to_jalali را مستقیماً روی کل آرایه فراخوانی کنید
+        return gregorian_to_jalali(gregorian_date_obj)
     except ValueError as e:
         logger.error(f"خطا در تبدیل تاریخ میلادی به جلالی (ValueError): {e} - ورودی: {gregorian_date_obj}")
         return None
@@ -70,157 +64,99 @@ def normalize_value(val):
             return None
     return val
 
+def _series_values(series, name, window=None):
+    """
+    مقادیر عددی یک Series را برای کرنل‌های services/indicator_kernels آماده می‌کند.
+    اگر window داده شود و داده غیر NaN کافی نباشد، هشدار ثبت می‌شود (کرنل در این حالت NaN برمی‌گرداند).
+    """
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    if window is not None:
+        valid_count = int(np.count_nonzero(~np.isnan(values)))
+        if 0 < valid_count < window:
+            logger.warning(f"داده کافی ({valid_count}) برای محاسبه {name} با window={window} وجود ندارد. بازگرداندن NaN.")
+    return values
+
+
+def _to_series(row, index):
+    return pd.Series(row[0], index=index)
+
+
 def calculate_rsi(series, window=14):
     """
     محاسبه شاخص قدرت نسبی (RSI).
     ورودی: pandas Series از قیمت‌های بسته شدن.
+    پوشش نازک روی indicator_kernels.rsi_kernel (NaNها نادیده گرفته می‌شوند و در خروجی NaN می‌مانند).
     """
     if not isinstance(series, pd.Series):
         logger.error("ورودی برای RSI باید یک pandas Series باشد.")
         raise TypeError("Input for RSI must be a pandas Series.")
 
-    # اطمینان از نوع عددی و مدیریت NaNها
-    series = pd.to_numeric(series, errors='coerce')
-    # اگر بعد از تبدیل، همه مقادیر NaN شدند، یک سری با NaN برمی‌گردانیم.
-    if series.isnull().all():
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    # حذف NaNها برای محاسبات (توجه: این ممکن است طول سری را تغییر دهد)
-    series_cleaned = series.dropna()
-    if len(series_cleaned) < window:
-        logger.warning(f"داده کافی ({len(series_cleaned)}) برای محاسبه RSI با window={window} وجود ندارد. بازگرداندن NaN.")
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    delta = series_cleaned.diff()
-    gain = (delta.where(delta > 0, 0)).fillna(0)
-    loss = (-delta.where(delta < 0, 0)).fillna(0)
-
-    avg_gain = gain.ewm(span=window, adjust=False).mean()
-    avg_loss = loss.ewm(span=window, adjust=False).mean()
-
-    # جلوگیری از تقسیم بر صفر با جایگزینی 0 با NaN در avg_loss قبل از تقسیم
-    rs = avg_gain / avg_loss.replace(0, np.nan)
-    # مدیریت مقادیر نامحدود که ممکن است از تقسیم بر صفر ناشی شوند، سپس NaNها را با 0 پر می‌کنیم.
-    rs = rs.replace([np.inf, -np.inf], np.nan).fillna(0)
-
-    rsi = 100 - (100 / (1 + rs))
-    # اطمینان از عدم وجود inf/NaN در خروجی نهایی، با 0 یا مقدار مناسب دیگر پر می‌کنیم.
-    final_rsi = rsi.replace([np.inf, -np.inf], np.nan).fillna(0)
-
-    # بازگرداندن سری با ایندکس اصلی
-    return final_rsi.reindex(series.index)
+    values = _series_values(series, 'RSI', window)
+    return _to_series(rsi_kernel(values, window=window), series.index)
 
 def calculate_macd(series, short_window=12, long_window=26, signal_window=9):
     """
     محاسبه MACD، خط سیگنال MACD و هیستوگرام MACD.
     ورودی: pandas Series از قیمت‌های بسته شدن.
+    پوشش نازک روی indicator_kernels.macd_kernel.
     """
     if not isinstance(series, pd.Series):
         logger.error("ورودی برای MACD باید یک pandas Series باشد.")
         raise TypeError("Input for MACD must be a pandas Series.")
 
-    series = pd.to_numeric(series, errors='coerce')
-    if series.isnull().all():
-        return (pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index))
-
-    series_cleaned = series.dropna()
-    if len(series_cleaned) < long_window: # MACD نیاز به داده کافی برای پنجره طولانی‌تر دارد
-        logger.warning(f"داده کافی ({len(series_cleaned)}) برای محاسبه MACD با long_window={long_window} وجود ندارد. بازگرداندن NaN.")
-        return (pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index))
-
-    exp1 = series_cleaned.ewm(span=short_window, adjust=False).mean()
-    exp2 = series_cleaned.ewm(span=long_window, adjust=False).mean()
-    macd = exp1 - exp2
-    macd_signal = macd.ewm(span=signal_window, adjust=False).mean()
-    macd_hist = macd - macd_signal
-
-    # بازگرداندن سری‌ها با ایندکس اصلی
-    return (macd.reindex(series.index),
-            macd_signal.reindex(series.index),
-            macd_hist.reindex(series.index))
+    values = _series_values(series, 'MACD', long_window) # MACD نیاز به داده کافی برای پنجره طولانی‌تر دارد
+    macd, macd_signal, macd_hist = macd_kernel(values, short_window, long_window, signal_window)
+    return (_to_series(macd, series.index),
+            _to_series(macd_signal, series.index),
+            _to_series(macd_hist, series.index))
 
 def calculate_sma(series, window):
     """
     محاسبه میانگین متحرک ساده (SMA).
     ورودی: pandas Series از قیمت‌ها.
+    پوشش نازک روی indicator_kernels.sma_kernel.
     """
     if not isinstance(series, pd.Series):
         logger.error("ورودی برای SMA باید یک pandas Series باشد.")
         raise TypeError("Input for SMA must be a pandas Series.")
 
-    series = pd.to_numeric(series, errors='coerce')
-    if series.isnull().all():
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    series_cleaned = series.dropna()
-    if len(series_cleaned) < window:
-        logger.warning(f"داده کافی ({len(series_cleaned)}) برای محاسبه SMA با window={window} وجود ندارد. بازگرداندن NaN.")
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    sma = series_cleaned.rolling(window=window).mean()
-    return sma.reindex(series.index)
+    values = _series_values(series, 'SMA', window)
+    return _to_series(sma_kernel(values, window), series.index)
 
 def calculate_bollinger_bands(series, window=20, num_std_dev=2):
     """
     محاسبه باندهای بولینگر.
     ورودی: pandas Series از قیمت‌ها.
+    پوشش نازک روی indicator_kernels.bollinger_kernel.
     """
     if not isinstance(series, pd.Series):
         logger.error("ورودی برای باندهای بولینگر باید یک pandas Series باشد.")
         raise TypeError("Input for Bollinger Bands must be a pandas Series.")
 
-    series = pd.to_numeric(series, errors='coerce')
-    if series.isnull().all():
-        return (pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index))
-
-    series_cleaned = series.dropna()
-    if len(series_cleaned) < window:
-        logger.warning(f"داده کافی ({len(series_cleaned)}) برای محاسبه باندهای بولینگر با window={window} وجود ندارد. بازگرداندن NaN.")
-        return (pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index),
-                pd.Series([np.nan] * len(series), index=series.index))
-
-    ma = series_cleaned.rolling(window=window).mean()
-    std = series_cleaned.rolling(window=window).std()
-
-    upper_band = ma + (std * num_std_dev)
-    lower_band = ma - (std * num_std_dev)
-
-    # بازگرداندن سری‌ها با ایندکس اصلی
-    return (ma.reindex(series.index),
-            upper_band.reindex(series.index),
-            lower_band.reindex(series.index))
+    values = _series_values(series, 'باندهای بولینگر', window)
+    ma, upper_band, lower_band = bollinger_kernel(values, window, num_std_dev)
+    return (_to_series(ma, series.index),
+            _to_series(upper_band, series.index),
+            _to_series(lower_band, series.index))
 
 def calculate_volume_ma(series, window=20):
     """
     محاسبه میانگین متحرک حجم.
     ورودی: pandas Series از حجم معاملات.
+    پوشش نازک روی indicator_kernels.sma_kernel.
     """
     if not isinstance(series, pd.Series):
         logger.error("ورودی برای میانگین متحرک حجم باید یک pandas Series باشد.")
         raise TypeError("Input for Volume MA must be a pandas Series.")
 
-    series = pd.to_numeric(series, errors='coerce')
-    if series.isnull().all():
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    series_cleaned = series.dropna()
-    if len(series_cleaned) < window:
-        logger.warning(f"داده کافی ({len(series_cleaned)}) برای محاسبه Volume MA با window={window} وجود ندارد. بازگرداندن NaN.")
-        return pd.Series([np.nan] * len(series), index=series.index)
-
-    volume_ma = series_cleaned.rolling(window=window).mean()
-    return volume_ma.reindex(series.index)
+    values = _series_values(series, 'Volume MA', window)
+    return _to_series(sma_kernel(values, window), series.index)
 
 def calculate_atr(high, low, close, window=14):
     """
     محاسبه Average True Range (ATR).
+    پوشش نازک روی indicator_kernels.atr_kernel؛ هر ردیف سری یک بار است و قیمت‌های NaN
+    با مقدار قبلی (و در ابتدای سری با 0) پر می‌شوند.
     Args:
         high (pd.Series): سری قیمت‌های بالا.
         low (pd.Series): سری قیمت‌های پایین.
@@ -233,29 +169,9 @@ def calculate_atr(high, low, close, window=14):
         logger.error("ورودی‌های ATR باید pandas Series باشند.")
         raise TypeError("Inputs for ATR must be pandas Series.")
 
-    # اطمینان از نوع عددی و مدیریت NaNها با پر کردن 0 در صورت لزوم برای محاسبات موقت
-    # استفاده از ffill() برای پر کردن NaNها از مقادیر قبلی، سپس fillna(0) برای ابتدای سری.
-    # این تغییر برای رفع FutureWarning اعمال شده است.
-    high_cleaned = pd.to_numeric(high, errors='coerce').ffill().fillna(0)
-    low_cleaned = pd.to_numeric(low, errors='coerce').ffill().fillna(0)
-    close_cleaned = pd.to_numeric(close, errors='coerce').ffill().fillna(0)
-
-    if len(high_cleaned) < 2: # ATR حداقل به 2 نقطه داده نیاز دارد (قیمت فعلی و بسته شدن قبلی)
-        return pd.Series([np.nan] * len(high), index=high.index) # بازگرداندن NaN با ایندکس اصلی
-
-    # محاسبه True Range (TR)
-    tr1 = high_cleaned - low_cleaned
-    tr2 = abs(high_cleaned - close_cleaned.shift(1)) # استفاده از shift(1) برای قیمت بسته شدن روز قبل
-    tr3 = abs(low_cleaned - close_cleaned.shift(1))
-
-    # انتخاب حداکثر از سه مقدار TR و پر کردن هر NaN با 0 (برای اولین ردیف shift)
-    true_range = pd.DataFrame({'tr1': tr1, 'tr2': tr2, 'tr3': tr3}).max(axis=1).fillna(0)
-
-    # محاسبه ATR با استفاده از میانگین متحرک نمایی (EMA) از TR
-    atr = true_range.ewm(span=window, adjust=False).mean()
-
-    # بازگرداندن سری ATR با ایندکس اصلی
-    return atr.reindex(high.index)
+    atr = atr_kernel(_series_values(high, 'ATR'), _series_values(low, 'ATR'), _series_values(close, 'ATR'),
+                     window=window, bars=True)
+    return _to_series(atr, high.index)
 
 
 def get_symbol_id(input_param):
@@ -342,26 +258,12 @@ def calculate_smart_money_flow(df):
         if df.empty or not all(col in df.columns for col in required_cols):
             return pd.DataFrame()
 
-    df_copy = df.copy() # کار روی یک کپی برای جلوگیری از SettingWithCopyWarning
-
-    # اطمینان از نوع عددی و پر کردن NaNها با 0 برای ستون‌های مرتبط
-    for col in required_cols:
-        df_copy[col] = pd.to_numeric(df_copy[col], errors='coerce').fillna(0)
-
-    # قدرت خرید حقیقی (Individual Buy Power)
-    # نسبت حجم خرید حقیقی به حجم فروش حقیقی
-    df_copy['individual_buy_power'] = df_copy['buy_i_volume'] / df_copy['sell_i_volume'].replace(0, np.nan)
-    df_copy['individual_buy_power'] = df_copy['individual_buy_power'].replace([np.inf, -np.inf], np.nan).fillna(0)
-
-    # خالص ورود/خروج پول حقیقی (Individual Net Flow)
-    # تفاوت بین حجم خرید حقیقی و حجم فروش حقیقی
-    df_copy['individual_net_flow'] = df_copy['buy_i_volume'] - df_copy['sell_i_volume']
-
-    # سرانه خرید/فروش حقیقی (Individual Buy/Sell per Trade)
-    df_copy['individual_buy_per_trade'] = df_copy['buy_i_volume'] / df_copy['buy_count_i'].replace(0, np.nan)
-    df_copy['individual_sell_per_trade'] = df_copy['sell_i_volume'] / df_copy['sell_count_i'].replace(0, np.nan)
-    df_copy['individual_buy_per_trade'] = df_copy['individual_buy_per_trade'].replace([np.inf, -np.inf], np.nan).fillna(0)
-    df_copy['individual_sell_per_trade'] = df_copy['individual_sell_per_trade'].replace([np.inf, -np.inf], np.nan).fillna(0)
+    # محاسبه برداری با indicator_kernels.smart_money_kernel (همان کرنلی که services/smart_money_flow برای کل بازار استفاده می‌کند)
+    inputs = [pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan) for col in required_cols[:4]]
+    metrics = smart_money_kernel(*inputs)
+    df_copy = pd.DataFrame(metrics, index=df.index)
+    if 'jdate' in df.columns:
+        df_copy.insert(0, 'jdate', df['jdate'])
 
     # بازگرداندن ستون‌های محاسبه شده.
     # فرض می‌شود 'jdate' در DataFrame ورودی موجود است.
@@ -439,7 +341,7 @@ def check_candlestick_patterns(today_candle_data, yesterday_candle_data, close_p
         detected_patterns.append("Bullish Engulfing")
         logger.debug("الگوی Bullish Engulfing شناسایی شد.")
 
-    # می‌توانید الگوهای بیشتری را در اینجا اضافه کنید (مانند Morning Star, Piercing Line و غیره).
+    # الگوهای بیشتر (Doji, Piercing Line, Morning Star, Three White Soldiers) روی کل تاریخچه در services/candlestick_scanner.
 
     return detected_patterns
 
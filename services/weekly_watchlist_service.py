@@ -12,6 +12,10 @@ import json
 
 # Import utility functions
 from services.utils import get_today_jdate_str, normalize_value, calculate_rsi, calculate_macd, calculate_sma, calculate_bollinger_bands, calculate_volume_ma, calculate_atr, calculate_smart_money_flow, check_candlestick_patterns, check_tsetmc_filters, check_financial_ratios, convert_gregorian_to_jalali 
+from services.jalali_calendar import jalali_to_gregorian
+from services.data_quality import get_quarantined_symbol_ids
+from services.smart_money_flow import get_latest_smart_money_flow, latest_smart_money_flow
+from services.indicator_registry import min_history
 
 # Import analysis_service for aggregated performance calculation
 from services import analysis_service 
@@ -19,8 +23,10 @@ from services import analysis_service
 # تنظیمات لاگینگ برای این ماژول
 logger = logging.getLogger(__name__)
 
-# Define the lookback period for technical data (e.g., 60 days for SMA_50, Bollinger Bands)
-TECHNICAL_DATA_LOOKBACK_DAYS = 60
+# Stored TechnicalIndicatorData values used by _check_technical_filters (services/indicator_registry).
+# The lookback is the fewest bars for which all of them are defined (SMA_50 is the longest).
+WATCHLIST_INDICATORS = ['RSI', 'MACD', 'SMA_20', 'SMA_50', 'Bollinger', 'Volume_MA_20']
+TECHNICAL_DATA_LOOKBACK_DAYS = min_history(WATCHLIST_INDICATORS)
 
 def is_data_sufficient(data_list, min_len):
     """
@@ -38,16 +44,10 @@ def is_data_sufficient(data_list, min_len):
 def convert_jalali_to_gregorian_timestamp(jdate_str):
     """
     Converts a Jalali date string (YYYY-MM-DD) to a pandas Timestamp (Gregorian).
-    Handles NaN/None values gracefully.
+    Also accepts a whole Series of jdate strings, converted in one vectorized call.
+    Handles NaN/None values gracefully (NaT).
     """
-    if pd.notna(jdate_str) and isinstance(jdate_str, str):
-        try:
-            jy, jm, jd = map(int, jdate_str.split('-'))
-            gregorian_date = jdatetime.date(jy, jm, jd).togregorian()
-            return pd.Timestamp(gregorian_date)
-        except ValueError:
-            return pd.NaT # Return Not a Time for invalid date strings
-    return pd.NaT # Return Not a Time for NaN or None
+    return jalali_to_gregorian(jdate_str)
 
 def _get_symbol_data_for_watchlist(symbol_id, symbol_name, lookback_days=TECHNICAL_DATA_LOOKBACK_DAYS):
     """
@@ -91,7 +91,7 @@ def _get_symbol_data_for_watchlist(symbol_id, symbol_name, lookback_days=TECHNIC
     
     # Convert technical records to DataFrame and get the latest row for current indicators
     tech_df = pd.DataFrame([rec.__dict__ for rec in technical_records]).drop(columns=['_sa_instance_state'], errors='ignore')
-    tech_df['date'] = tech_df['jdate'].apply(convert_jalali_to_gregorian_timestamp)
+    tech_df['date'] = convert_jalali_to_gregorian_timestamp(tech_df['jdate'])
     tech_df = tech_df.dropna(subset=['date']) # Drop rows where conversion failed
     tech_df = tech_df.sort_values(by='date', ascending=True).reset_index(drop=True)
     tech_df = tech_df.sort_values(by='jdate', ascending=True).reset_index(drop=True)
@@ -200,9 +200,11 @@ def _check_fundamental_filters(fundamental_rec):
 
     return satisfied_filters, reason_parts
 
-def _check_smart_money_filters(hist_df):
+def _check_smart_money_filters(hist_df, latest_smart_money=None):
     """
     Applies smart money flow filters.
+    latest_smart_money holds the metrics of the last bar (services/smart_money_flow.latest_smart_money_flow);
+    they are computed from hist_df when not given.
     """
     satisfied_filters = []
     reason_parts = []
@@ -210,12 +212,11 @@ def _check_smart_money_filters(hist_df):
     if hist_df is None or hist_df.empty or 'buy_i_volume' not in hist_df.columns: # Changed to 'buy_i_volume'
         return satisfied_filters, reason_parts
 
-    # Calculate smart money flow using the utility function
-    smart_money_flow_df = calculate_smart_money_flow(hist_df)
+    if latest_smart_money is None:
+        smart_money_flow_df = calculate_smart_money_flow(hist_df)
+        latest_smart_money = None if smart_money_flow_df.empty else smart_money_flow_df.iloc[-1]
 
-    if not smart_money_flow_df.empty:
-        latest_smart_money = smart_money_flow_df.iloc[-1]
-        
+    if latest_smart_money is not None:
         # Check for individual buyer power (e.g., individual_buy_power > 1)
         if latest_smart_money['individual_buy_power'] is not None and latest_smart_money['individual_buy_power'] > 1.2: # Example threshold
             satisfied_filters.append("Strong_Individual_Buy_Power")
@@ -261,8 +262,14 @@ def run_weekly_watchlist_selection():
 
     watchlist_candidates = []
     processed_symbols_count = 0
+    quarantined_ids = get_quarantined_symbol_ids()
+    latest_flows = get_latest_smart_money_flow()
 
     for symbol in symbols_to_analyze:
+        if symbol.symbol_id in quarantined_ids:
+            logger.debug(f"Skipping {symbol.symbol_name}: Quarantined by the data-quality checks.")
+            continue
+
         logger.info(f"Analyzing {symbol.symbol_name} ({symbol.symbol_id}) for Weekly Watchlist.")
 
         hist_df, technical_rec, fundamental_rec = _get_symbol_data_for_watchlist(symbol.symbol_id, symbol.symbol_name, lookback_days=TECHNICAL_DATA_LOOKBACK_DAYS)
@@ -288,7 +295,8 @@ def run_weekly_watchlist_selection():
             logger.debug(f"No fundamental data for {symbol.symbol_name}. Skipping fundamental filters.")
 
         # 3. Apply Smart Money Filters
-        smart_money_filters, smart_money_reasons = _check_smart_money_filters(hist_df)
+        smart_money_filters, smart_money_reasons = _check_smart_money_filters(
+            hist_df, latest_smart_money_flow(latest_flows, symbol.symbol_id, hist_df))
         all_satisfied_filters.extend(smart_money_filters)
         all_reason_parts.extend(smart_money_reasons)
 
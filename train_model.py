@@ -35,6 +35,8 @@ if SERVICES_PATH not in sys.path:
 try:
     from models import HistoricalData, ComprehensiveSymbolData 
     from utils import calculate_rsi, calculate_macd, calculate_sma, calculate_volume_ma, calculate_atr
+    from services.jalali_calendar import gregorian_to_jalali
+    from services.market_panel import load_market_panel
 except ImportError as e:
     logger.error(f"خطا در ایمپورت ماژول‌ها: {e}")
     logger.error("لطفاً مطمئن شوید models.py و services/utils.py در مسیرهای صحیح قرار دارند.")
@@ -133,59 +135,47 @@ def _perform_feature_engineering(df_symbol_hist, symbol_id_for_logging="N/A"):
 
     return features_df
 
+# --- ستون‌های stock_data مورد نیاز مهندسی ویژگی (به جای SELECT *) ---
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+TRAINING_COLUMNS = PRICE_COLUMNS + [
+    'volume', 'num_trades', 'buy_count_i', 'sell_count_i', 'buy_i_volume', 'sell_i_volume',
+    'zd1', 'qd1', 'pd1', 'zo1', 'qo1', 'po1',
+    'zd2', 'qd2', 'pd2', 'zo2', 'qo2', 'po2',
+    'zd3', 'qd3', 'pd3', 'zo3', 'qo3', 'po3',
+    'zd4', 'qd4', 'pd4', 'zo4', 'qo4', 'po4',
+    'zd5', 'qd5', 'pd5', 'zo5', 'qo5', 'po5',
+]
+
 # --- تابع اصلی ---
 def train_model():
-    logger.info("در حال اتصال به دیتابیس و بارگذاری داده‌ها به صورت دسته‌ای (chunked)...")
+    logger.info("در حال اتصال به دیتابیس و بارگذاری داده‌ها به صورت دسته‌ای (chunked) در پنل فشرده بازار...")
     
-    CHUNK_SIZE = 10000
-    all_chunks_df = []
+    CHUNK_SIZE = 50000
 
     try:
-        query = "SELECT * FROM stock_data ORDER BY symbol_id, date"
-        for chunk_df in pd.read_sql_query(query, engine, chunksize=CHUNK_SIZE):
-            logger.info(f"دسته جدید با {len(chunk_df)} ردیف بارگذاری شد.")
-            all_chunks_df.append(chunk_df)
+        # قیمت‌ها float32 و نماد/تاریخ به صورت کد عددی (services/market_panel.py)؛ ردیف‌هایی که قیمت یا حجم ندارند
+        # همان‌جا کنار گذاشته می‌شوند. ستون‌های عدد صحیح با keep_nulls مقدار NULL را NaN نگه می‌دارند تا مثل مسیر
+        # پیش‌بینی (ml_predictor) با ffill/bfill مهندسی ویژگی پر شوند، نه با 0.
+        panel = load_market_panel(engine, TRAINING_COLUMNS, required=PRICE_COLUMNS + ['volume'], keep_nulls=True,
+                                  chunksize=CHUNK_SIZE)
 
-        if not all_chunks_df:
+        if panel.empty:
             logger.error("داده تاریخی در دیتابیس یافت نشد. لطفاً ابتدا داده‌ها را جمع‌آوری کنید.")
             return
 
-        logger.info(f"تمام دسته‌ها با موفقیت بارگذاری شدند. در حال ادغام و پیش‌پردازش...")
-        df_hist = pd.concat(all_chunks_df, ignore_index=True)
-        
-        logger.info(f"تعداد کل نقاط داده تاریخی پس از واکشی: {len(df_hist)}")
-
-        df_hist['gregorian_date'] = pd.to_datetime(df_hist['date'])
-        
-        df_hist.drop(columns=['_sa_instance_state'], errors='ignore', inplace=True)
-        numeric_cols = ['open', 'high', 'low', 'close', 'final', 'yesterday_price', 'volume', 'value', 'num_trades',
-                         'plc', 'plp', 'pcc', 'pcp', 'mv',
-                         'buy_count_i', 'buy_count_n', 'sell_count_i', 'sell_count_n',
-                         'buy_i_volume', 'buy_n_volume', 'sell_i_volume', 'sell_n_volume',
-                         'zd1', 'qd1', 'pd1', 'zo1', 'qo1', 'po1',
-                         'zd2', 'qd2', 'pd2', 'zo2', 'qo2', 'po2',
-                         'zd3', 'qd3', 'pd3', 'zo3', 'qo3', 'po3',
-                         'zd4', 'qd4', 'pd4', 'zo4', 'qo4', 'po4',
-                         'zd5', 'qd5', 'pd5', 'zo5', 'qo5', 'po5']
-        for col in numeric_cols:
-            if col in df_hist.columns:
-                df_hist[col] = pd.to_numeric(df_hist[col], errors='coerce')
-        
-        initial_rows_count = len(df_hist)
-        df_hist.dropna(subset=['close', 'volume', 'high', 'low', 'open'], inplace=True)
-        logger.info(f"تعداد نقاط داده پس از پیش‌پردازش اولیه و حذف NaNهای اساسی: {len(df_hist)} (حذف شده: {initial_rows_count - len(df_hist)})")
+        logger.info(f"تعداد کل نقاط داده تاریخی پس از واکشی و حذف NaNهای اساسی: {len(panel)} "
+                    f"({len(panel.symbols)} نماد، {panel.nbytes / 2 ** 20:.1f} MiB در حافظه)")
 
         logger.info("در حال شروع مهندسی ویژگی‌ها...")
-        all_features_df = pd.DataFrame()
+        feature_frames = []
         skipped_symbols = []
 
-        for symbol_id in df_hist['symbol_id'].unique():
-            df_symbol = df_hist[df_hist['symbol_id'] == symbol_id].copy()
-            
+        for symbol_id, df_symbol in panel.symbol_frames():
             if len(df_symbol) < 60:
                 skipped_symbols.append(f"{symbol_id}: داده کافی ({len(df_symbol)} روز) برای محاسبه ویژگی‌ها وجود ندارد.")
                 continue
 
+            df_symbol = df_symbol.rename(columns={'date': 'gregorian_date'})
             features_df = _perform_feature_engineering(df_symbol, symbol_id_for_logging=symbol_id)
             
             if features_df.empty:
@@ -193,10 +183,12 @@ def train_model():
                 continue
 
             features_df['symbol_id'] = symbol_id
-            features_df['jdate'] = df_symbol.set_index('gregorian_date').loc[features_df.index, 'jdate']
+            features_df['jdate'] = gregorian_to_jalali(features_df.index)
             features_df['close_hist'] = df_symbol.set_index('gregorian_date').loc[features_df.index, 'close'] 
 
-            all_features_df = pd.concat([all_features_df, features_df], ignore_index=False)
+            feature_frames.append(features_df)
+
+        all_features_df = pd.concat(feature_frames) if feature_frames else pd.DataFrame()
         
         if skipped_symbols:
             logger.warning("نمادهای زیر به دلیل داده ناکافی یا نامعتبر پرش شدند:")
@@ -4,23 +4,37 @@
 import os
 import requests
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 import time
 import json
 import logging
 import jdatetime
+from sqlalchemy import tuple_
 
 # وارد کردن 'db' از extensions.py (به جای main.py)
 from extensions import db 
 # وارد کردن مدل‌های SQLAlchemy
 from models import HistoricalData, ComprehensiveSymbolData, SignalsPerformance, FundamentalData, SentimentData # اضافه شدن FundamentalData و SentimentData
+from services.http_client import get_http_client
+from services.db_utils import bulk_upsert
+from services.jalali_calendar import gregorian_to_jalali
+from services.data_fetch_and_process import reset_derived_history
 
 # --- تنظیمات لاگینگ (Logging Setup) ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- تنظیمات API ---
 BRES_API_KEY = os.getenv('BRES_API_KEY')
-BASE_URL = 'https://api.brsapi.ir/v1/'
+# BRSAPI_BASE_URL را می‌توان برای تست به یک سرور محلی (stub) اشاره داد
+BASE_URL = os.getenv('BRSAPI_BASE_URL', 'https://api.brsapi.ir/v1/')
+
+# همزمانی، سقف نرخ درخواست‌ها (درخواست در ثانیه) و تعداد نماد در هر commit
+BRSAPI_MAX_WORKERS = int(os.getenv('BRSAPI_MAX_WORKERS', 8))
+BRSAPI_RATE_LIMIT = float(os.getenv('BRSAPI_RATE_LIMIT', 4))
+BRSAPI_WRITE_BATCH_SIZE = int(os.getenv('BRSAPI_WRITE_BATCH_SIZE', 50))
+DB_BATCH_SIZE = 500
 
 if not BRES_API_KEY:
     logging.error("خطا: BRES_API_KEY در متغیرهای محیطی تنظیم نشده است! لطفا آن را در Replit (Secrets) تنظیم کنید.")
@@ -39,7 +53,7 @@ def fetch_data_from_brsapi(endpoint, params=None):
     }
     url = f"{BASE_URL}{endpoint}"
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = get_http_client().get(url, headers=headers, params=params, timeout=30)
         response.raise_for_status() # برای خطاهای HTTP (4xx or 5xx)
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -80,172 +94,200 @@ def get_comprehensive_symbol_data_from_brsapi(symbol_id):
 
 # --- توابع برای ذخیره داده‌ها در پایگاه داده (با SQLAlchemy) ---
 
-def save_historical_data_to_db(data):
-    """داده‌های تاریخی را در دیتابیس ذخیره یا به‌روزرسانی می‌کند."""
+# BRSAPI field -> stock_data column
+BRSAPI_HISTORY_FIELD_MAP = {
+    'SymbolName': 'symbol_name',
+    'Open': 'open',
+    'High': 'high',
+    'Low': 'low',
+    'Close': 'close',
+    'Final': 'final',
+    'Volume': 'volume',
+    'Value': 'value',
+    'NumberOfTrades': 'num_trades',
+    'YesterdayPrice': 'yesterday_price',
+}
+
+# BRSAPI field -> comprehensive_symbol_data column
+BRSAPI_SYMBOL_FIELD_MAP = {
+    'SymbolName': 'symbol_name',
+    'MarketType': 'market_type',
+    'Flow': 'flow',
+    'Industry': 'industry',
+    'Capital': 'capital',
+    'LegalShareHolderPercentage': 'legal_shareholder_percentage',
+    'RealShareHolderPercentage': 'real_shareholder_percentage',
+    'FloatShares': 'float_shares',
+    'BaseVolume': 'base_volume',
+    'GroupName': 'group_name',
+    'Description': 'description',
+    'CompanyName': 'company_name',
+    'ISIN': 'isin',
+}
+
+
+def _history_rows_to_records(data):
+    """ردیف‌های API را به دیکشنری‌های جدول stock_data تبدیل می‌کند (تاریخ میلادی به date و jdate با جدول تقویم)."""
     if not data:
-        return
-
-    records_to_add = []
-
-    existing_records = {}
-    symbol_date_pairs = [(str(row['SymbolId']), str(row['Date'])) for row in data]
-
-    if symbol_date_pairs:
-        # برای بهبود عملکرد، می‌توانیم رکوردهای موجود را در یک پرس‌وجوی دسته‌ای دریافت کنیم.
-        # اما برای تعداد زیاد جفت (symbol_id, date) این هنوز می‌تواند کند باشد.
-        # یک رویکرد جایگزین برای حجم بسیار بالا، استفاده از SQLite upsert (INSERT OR REPLACE)
-        # یا ابزارهای Bulk Insert/Update SQLAlchemy است.
-        # برای این مثال، ابتدا بررسی می‌کنیم و سپس اضافه یا به‌روز می‌کنیم.
-
-        # این بخش ممکن است در صورت بسیار بزرگ بودن symbol_date_pairs بهینه نباشد.
-        # راه حل قوی‌تر: بارگذاری تمام رکوردهای موجود برای نمادهای مرتبط در یک بازه زمانی.
-
-        # برای سادگی، فعلاً یک رویکرد کمتر بهینه اما کارآمد برای حجم متوسط داده را پیاده‌سازی می‌کنیم.
-        # می‌توانید این بخش را برای کارایی بیشتر در حجم بالا بازنویسی کنید.
-        for symbol_id, date in set(symbol_date_pairs): # استفاده از set برای جلوگیری از تکرار
-            record = db.session.query(HistoricalData).filter_by(symbol_id=symbol_id, date=date).first()
-            if record:
-                existing_records[(symbol_id, date)] = record
-
-    for row in data:
-        symbol_id = str(row['SymbolId'])
-        date = str(row['Date'])
-
-        existing_record = existing_records.get((symbol_id, date))
-
-        if existing_record:
-            # به‌روزرسانی رکورد موجود
-            existing_record.symbol_name = row['SymbolName']
-            existing_record.open = row['Open']
-            existing_record.high = row['High']
-            existing_record.low = row['Low']
-            existing_record.close = row['Close']
-            existing_record.final = row['Final']
-            existing_record.volume = row['Volume']
-            existing_record.value = row['Value']
-            existing_record.num_trades = row['NumberOfTrades']
-            existing_record.yesterday_price = row['YesterdayPrice']
-        else:
-            # ایجاد رکورد جدید
-            new_data = HistoricalData(
-                symbol_id=symbol_id,
-                symbol_name=row['SymbolName'],
-                date=date,
-                open=row['Open'],
-                high=row['High'],
-                low=row['Low'],
-                close=row['Close'],
-                final=row['Final'],
-                volume=row['Volume'],
-                value=row['Value'],
-                num_trades=row['NumberOfTrades'],
-                yesterday_price=row['YesterdayPrice']
-            )
-            records_to_add.append(new_data)
-
-    if records_to_add:
-        db.session.add_all(records_to_add)
-
+        return []
+    dates = pd.to_datetime([row.get('Date') for row in data], errors='coerce')
+    jdates = gregorian_to_jalali(dates)
+    records = {}
+    for row, gdate, jdate in zip(data, dates, jdates):
+        if pd.isna(gdate) or jdate is None:
+            logging.warning(f"ردیف با تاریخ نامعتبر نادیده گرفته شد: {row.get('SymbolId')} {row.get('Date')}")
+            continue
+        record = {'symbol_id': str(row['SymbolId']), 'date': gdate.date(), 'jdate': jdate}
+        for field, column in BRSAPI_HISTORY_FIELD_MAP.items():
+            record[column] = row.get(field)
+        records[(record['symbol_id'], record['date'])] = record  # از ردیف‌های تکراری، آخری نگه داشته می‌شود
+    return list(records.values())
+
+
+def save_historical_data_to_db(data, batch_size=DB_BATCH_SIZE):
+    """
+    داده‌های تاریخی را در دیتابیس ذخیره یا به‌روزرسانی می‌کند.
+    برای هر دسته، ردیف‌های موجود با یک پرس‌وجوی tuple IN خوانده می‌شوند و فقط ردیف‌های جدید
+    یا تغییرکرده با یک upsert دسته‌ای نوشته می‌شوند.
+    Returns: (تعداد ردیف جدید، تعداد ردیف به‌روزشده)
+    """
+    records = _history_rows_to_records(data)
+    if not records:
+        return 0, 0
+
+    value_columns = list(BRSAPI_HISTORY_FIELD_MAP.values())
+    new_count = updated_count = 0
+    rewritten_from = {} # نماد -> قدیمی‌ترین تاریخ ردیف نوشته‌شده
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        keys = [(record['symbol_id'], record['date']) for record in batch]
+        existing = {
+            (row.symbol_id, row.date): row
+            for row in db.session.query(HistoricalData.symbol_id, HistoricalData.date, *[getattr(HistoricalData, col) for col in value_columns])
+                                 .filter(tuple_(HistoricalData.symbol_id, HistoricalData.date).in_(keys)).all()
+        }
+        to_write = []
+        for record in batch:
+            current = existing.get((record['symbol_id'], record['date']))
+            if current is None:
+                new_count += 1
+            elif any(getattr(current, col) != record[col] for col in value_columns):
+                updated_count += 1
+            else:
+                continue
+            to_write.append(record)
+            symbol_id = record['symbol_id']
+            rewritten_from[symbol_id] = min(rewritten_from.get(symbol_id, record['date']), record['date'])
+        bulk_upsert(db.session, HistoricalData, to_write, index_elements=['symbol_id', 'date'])
+
+    # وضعیت‌هایی که ردیف اصلاح‌شده یا جاافتاده‌ای قبل از تاریخ آخرشان دارند دوباره از کل تاریخچه ساخته می‌شوند
+    reset_derived_history(db.session, rewritten_from)
     db.session.commit()
-    logging.info(f"{len(records_to_add)} رکورد جدید و {len(data) - len(records_to_add)} رکورد موجود در HistoricalData به‌روزرسانی/اضافه شد.")
+    logging.info(f"{new_count} رکورد جدید و {updated_count} رکورد موجود در HistoricalData اضافه/به‌روزرسانی شد "
+                 f"({len(records) - new_count - updated_count} رکورد بدون تغییر).")
+    return new_count, updated_count
+
+
+def save_comprehensive_symbols_to_db(items):
+    """داده‌های جامع چند نماد را با یک upsert دسته‌ای (کلید symbol_id) ذخیره یا به‌روزرسانی می‌کند."""
+    records = {}
+    for data in items or []:
+        if not data:
+            continue
+        record = {'symbol_id': str(data['SymbolId'])}
+        for field, column in BRSAPI_SYMBOL_FIELD_MAP.items():
+            record[column] = data.get(field)
+        records[record['symbol_id']] = record
+    if not records:
+        return 0
+    written = bulk_upsert(db.session, ComprehensiveSymbolData, list(records.values()), index_elements=['symbol_id'])
+    db.session.commit()
+    return written
 
 
 def save_comprehensive_symbol_data_to_db(data):
     """داده‌های جامع نماد را در دیتابیس ذخیره یا به‌روزرسانی می‌کند."""
     if not data:
         return
+    save_comprehensive_symbols_to_db([data])
+    logging.info(f"داده‌های جامع نماد {data['SymbolId']} ذخیره/به‌روزرسانی شد.")
 
-    symbol_id = str(data['SymbolId'])
-
-    existing_data = db.session.query(ComprehensiveSymbolData).filter_by(symbol_id=symbol_id).first()
-
-    if existing_data:
-        existing_data.symbol_name = data['SymbolName']
-        existing_data.market_type = data.get('MarketType')
-        existing_data.flow = data.get('Flow')
-        existing_data.industry = data.get('Industry')
-        existing_data.capital = data.get('Capital')
-        existing_data.legal_shareholder_percentage = data.get('LegalShareHolderPercentage')
-        existing_data.real_shareholder_percentage = data.get('RealShareHolderPercentage')
-        existing_data.float_shares = data.get('FloatShares')
-        existing_data.base_volume = data.get('BaseVolume')
-        existing_data.group_name = data.get('GroupName')
-        existing_data.description = data.get('Description')
-        existing_data.company_name = data.get('CompanyName')
-        existing_data.isin = data.get('ISIN')
-        logging.info(f"داده‌های جامع نماد {symbol_id} به‌روزرسانی شد.")
-    else:
-        new_data = ComprehensiveSymbolData(
-            symbol_id=symbol_id,
-            symbol_name=data['SymbolName'],
-            market_type=data.get('MarketType'),
-            flow=data.get('Flow'),
-            industry=data.get('Industry'),
-            capital=data.get('Capital'),
-            legal_shareholder_percentage=data.get('LegalShareHolderPercentage'),
-            real_shareholder_percentage=data.get('RealShareHolderPercentage'),
-            float_shares=data.get('FloatShares'),
-            base_volume=data.get('BaseVolume'),
-            group_name=data.get('GroupName'),
-            description=data.get('Description'),
-            company_name=data.get('CompanyName'),
-            isin=data.get('ISIN')
-        )
-        db.session.add(new_data)
-        logging.info(f"داده‌های جامع نماد {symbol_id} جدید درج شد.")
 
-    db.session.commit()
+def _fetch_symbol_from_brsapi(symbol_id, start_date, end_date):
+    """مرحله شبکه برای یک نماد (در نخ کارگر اجرا می‌شود و به پایگاه داده دسترسی ندارد)."""
+    historical_data = get_daily_historical_data_from_brsapi(symbol_id, start_date, end_date)
+    comprehensive_data = get_comprehensive_symbol_data_from_brsapi(symbol_id)
+    return historical_data, comprehensive_data
 
 
-def update_all_stock_data_daily():
-    """تابع اصلی برای به‌روزرسانی تمام داده‌های سهام."""
+def update_all_stock_data_daily(max_workers=None, rate_limit=None, days_back=3, write_batch_size=None):
+    """
+    تابع اصلی برای به‌روزرسانی تمام داده‌های سهام.
+    درخواست‌های همه نمادها به‌صورت همزمان (ThreadPool) و با سقف نرخ BRSAPI_RATE_LIMIT ارسال می‌شوند
+    و نخ فراخواننده تنها نویسنده پایگاه داده است که هر write_batch_size نماد را یک‌جا ذخیره می‌کند.
+    Returns: تعداد نمادهای پردازش‌شده
+    """
     if not BRES_API_KEY:
         logging.error("BRS_API_KEY تنظیم نشده است. به‌روزرسانی داده متوقف شد.")
-        return
+        return 0
 
-    logging.info("شروع به‌روزرسانی روزانه داده‌های سهام...")
+    max_workers = max_workers or BRSAPI_MAX_WORKERS
+    rate_limit = rate_limit or BRSAPI_RATE_LIMIT
+    write_batch_size = write_batch_size or BRSAPI_WRITE_BATCH_SIZE
+    get_http_client().set_host_limit(urlsplit(BASE_URL).hostname, rate_limit)
+
+    logging.info(f"شروع به‌روزرسانی روزانه داده‌های سهام (workers={max_workers}, rate_limit={rate_limit}/s)...")
 
     all_symbols = get_all_symbols_from_brsapi()
     if not all_symbols:
         logging.error("هیچ نمادی برای به‌روزرسانی یافت نشد. اتمام به‌روزرسانی.")
-        return
-
-    symbols_to_process = all_symbols[:100] # فقط 100 نماد اول را برای تست پردازش می‌کنیم
+        return 0
 
     today_miladi = datetime.now()
-    start_date = today_miladi - timedelta(days=3)
+    start_date = today_miladi - timedelta(days=days_back)
 
     total_symbols_processed = 0
+    pending_history, pending_symbols, symbols_in_batch = [], [], 0
 
-    for symbol in symbols_to_process:
-        symbol_id = symbol['SymbolId']
-        symbol_name = symbol['SymbolName']
-
+    def _flush():
+        nonlocal pending_history, pending_symbols, symbols_in_batch, total_symbols_processed
         try:
-            # --- دریافت و ذخیره داده‌های تاریخی ---
-            historical_data = get_daily_historical_data_from_brsapi(symbol_id, start_date, today_miladi)
+            save_historical_data_to_db(pending_history)
+            save_comprehensive_symbols_to_db(pending_symbols)
+            total_symbols_processed += symbols_in_batch
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"خطا در ذخیره دسته {symbols_in_batch} نماد: {e}")
+        pending_history, pending_symbols, symbols_in_batch = [], [], 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='brsapi') as pool:
+        futures = {
+            pool.submit(_fetch_symbol_from_brsapi, symbol['SymbolId'], start_date, today_miladi): symbol
+            for symbol in all_symbols
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            symbol_id, symbol_name = symbol['SymbolId'], symbol['SymbolName']
+            try:
+                historical_data, comprehensive_data = future.result()
+            except Exception as e:
+                logging.error(f"خطا در پردازش نماد {symbol_name} ({symbol_id}): {e}")
+                continue
+
             if historical_data:
-                save_historical_data_to_db(historical_data)
-                logging.info(f"داده‌های تاریخی برای {symbol_name} ({symbol_id}) با موفقیت به‌روزرسانی شد.")
+                pending_history.extend(historical_data)
             else:
                 logging.warning(f"داده تاریخی برای {symbol_name} ({symbol_id}) در بازه مشخص شده یافت نشد.")
-            time.sleep(0.5)
-
-            # --- دریافت و ذخیره داده‌های جامع نماد ---
-            comprehensive_data = get_comprehensive_symbol_data_from_brsapi(symbol_id)
             if comprehensive_data:
-                save_comprehensive_symbol_data_to_db(comprehensive_data)
-                logging.info(f"داده‌های جامع برای {symbol_name} ({symbol_id}) با موفقیت به‌روزرسانی شد.")
+                pending_symbols.append(comprehensive_data)
             else:
                 logging.warning(f"داده جامع برای {symbol_name} ({symbol_id}) یافت نشد.")
-            time.sleep(0.5)
-
-            total_symbols_processed += 1
 
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f"خطا در پردازش نماد {symbol_name} ({symbol_id}): {e}")
-        finally:
-            db.session.remove() # مهم برای آزاد کردن منابع
+            symbols_in_batch += 1
+            if symbols_in_batch >= write_batch_size:
+                _flush()
+    if symbols_in_batch:
+        _flush()
 
-    logging.info(f"به‌روزرسانی روزانه داده‌های سهام به پایان رسید. {total_symbols_processed} نماد پردازش شد.")
\ No newline at end of file
+    logging.info(f"به‌روزرسانی روزانه داده‌های سهام به پایان رسید. {total_symbols_processed} نماد از {len(all_symbols)} پردازش شد.")
+    return total_symbols_processed